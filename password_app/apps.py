@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Put SQLite databases in write-ahead-log mode, so readers no longer block the writer,
+    which matters once requests run concurrently (threads under WSGI, async views under ASGI).
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
 
 
 class PasswordAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'password_app'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite, dispatch_uid='password_app.configure_sqlite')
@@ -0,0 +1,143 @@
+import hmac
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from password_manager import settings
+from password_manager.db_router import replica_view, vault_db
+from password_manager.async_views import AsyncAPIView
+from password_manager.utility import (acheck_password_strength,
+                                      astream_vault_entries,
+                                      generate_password,
+                                      decrypt_password,
+                                      decrypt_passwords,
+                                      encrypt_password)
+from .models import PasswordVault, PendingNotification, VaultVersion
+from .serializers import PasswordSerializer
+from .notifications import queue_notification
+from .vault_cache import vault_page_cache
+from .views import VAULT_ENTRY_FIELDS, vault_etag, is_not_modified, with_etag
+
+# Async versions of the add, view-all and update endpoints, selected with ASYNC_VIEWS=True.
+# Each one keeps the request and response contract of its counterpart in password_app.views.
+
+def save_and_notify(entry, event, **save_kwargs):
+    """Save a vault entry and queue its notification in one transaction; run through sync_to_async."""
+    with transaction.atomic(using=vault_db(entry.user_id)):
+        entry.save(**save_kwargs)
+        queue_notification(entry.user, event, entry.website_name)
+
+class AsyncAddPassword(AsyncAPIView):
+    """
+    Async version of AddPassword. The breach check awaits the async HIBP client, so no worker
+    thread waits on the network; the entry and its notification are written in one transaction
+    in a worker thread.
+
+    Parameters:
+    - request (HttpRequest): HTTP request object containing password entry data.
+    - autogenerate (str): Optional query parameter indicating whether to autogenerate a password.
+    Return: JsonResponse: JSON response indicating the success or failure of the password addition.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        autogenerate = request.GET.get('autogenerate')
+        data = request.data
+        data['website_name'] = data['website_name'].lower()
+        duplicate_error = {"Error": f"Passwords for '{data['website_name']}' already exist. Consider updating the existing password for enhanced security."}
+        if await PasswordVault.objects.filter(user=request.user, website_name=data['website_name']).aexists():
+            raise ValidationError(duplicate_error)
+
+        if autogenerate:
+            data['password'] = generate_password()
+
+        serializer = PasswordSerializer(data=data)
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+        resultant_data = await acheck_password_strength(serializer.validated_data)
+        if isinstance(resultant_data, JsonResponse):
+            return resultant_data
+        try:
+            await sync_to_async(save_and_notify)(PasswordVault(user=request.user, **resultant_data), PendingNotification.ADDED, force_insert=True)
+        except IntegrityError:
+            # A concurrent request added the same website between the exists() check and the insert.
+            raise ValidationError(duplicate_error)
+        return JsonResponse({"Message": f"Password for {resultant_data['website_name']} has been added successfully"}, status=status.HTTP_201_CREATED)
+
+class AsyncViewAllPassword(AsyncAPIView):
+    """
+    Async version of ViewAllPassword, with the same paging, streaming, ETag and page cache behaviour.
+
+    Parameters:
+    - request (HttpRequest): HTTP GET request object.
+    - cursor (str): Optional query parameter, the 'next_cursor' value of the previous page.
+    - page_size (str): Optional query parameter, number of entries per page.
+    - stream (str): Optional query parameter, 'json' or 'ndjson' to stream the whole vault.
+
+    Return: JsonResponse: A page of password entries and the cursor of the next page,
+    or a StreamingHttpResponse fed by an async iterator.
+    """
+
+    @replica_view
+    async def get(self, request, *args, **kwargs):
+        current_user = request.user.username
+        version = await VaultVersion.objects.filter(user_id=request.user.id).values_list('version', flat=True).afirst() or 0
+        etag = vault_etag(request.user, version)
+        if is_not_modified(request, etag):
+            return with_etag(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), etag)
+        all_entries = PasswordVault.objects.filter(user=request.user).order_by('id').values(*VAULT_ENTRY_FIELDS)
+
+        output_format = request.GET.get('stream')
+        if output_format:
+            if output_format not in ('json', 'ndjson'):
+                return JsonResponse({"Error": "stream must be either 'json' or 'ndjson'"}, status=status.HTTP_400_BAD_REQUEST)
+            content_type = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+            # The body is read after the view returns, so bind it to the database picked for this request.
+            rows = astream_vault_entries(all_entries.using(all_entries.db), output_format, settings.VAULT_STREAM_CHUNK_SIZE, current_user)
+            return with_etag(StreamingHttpResponse(rows, content_type=content_type), etag)
+
+        try:
+            cursor = int(request.GET.get('cursor', 0))
+            page_size = int(request.GET.get('page_size', settings.VAULT_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({"Error": "cursor and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = max(1, min(page_size, settings.VAULT_MAX_PAGE_SIZE))
+
+        async def load_page():
+            page = [data async for data in all_entries.filter(id__gt=cursor)[:page_size + 1]]
+            next_cursor = page[page_size - 1]['id'] if len(page) > page_size else None
+            return page[:page_size], next_cursor
+
+        page, next_cursor = await vault_page_cache.aget_page(request.user.id, version, cursor, page_size, load_page)
+        passwords = decrypt_passwords([data['password'] for data in page])
+        for data, password in zip(page, passwords):
+            data['user'] = current_user
+            data['password'] = password
+        return with_etag(JsonResponse({"results": page, "next_cursor": next_cursor, "version": version}), etag)
+
+class AsyncUpdatePassword(AsyncAPIView):
+    """
+    Async version of UpdatePassword.
+    It expects 'old_password', 'new_password', 'website_name', and 'website_url' keys in the request data.
+
+    Parameters:
+    - request (HttpRequest): HTTP POST request object.
+
+    Returns: JsonResponse: JSON response indicating the status of the password update request.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        data = request.data
+        if 'old_password' not in data.keys() or 'new_password' not in data.keys():
+            return JsonResponse({"Error": "old_password/new_password key is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_info = await PasswordVault.objects.aget(user=request.user, website_name=data['website_name'], website_url=data['website_url'])
+        except PasswordVault.DoesNotExist:
+            return JsonResponse({"Error": "Invalid data provided. Please ensure that the input is accurate and complete."}, status=status.HTTP_404_NOT_FOUND)
+        if not hmac.compare_digest(decrypt_password(user_info.password).encode('utf-8'), str(data['old_password']).encode('utf-8')):
+            return JsonResponse({"Error": "Old password does not match."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_info.password = encrypt_password(data['new_password'])
+        user_info.user = request.user
+        await sync_to_async(save_and_notify)(user_info, PendingNotification.UPDATED, update_fields=['password', 'updated_at'])
+        return JsonResponse({"Message": f"Password for {data['website_name']} updated successfully."}, status=status.HTTP_200_OK)
@@ -0,0 +1,116 @@
+import hmac
+from django.db import transaction
+from django.utils import timezone
+from password_manager.db_router import vault_db
+from password_manager.utility import (is_weak_password,
+                                      pwned_passwords,
+                                      encrypt_passwords,
+                                      decrypt_passwords)
+from .models import PasswordVault, PendingNotification, VaultVersion
+from .importers import PASSWORD_MAX_LENGTH
+
+UPDATE = 'update'
+DELETE = 'delete'
+OPERATIONS = (UPDATE, DELETE)
+NOT_APPLIED = "Not applied because other operations in the batch failed."
+
+def _validate(operation, seen):
+    """Return the error of an operation that is malformed on its own, or None."""
+    if not isinstance(operation, dict):
+        return "Each operation must be an object."
+    if operation.get('op') not in OPERATIONS:
+        return "op must be either 'update' or 'delete'."
+    website_name = operation.get('website_name')
+    if not isinstance(website_name, str) or not website_name:
+        return "website_name is required."
+    if website_name in seen:
+        return f"'{website_name}' appears more than once in the batch."
+    seen.add(website_name)
+    if operation['op'] == UPDATE:
+        if not isinstance(operation.get('old_password'), str) or not isinstance(operation.get('new_password'), str):
+            return "old_password/new_password key is required"
+        if not operation['new_password'] or len(operation['new_password']) > PASSWORD_MAX_LENGTH:
+            return f"new_password must be between 1 and {PASSWORD_MAX_LENGTH} characters."
+        if is_weak_password(operation['new_password'], [website_name]):
+            return "Password does not meet the minimum strength criteria."
+    return None
+
+def apply_vault_batch(user, operations, atomic=True):
+    """
+    Apply a list of update and delete operations to a user's vault.
+
+    Operations are validated first, and new passwords are checked for breaches with each
+    SHA-1 prefix fetched once. The entries are then resolved with a single IN query and
+    locked. Updates are written with one bulk_update under one new vault version, deletes
+    with one delete, and the updates are queued for a single digest email. Everything runs
+    in one transaction. With atomic=True no operation is applied if any of them fails;
+    otherwise the valid ones are applied and the others reported.
+
+    Parameters:
+    - user (User): Owner of the vault.
+    - operations (list): Dicts with 'op' ('update' or 'delete') and 'website_name', plus
+      'old_password' and 'new_password' for updates and an optional 'website_url' to match.
+    - atomic (bool): Whether one failed operation rejects the whole batch.
+    Returns: tuple: (applied, results) where applied tells whether any change was written and
+    results has one dict per operation with 'index', 'op', 'website_name', 'status' and 'error'.
+    """
+    results, seen = [], set()
+    for index, operation in enumerate(operations):
+        error = _validate(operation, seen)
+        results.append({"index": index,
+                        "op": operation.get('op') if isinstance(operation, dict) else None,
+                        "website_name": operation.get('website_name') if isinstance(operation, dict) else None,
+                        "status": "error" if error else None,
+                        "error": error})
+
+    updates = [result for result in results if result['status'] is None and result['op'] == UPDATE]
+    if atomic and any(result['status'] for result in results):
+        updates = []
+    for result, is_breached in zip(updates, pwned_passwords([operations[result['index']]['new_password'] for result in updates])):
+        if is_breached is None:
+            result['status'], result['error'] = "error", "Breach check unavailable."
+        elif is_breached:
+            result['status'], result['error'] = "error", "Password has been identified in security breaches."
+
+    with transaction.atomic(using=vault_db(user.id)):
+        pending = [result for result in results if result['status'] is None]
+        if atomic and len(pending) < len(results):
+            pending = []
+        entries = {entry.website_name: entry
+                   for entry in PasswordVault.objects.select_for_update().filter(user=user, website_name__in=[result['website_name'] for result in pending])}
+        for result in pending:
+            entry = entries.get(result['website_name'])
+            website_url = operations[result['index']].get('website_url')
+            if entry is None or (website_url is not None and website_url != entry.website_url):
+                result['status'], result['error'] = "error", f"No password found for {result['website_name']}"
+
+        updates = [result for result in pending if result['status'] is None and result['op'] == UPDATE]
+        current_passwords = decrypt_passwords([entries[result['website_name']].password for result in updates])
+        for result, current_password in zip(updates, current_passwords):
+            if not hmac.compare_digest(current_password.encode('utf-8'), operations[result['index']]['old_password'].encode('utf-8')):
+                result['status'], result['error'] = "error", "Old password does not match."
+
+        applied = [result for result in pending if result['status'] is None]
+        if atomic and len(applied) < len(results):
+            applied = []
+        for result in applied:
+            result['status'] = "updated" if result['op'] == UPDATE else "deleted"
+        updates = [result for result in applied if result['op'] == UPDATE]
+        deletes = [result for result in applied if result['op'] == DELETE]
+        if updates:
+            version, now = VaultVersion.next_for(user.id), timezone.now()
+            updated_entries = [entries[result['website_name']] for result in updates]
+            for entry, password in zip(updated_entries, encrypt_passwords([operations[result['index']]['new_password'] for result in updates])):
+                entry.password, entry.version, entry.updated_at = password, version, now
+            PasswordVault.objects.bulk_update(updated_entries, ['password', 'version', 'updated_at'])
+            PendingNotification.objects.bulk_create(PendingNotification(user=user, event=PendingNotification.UPDATED, website_name=entry.website_name)
+                                                    for entry in updated_entries)
+        if deletes:
+            PasswordVault.objects.filter(id__in=[entries[result['website_name']].id for result in deletes]).delete()
+
+    for result in results:
+        if result['status'] is None:
+            result['status'], result['error'] = "skipped", NOT_APPLIED
+        if result['error'] is None:
+            del result['error']
+    return bool(applied), results
@@ -0,0 +1,293 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import tempfile
+import threading
+import statistics
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from password_manager import settings, hibp
+from password_manager.db_router import shard_for_user
+from password_manager.utility import encrypt_passwords, decrypt_password, generate_password
+from .models import PasswordVault, VaultSearchTerm, VaultVersion
+
+BENCHMARK_PASSWORD = 'Bench!Passw0rd#2024'
+BENCHMARK_HOST = 'localhost'
+
+def seed_vault(users, entries, prefix='bench', batch_size=1000):
+    """
+    Create users and vault entries for benchmarking.
+
+    All users share BENCHMARK_PASSWORD, hashed once. Passwords are encrypted with the
+    batch engine and rows are written with bulk_create, so seeding large vaults is quick.
+    Each vault is written to the user's shard.
+
+    Parameters:
+    - users (int): Number of users to create.
+    - entries (int): Number of vault entries per user.
+    - prefix (str): Prefix of the generated usernames, '<prefix>_user_<n>'.
+    - batch_size (int): Rows per bulk_create call.
+    Returns: list: The created users.
+    """
+    password_hash = make_password(BENCHMARK_PASSWORD)
+    created = User.objects.bulk_create(
+        [User(username=f"{prefix}_user_{number}", email=f"{prefix}_user_{number}@example.com", password=password_hash)
+         for number in range(users)], batch_size=batch_size)
+    # bulk_create only returns primary keys on backends that support it, so reload the users.
+    created = list(User.objects.filter(username__in=[user.username for user in created]).order_by('id'))
+
+    pending = {}
+    for user in created:
+        shard = shard_for_user(user.id)
+        passwords = encrypt_passwords([generate_password() for _ in range(entries)])
+        version = VaultVersion.next_for(user.id, using=shard)
+        pending.setdefault(shard, []).extend(
+            PasswordVault(user=user, website_name=f"site{number}", website_url=f"https://site{number}.example.com", password=password, version=version)
+            for number, password in enumerate(passwords))
+        if len(pending[shard]) >= batch_size:
+            VaultSearchTerm.reindex(PasswordVault.objects.using(shard).bulk_create(pending.pop(shard), batch_size=batch_size), using=shard, replace=False)
+    for shard, rows in pending.items():
+        VaultSearchTerm.reindex(PasswordVault.objects.using(shard).bulk_create(rows, batch_size=batch_size), using=shard, replace=False)
+    return created
+
+class _StubRangeHandler(BaseHTTPRequestHandler):
+    """Answer /range/<prefix> like the Pwned Passwords API, with a fixed set of suffixes that never match a real password."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests += 1
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            prefix = self.path.rsplit('/', 1)[-1].upper()
+            body = "".join(f"{hashlib.sha1(f'{prefix}{number}'.encode()).hexdigest()[5:].upper()}:{number + 1}\r\n"
+                           for number in range(800)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # A client that timed out and hung up is expected, not an error of the stub.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_stub_hibp(delay=0):
+    """
+    Start a stub Pwned Passwords range server on a free localhost port, in a daemon thread.
+
+    Parameters: delay (float): Seconds every response is held back, to simulate a slow upstream.
+    Returns: ThreadingHTTPServer: The server; its 'requests' and 'max_in_flight' attributes count
+    the calls received and the most calls handled at once. Call shutdown() and server_close() when done.
+    """
+    server = _StubServer(('127.0.0.1', 0), _StubRangeHandler)
+    server.delay = delay
+    server.lock = threading.Lock()
+    server.in_flight = server.max_in_flight = server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@contextmanager
+def local_services():
+    """
+    Replace external services with local stand-ins for the duration of a benchmark.
+
+    - HIBP: a stub HTTP server on localhost; the breach index and range cache point to a fresh temporary directory.
+    - SMTP: Django's locmem email backend.
+    - Storage: the local storage backend below the temporary directory.
+    - Celery: tasks run eagerly in the calling process.
+    - Login throttling is off.
+    """
+    from password_manager.celery import app
+    server = start_stub_hibp()
+    overrides = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stand_ins = {
+            'HIBP_API_URL': f"http://127.0.0.1:{server.server_port}",
+            'HIBP_FAIL_OPEN': False,
+            'BREACH_INDEX_PATH': os.path.join(temp_dir, 'breach_index.bin'),
+            'BREACH_RANGE_CACHE_DIR': os.path.join(temp_dir, 'ranges'),
+            'REPORT_STORAGE_BACKEND': 'local',
+            'REPORT_STORAGE_ROOT': os.path.join(temp_dir, 'reports'),
+            # Benchmarks log many users in from one address.
+            'LOGIN_THROTTLE_ENABLED': False,
+        }
+        for name, value in stand_ins.items():
+            overrides[name] = getattr(settings, name)
+            setattr(settings, name, value)
+        previous_client, hibp._client = hibp._client, None
+        always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        try:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                                   ALLOWED_HOSTS=[BENCHMARK_HOST]):
+                yield
+        finally:
+            app.conf.task_always_eager = always_eager
+            hibp._client = previous_client
+            for name, value in overrides.items():
+                setattr(settings, name, value)
+            server.shutdown()
+            server.server_close()
+
+def _percentile(latencies, percent):
+    if len(latencies) == 1:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method='inclusive')[percent - 1]
+
+class BenchmarkRunner:
+    """
+    Run scripted API scenarios through the Django test client and collect
+    throughput, p50/p95/p99 latency and database query counts per scenario.
+    """
+
+    def __init__(self, users, iterations, seed=0):
+        self.users = users
+        self.iterations = iterations
+        self.random = random.Random(seed)
+        self.client = Client(HTTP_HOST=BENCHMARK_HOST)
+        self.tokens = {}
+        self.added = {}
+
+    def _token(self, user):
+        if user.id not in self.tokens:
+            response = self.client.post('/api/user/login', {'username': user.username, 'password': BENCHMARK_PASSWORD}, content_type='application/json')
+            self.tokens[user.id] = response.json()['access']
+        return self.tokens[user.id]
+
+    def _auth(self, user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {self._token(user)}"}
+
+    def _scenario_register(self, number):
+        username = f"bench_register_{number}"
+        return 'post', '/api/user/register', {
+            'data': {'username': username, 'first_name': 'Bench', 'last_name': 'User', 'email': f"{username}@example.com",
+                     'password': BENCHMARK_PASSWORD, 'confirm_password': BENCHMARK_PASSWORD},
+            'content_type': 'application/json'}
+
+    def _scenario_login(self, number):
+        user = self.random.choice(self.users)
+        return 'post', '/api/user/login', {'data': {'username': user.username, 'password': BENCHMARK_PASSWORD}, 'content_type': 'application/json'}
+
+    def _add(self, number, autogenerate):
+        user = self.random.choice(self.users)
+        website_name = f"bench-{'auto' if autogenerate else 'manual'}-{number}"
+        self.added.setdefault(user.id, []).append(website_name)
+        data = {'website_name': website_name, 'website_url': f"https://{website_name}.example.com"}
+        if not autogenerate:
+            data['password'] = generate_password()
+        return 'post', '/api/password/add?autogenerate=true' if autogenerate else '/api/password/add', {
+            'data': data, 'content_type': 'application/json', **self._auth(user)}
+
+    def _scenario_add(self, number):
+        return self._add(number, autogenerate=False)
+
+    def _scenario_add_autogenerate(self, number):
+        return self._add(number, autogenerate=True)
+
+    def _scenario_all(self, number):
+        user = self.random.choice(self.users)
+        return 'get', '/api/password/all', {**self._auth(user)}
+
+    def _scenario_search(self, number):
+        user = self.random.choice(self.users)
+        return 'get', f"/api/password/search?q=site{self.random.randrange(100)}&mode=prefix", {**self._auth(user)}
+
+    def _scenario_update(self, number):
+        user = self.random.choice(self.users)
+        entry = PasswordVault.objects.using(shard_for_user(user.id)).filter(user=user).order_by('?').values('website_name', 'website_url', 'password').first()
+        return 'post', '/api/password/update', {
+            'data': {'website_name': entry['website_name'], 'website_url': entry['website_url'],
+                     'old_password': decrypt_password(entry['password']), 'new_password': generate_password()},
+            'content_type': 'application/json', **self._auth(user)}
+
+    def _scenario_delete(self, number):
+        candidates = [user for user in self.users if self.added.get(user.id)]
+        user = self.random.choice(candidates) if candidates else self.random.choice(self.users)
+        website_name = self.added[user.id].pop() if candidates else f"site{number}"
+        return 'get', f"/api/password/delete?website_name={website_name}", {**self._auth(user)}
+
+    SCENARIOS = ('register', 'login', 'add', 'add_autogenerate', 'all', 'search', 'update', 'delete')
+
+    def run(self, name):
+        """
+        Run one scenario for `iterations` requests.
+
+        Request preparation (picking a user, logging in, reading the entry to update)
+        happens outside the timed section and is not counted in the queries.
+
+        Parameters: name (str): One of SCENARIOS.
+        Returns: dict: Requests, errors, throughput, latency percentiles in ms and query counts.
+        """
+        build = getattr(self, f"_scenario_{name}")
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        timed = 0.0
+        for number in range(self.iterations):
+            method, path, kwargs = build(number)
+            data = kwargs.pop('data', None)
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                response = getattr(self.client, method)(path, data, **kwargs) if data is not None else getattr(self.client, method)(path, **kwargs)
+                elapsed = time.perf_counter() - request_started
+            timed += elapsed
+            latencies.append(elapsed * 1000)
+            queries.append(len(context.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+        return {
+            'requests': self.iterations,
+            'errors': errors,
+            'throughput_rps': round(self.iterations / timed, 1) if timed else None,
+            'wall_seconds': round(time.perf_counter() - started, 3),
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+def compare_results(baseline, current, max_regression):
+    """
+    Compare two benchmark results and list the regressions.
+
+    A scenario regresses when its p95 latency grows by more than `max_regression`
+    percent, or when it runs more database queries per request than before.
+
+    Parameters:
+    - baseline (dict): Scenario results of the reference run.
+    - current (dict): Scenario results of this run.
+    - max_regression (float): Allowed p95 growth in percent.
+    Returns: list: Human readable descriptions of the regressions.
+    """
+    regressions = []
+    for name, result in current.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if reference['p95_ms'] and result['p95_ms'] > reference['p95_ms'] * (1 + max_regression / 100):
+            regressions.append(f"{name}: p95 {reference['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result['queries_max'] > reference['queries_max']:
+            regressions.append(f"{name}: queries per request {reference['queries_max']} -> {result['queries_max']}")
+    return regressions
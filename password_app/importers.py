@@ -0,0 +1,196 @@
+import csv
+import json
+from urllib.parse import urlsplit
+from django.db import transaction, IntegrityError
+from django.core.validators import URLValidator
+from django.core.exceptions import ValidationError
+from password_manager import settings
+from password_manager.db_router import user_shard, vault_db
+from password_manager.utility import (is_weak_password,
+                                      pwned_passwords,
+                                      encrypt_passwords,
+                                      decrypt_passwords)
+from .models import PasswordVault, VaultSearchTerm, VaultVersion
+
+# Header aliases covering the CSV exports of Chrome (name,url,username,password),
+# Firefox (url,username,password,httpRealm,...), Bitwarden (name,login_uri,login_password,...)
+# and 1Password (Title,Url,Username,Password,...).
+NAME_COLUMNS = ('name', 'title')
+URL_COLUMNS = ('url', 'login_uri', 'website')
+PASSWORD_COLUMNS = ('password', 'login_password')
+
+WEBSITE_NAME_MAX_LENGTH = PasswordVault._meta.get_field('website_name').max_length
+PASSWORD_MAX_LENGTH = 100
+validate_url = URLValidator()
+
+def _column(header, aliases):
+    for alias in aliases:
+        if alias in header:
+            return header.index(alias)
+    return None
+
+def _cell(row, column):
+    return row[column] if column is not None and column < len(row) else ''
+
+def iter_csv_export(upload):
+    """
+    Read a browser or password manager CSV export line by line.
+
+    Parameters: upload (UploadedFile): Uploaded CSV file.
+    Yields: tuple: (name, url, password) for every data row.
+    Raises: ValueError: If the header has no url or password column.
+    """
+    reader = csv.reader(line.decode('utf-8-sig') for line in upload)
+    header = [column.strip().lower() for column in next(reader, [])]
+    name_column = _column(header, NAME_COLUMNS)
+    url_column = _column(header, URL_COLUMNS)
+    password_column = _column(header, PASSWORD_COLUMNS)
+    if url_column is None or password_column is None:
+        raise ValueError("Unrecognised export format: a url and a password column are required.")
+    for row in reader:
+        if not any(row):
+            continue
+        yield _cell(row, name_column).strip(), _cell(row, url_column).strip(), _cell(row, password_column)
+
+def iter_json_export(upload):
+    """
+    Read a Bitwarden JSON export.
+
+    Parameters: upload (UploadedFile): Uploaded JSON file.
+    Yields: tuple: (name, url, password) for every login item.
+    Raises: ValueError: If the file is not a Bitwarden export.
+    """
+    try:
+        items = json.load(upload).get('items')
+    except (ValueError, AttributeError):
+        items = None
+    if not isinstance(items, list):
+        raise ValueError("Unrecognised export format: expected a Bitwarden JSON export with an 'items' list.")
+    for item in items:
+        login = item.get('login') or {}
+        uris = login.get('uris') or [{}]
+        yield (item.get('name') or '').strip(), (uris[0].get('uri') or '').strip(), login.get('password') or ''
+
+def parse_export(upload):
+    """
+    Parse an uploaded export into rows ready for import, validating each one.
+
+    Rows are numbered from 1 in file order. Invalid rows are reported instead of
+    raising, so one bad entry does not reject the whole upload.
+
+    Parameters: upload (UploadedFile): Uploaded CSV or JSON export.
+    Returns: tuple: (rows, report) where rows are dicts with 'row', 'website_name',
+    'website_url' and the plain 'password', and report lists the rejected rows.
+    Raises: ValueError: If the file format is not recognised.
+    """
+    entries = iter_json_export(upload) if upload.name.lower().endswith('.json') else iter_csv_export(upload)
+    rows, report, seen = [], [], set()
+    for number, (name, url, password) in enumerate(entries, start=1):
+        if url and '://' not in url:
+            url = f"https://{url}"
+        if not name:
+            name = (urlsplit(url).hostname or '').removeprefix('www.')
+        website_name = name.lower()[:WEBSITE_NAME_MAX_LENGTH]
+
+        error = None
+        try:
+            validate_url(url)
+        except ValidationError:
+            error = "Invalid website URL."
+        if not website_name:
+            error = "Website name is required."
+        elif not password:
+            error = "Password is required."
+        elif len(password) > PASSWORD_MAX_LENGTH:
+            error = f"Password is longer than {PASSWORD_MAX_LENGTH} characters."
+        elif is_weak_password(password, [website_name]):
+            error = "Password does not meet the minimum strength criteria."
+        elif website_name in seen:
+            error = f"Duplicate entry for '{website_name}' in the upload."
+
+        if error:
+            report.append({"row": number, "website_name": website_name, "status": "error", "error": error})
+            continue
+        seen.add(website_name)
+        rows.append({"row": number, "website_name": website_name, "website_url": url, "password": password})
+    return rows, report
+
+def encrypt_rows(rows):
+    """Replace the plain passwords of parsed rows with their encrypted form, in place."""
+    for row, encrypted_password in zip(rows, encrypt_passwords([row['password'] for row in rows])):
+        row['password'] = encrypted_password
+    return rows
+
+def _insert_chunk(user, chunk, report):
+    entries = [PasswordVault(user=user, website_name=row['website_name'], website_url=row['website_url'], password=row['password'])
+               for row in chunk]
+    try:
+        with transaction.atomic(using=vault_db(user.id)):
+            version = VaultVersion.next_for(user.id)
+            for entry in entries:
+                entry.version = version
+            PasswordVault.objects.bulk_create(entries)
+            VaultSearchTerm.reindex(entries, replace=False)
+        report.extend({"row": row['row'], "website_name": row['website_name'], "status": "imported"} for row in chunk)
+        return len(entries)
+    except IntegrityError:
+        pass
+    # Another request added one of these websites meanwhile; insert one by one to pinpoint the conflict.
+    imported = 0
+    for row, entry in zip(chunk, entries):
+        try:
+            with transaction.atomic(using=vault_db(user.id)):
+                entry.save()
+            imported += 1
+            report.append({"row": row['row'], "website_name": row['website_name'], "status": "imported"})
+        except IntegrityError:
+            report.append({"row": row['row'], "website_name": row['website_name'], "status": "skipped", "error": "Password already exists."})
+    return imported
+
+def import_vault_entries(user, rows, progress=None):
+    """
+    Import encrypted rows into a user's vault in chunks.
+
+    For every chunk, entries already in the vault are skipped with one IN query,
+    the remaining passwords are checked for breaches with each SHA-1 prefix
+    fetched once, and the clean entries are written with a single bulk_create
+    inside a transaction on the user's shard.
+
+    Parameters:
+    - user (User): Owner of the imported entries.
+    - rows (list): Rows from parse_export with encrypted passwords.
+    - progress (callable): Optional callback receiving the number of rows processed so far.
+    Returns: tuple: (imported, report) with the number of imported entries and the per-row report.
+    """
+    with user_shard(user.id):
+        return _import_chunks(user, rows, progress)
+
+def _import_chunks(user, rows, progress):
+    report, imported = [], 0
+    chunk_size = settings.IMPORT_CHUNK_SIZE
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        existing = set(PasswordVault.objects.filter(user=user, website_name__in=[row['website_name'] for row in chunk])
+                       .values_list('website_name', flat=True))
+        candidates = []
+        for row in chunk:
+            if row['website_name'] in existing:
+                report.append({"row": row['row'], "website_name": row['website_name'], "status": "skipped", "error": "Password already exists."})
+            else:
+                candidates.append(row)
+
+        breached = pwned_passwords(decrypt_passwords([row['password'] for row in candidates]))
+        clean = []
+        for row, is_breached in zip(candidates, breached):
+            if is_breached is None:
+                report.append({"row": row['row'], "website_name": row['website_name'], "status": "error", "error": "Breach check unavailable."})
+            elif is_breached:
+                report.append({"row": row['row'], "website_name": row['website_name'], "status": "error", "error": "Password has been identified in security breaches."})
+            else:
+                clean.append(row)
+
+        if clean:
+            imported += _insert_chunk(user, clean, report)
+        if progress is not None:
+            progress(start + len(chunk))
+    return imported, report
@@ -0,0 +1,65 @@
+import json
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+from password_app.benchmarks import BenchmarkRunner, seed_vault, local_services, compare_results
+from password_app.vault_cache import vault_page_cache
+from password_manager.hibp import hibp_stats
+
+class Command(BaseCommand):
+    """
+    Benchmark every API endpoint against a freshly created test database.
+
+    The database is seeded with N users x M entries, external services are
+    replaced by local stand-ins (see password_app.benchmarks.local_services),
+    and each scenario reports throughput, p50/p95/p99 latency and query counts.
+    """
+    help = "Run the API benchmark scenarios and report latency, throughput and query counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Number of seeded users.")
+        parser.add_argument('--entries', type=int, default=100, help="Vault entries per seeded user.")
+        parser.add_argument('--iterations', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--scenario', choices=BenchmarkRunner.SCENARIOS, nargs='+', default=list(BenchmarkRunner.SCENARIOS), help="Scenarios to run, in order.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the choice of users and entries.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="JSON results of a previous run to compare against.")
+        parser.add_argument('--max-regression', type=float, default=20.0, help="Allowed p95 latency growth over the baseline, in percent.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)['scenarios']
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with local_services():
+                with transaction.atomic():
+                    users = seed_vault(options['users'], options['entries'])
+                runner = BenchmarkRunner(users, options['iterations'], options['seed'])
+                scenarios = {}
+                for name in options['scenario']:
+                    scenarios[name] = result = runner.run(name)
+                    self.stdout.write(f"{name:>17}: {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+                                      f"p99 {result['p99_ms']:>8} ms  queries {result['queries_mean']} (max {result['queries_max']})  errors {result['errors']}")
+                # local_services gives the run an HIBP client of its own, dropped when it ends.
+                breach_checks = hibp_stats()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results = {
+            'parameters': {name: options[name] for name in ('users', 'entries', 'iterations', 'seed')},
+            'database': connection.vendor,
+            'scenarios': scenarios,
+            'vault_cache': vault_page_cache.stats(),
+            'breach_checks': breach_checks,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2)
+
+        if baseline is not None:
+            regressions = compare_results(baseline, scenarios, options['max_regression'])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against the baseline.")
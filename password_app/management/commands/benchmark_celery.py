@@ -0,0 +1,89 @@
+import os
+import json
+import time
+from django.core import mail
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand, CommandError
+from django_celery_results.models import TaskResult
+from password_manager.celery import app, NOTIFICATIONS_QUEUE
+from user_app.tasks import send_welcome_mail
+
+class Command(BaseCommand):
+    """
+    Measure how many welcome emails a notifications worker sends per second
+    when every task stores its result in the database, and when results are ignored.
+
+    For each mode an in-process worker consumes the notifications queue of an
+    in-memory broker, with the locmem email backend and the django-db result
+    backend. Rate limits are disabled so the numbers show the cost of the task
+    itself. --mail-delay adds a pause per message to stand in for SMTP latency.
+
+The prefetch is unlimited by default: without an event loop for the in-memory
+transport the worker only acknowledges started tasks between two 2 second polls,
+so a bounded prefetch would measure that wait rather than the tasks.
+    """
+    help = "Compare mail task throughput of a Celery worker with and without result persistence."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['results', 'ignore_result'], nargs='+', default=['results', 'ignore_result'], help="Result handling to measure.")
+        parser.add_argument('--tasks', type=int, default=1000, help="Mail tasks sent per mode.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Worker threads.")
+        parser.add_argument('--prefetch-multiplier', type=int, default=0, help="Messages reserved per worker thread; 0 for no limit.")
+        parser.add_argument('--mail-delay', type=float, default=0.0, help="Seconds each email takes to send.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _run(self, ignore_result, tasks, concurrency, prefetch_multiplier, mail_delay):
+        from celery.contrib.testing.worker import start_worker
+        send_welcome_mail.ignore_result = ignore_result
+        stored_before = TaskResult.objects.count()
+        mail.outbox = []
+        original_send = mail.backends.locmem.EmailBackend.send_messages
+
+        def send_messages(backend, messages):
+            time.sleep(mail_delay)
+            return original_send(backend, messages)
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            mail.backends.locmem.EmailBackend.send_messages = send_messages
+            try:
+                with start_worker(app, pool='threads', concurrency=concurrency, perform_ping_check=False,
+                                  queues=[NOTIFICATIONS_QUEUE], prefetch_multiplier=prefetch_multiplier,
+                                  disable_rate_limits=True, shutdown_timeout=60):
+                    started = time.perf_counter()
+                    for number in range(tasks):
+                        send_welcome_mail.delay(f"bench_user_{number}", f"bench_user_{number}@example.com")
+                    expected = stored_before + (0 if ignore_result else tasks)
+                    deadline = time.monotonic() + 300
+                    while len(mail.outbox) < tasks or TaskResult.objects.count() < expected:
+                        if time.monotonic() > deadline:
+                            raise CommandError(f"Only {len(mail.outbox)} of {tasks} emails were sent within 300 seconds")
+                        time.sleep(0.01)
+                    elapsed = time.perf_counter() - started
+            finally:
+                mail.backends.locmem.EmailBackend.send_messages = original_send
+        stored = TaskResult.objects.count() - stored_before
+        return {'tasks': tasks, 'seconds': round(elapsed, 2), 'tasks_per_second': round(tasks / elapsed, 1), 'result_rows': stored}
+
+    def handle(self, *args, **options):
+        import django.core.mail.backends.locmem  # noqa: F401
+        # Celery reads the broker and result backend from the environment before its configuration.
+        os.environ['CELERY_BROKER_URL'], os.environ['CELERY_RESULT_BACKEND'] = 'memory://', 'django-db'
+        # The in-memory transport polls for messages every second by default, which would cap the worker at its prefetch count per second.
+        app.conf.update(CELERY_BROKER_TRANSPORT_OPTIONS={'polling_interval': 0.001})
+        ignore_result = send_welcome_mail.ignore_result
+        last_result_id = TaskResult.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        results = {}
+        try:
+            for mode in options['mode']:
+                result = self._run(mode == 'ignore_result', options['tasks'], options['concurrency'], options['prefetch_multiplier'], options['mail_delay'])
+                results[mode] = result
+                if not options['json']:
+                    self.stdout.write(f"{mode:>13}: {result['tasks_per_second']:>8} tasks/s  {result['seconds']:>7} s  "
+                                      f"{result['result_rows']} result rows written")
+        finally:
+            send_welcome_mail.ignore_result = ignore_result
+            TaskResult.objects.filter(id__gt=last_result_id, task_name=send_welcome_mail.name).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in ('tasks', 'concurrency', 'prefetch_multiplier', 'mail_delay')},
+                                          'results': results}, indent=2))
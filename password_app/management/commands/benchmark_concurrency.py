@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import tempfile
+import statistics
+import subprocess
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from password_manager.utility import generate_password
+from password_app.benchmarks import seed_vault, start_stub_hibp
+
+class Command(BaseCommand):
+    """
+    Measure how many add requests one ASGI worker keeps in flight while the
+    Pwned Passwords API is slow, with the sync views and with the async views.
+
+    A stub range server that holds every response for --hibp-delay seconds
+    stands in for HIBP. For each mode one uvicorn worker is started on the
+    configured database and --concurrency clients send --requests adds.
+    The stub reports the most breach checks it saw at once, which is the
+    concurrency the worker actually achieved.
+    """
+    help = "Compare per-worker concurrency of the sync and async add endpoint under a slow HIBP."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['sync', 'async'], nargs='+', default=['sync', 'async'], help="View implementations to measure.")
+        parser.add_argument('--concurrency', type=int, default=100, help="Concurrent client connections.")
+        parser.add_argument('--requests', type=int, default=400, help="Add requests per mode.")
+        parser.add_argument('--hibp-delay', type=float, default=0.25, help="Seconds the stub HIBP holds each response.")
+        parser.add_argument('--port', type=int, default=8765, help="Port of the uvicorn worker.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _start_worker(self, mode, port, hibp_url, temp_dir, concurrency):
+        env = dict(os.environ,
+                   ASYNC_VIEWS='True' if mode == 'async' else 'False',
+                   HIBP_API_URL=hibp_url,
+                   HIBP_FAIL_OPEN='False',
+                   HIBP_POOL_SIZE=str(concurrency),
+                   BREACH_INDEX_PATH=os.path.join(temp_dir, 'breach_index.bin'),
+                   BREACH_RANGE_CACHE_DIR=os.path.join(temp_dir, 'ranges'),
+                   BREACH_RANGE_TTL='0',
+                   CELERY_BROKER_URL='memory://')
+        worker = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'password_manager.asgi:application',
+                                   '--port', str(port), '--workers', '1', '--log-level', 'warning'],
+                                  cwd=django_settings.BASE_DIR, env=env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if worker.poll() is not None:
+                raise CommandError(f"uvicorn exited with status {worker.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                return worker
+            except OSError:
+                time.sleep(0.1)
+        worker.terminate()
+        raise CommandError("uvicorn did not start within 30 seconds")
+
+    async def _load(self, port, tokens, total, concurrency, mode):
+        import httpx
+        latencies, statuses = [], {}
+        queue = asyncio.Queue()
+        for number in range(total):
+            queue.put_nowait(number)
+
+        async def client(session):
+            while True:
+                try:
+                    number = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                body = {'website_name': f"{mode}-{number}", 'website_url': f"https://{mode}-{number}.example.com", 'password': generate_password()}
+                started = time.perf_counter()
+                response = await session.post('/api/password/add', json=body,
+                                              headers={'Authorization': f"Bearer {tokens[number % len(tokens)]}"})
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(client(session) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'requests': total,
+            'statuses': statuses,
+            'throughput_rps': round(total / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        }
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        users = seed_vault(concurrency, 0, prefix=f"concurrency{int(time.time())}")
+        tokens = [str(RefreshToken.for_user(user).access_token) for user in users]
+        results = {}
+        try:
+            for mode in options['mode']:
+                stub = start_stub_hibp(options['hibp_delay'])
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    worker = self._start_worker(mode, options['port'], f"http://127.0.0.1:{stub.server_port}", temp_dir, concurrency)
+                    try:
+                        result = asyncio.run(self._load(options['port'], tokens, options['requests'], concurrency, mode))
+                    finally:
+                        worker.terminate()
+                        worker.wait()
+                        stub.shutdown()
+                        stub.server_close()
+                result['hibp_calls'] = stub.requests
+                result['max_concurrent_breach_checks'] = stub.max_in_flight
+                results[mode] = result
+                if not options['json']:
+                    self.stdout.write(f"{mode:>5}: {result['throughput_rps']:>7} req/s  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+                                      f"max concurrent breach checks {result['max_concurrent_breach_checks']}  statuses {result['statuses']}")
+        finally:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in ('concurrency', 'requests', 'hibp_delay')},
+                                          'results': results}, indent=2))
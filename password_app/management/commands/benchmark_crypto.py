@@ -0,0 +1,49 @@
+import time
+import base64
+from Crypto.Cipher import AES
+from django.core.management.base import BaseCommand
+from password_manager.utility import (ENCRYPTION_KEY,
+                                      ENCRYPTION_NONCE,
+                                      generate_password,
+                                      legacy_decrypt_password,
+                                      encrypt_passwords,
+                                      decrypt_passwords)
+
+class Command(BaseCommand):
+    """
+    Measure vault encryption and decryption throughput in rows per second,
+    comparing the legacy one-cipher-per-row path with the batch engine.
+    """
+    help = "Benchmark per-row and batch password encryption/decryption."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help="Row counts to benchmark.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per batch call, matching VAULT_STREAM_CHUNK_SIZE.")
+
+    def _rate(self, rows, function):
+        started = time.perf_counter()
+        function()
+        return rows / (time.perf_counter() - started)
+
+    def _batched(self, function, values, batch_size):
+        for start in range(0, len(values), batch_size):
+            function(values[start:start + batch_size])
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"{'rows':>8} {'legacy decrypt':>16} {'batch decrypt (legacy)':>24} {'batch decrypt (v1)':>20} {'legacy encrypt':>16} {'batch encrypt':>15}")
+        for rows in options['rows']:
+            passwords = [generate_password() for _ in range(rows)]
+            legacy = [base64.b64encode(AES.new(ENCRYPTION_KEY, AES.MODE_CTR, nonce=ENCRYPTION_NONCE).encrypt(password.encode('utf-8'))).decode('utf-8')
+                      for password in passwords]
+            versioned = encrypt_passwords(passwords)
+
+            results = [
+                self._rate(rows, lambda: [legacy_decrypt_password(value) for value in legacy]),
+                self._rate(rows, lambda: self._batched(decrypt_passwords, legacy, batch_size)),
+                self._rate(rows, lambda: self._batched(decrypt_passwords, versioned, batch_size)),
+                self._rate(rows, lambda: [base64.b64encode(AES.new(ENCRYPTION_KEY, AES.MODE_CTR, nonce=ENCRYPTION_NONCE).encrypt(password.encode('utf-8'))).decode('utf-8')
+                                          for password in passwords]),
+                self._rate(rows, lambda: self._batched(encrypt_passwords, passwords, batch_size)),
+            ]
+            self.stdout.write(f"{rows:>8} {results[0]:>16,.0f} {results[1]:>24,.0f} {results[2]:>20,.0f} {results[3]:>16,.0f} {results[4]:>15,.0f}")
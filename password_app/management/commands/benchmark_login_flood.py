@@ -0,0 +1,130 @@
+import json
+import time
+import logging
+import threading
+import statistics
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from password_manager import settings
+from password_app.benchmarks import BENCHMARK_HOST, BENCHMARK_PASSWORD, seed_vault, local_services
+from user_app import hashers
+
+class Command(BaseCommand):
+    """
+    Measure vault endpoint latency while the login endpoint is flooded.
+
+    A fresh test database is seeded and --vault-clients threads list their vaults for
+    --seconds in three rounds: without a flood, under a flood of wrong-password logins
+    from --flood-clients threads with throttling off and unbounded hashing, and under the
+    same flood with the configured throttles and hashing slots. The flood cycles through
+    --flood-addresses client addresses and --flood-usernames usernames, like a credential
+    stuffing run. Each round reports vault throughput and latency, login statuses, the
+    password hashes computed and the CPU seconds this process used.
+    """
+    help = "Report vault latency under a simulated login flood, with and without login throttling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of seeded users listing their vault.")
+        parser.add_argument('--entries', type=int, default=50, help="Vault entries per seeded user.")
+        parser.add_argument('--seconds', type=float, default=5.0, help="Duration of each round.")
+        parser.add_argument('--vault-clients', type=int, default=4, help="Threads listing vaults.")
+        parser.add_argument('--flood-clients', type=int, default=16, help="Threads sending login attempts.")
+        parser.add_argument('--flood-addresses', type=int, default=8, help="Client addresses the flood comes from.")
+        parser.add_argument('--flood-usernames', type=int, default=50, help="Usernames the flood tries.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _round(self, tokens, options, flood):
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies, vault_errors, logins = [], [0], {}
+
+        def vault_client(token):
+            session = Client(HTTP_HOST=BENCHMARK_HOST)
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = session.get('/api/password/all', HTTP_AUTHORIZATION=f"Bearer {token}")
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed * 1000)
+                    vault_errors[0] += response.status_code >= 400
+            connections.close_all()
+
+        def flood_client(number):
+            session = Client(HTTP_HOST=BENCHMARK_HOST)
+            attempt = number
+            while not stop.is_set():
+                address = f"203.0.113.{attempt % options['flood_addresses'] + 1}"
+                data = {'username': f"victim{attempt % options['flood_usernames']}", 'password': f"guess-{attempt}"}
+                response = session.post('/api/user/login', data, content_type='application/json', REMOTE_ADDR=address)
+                with lock:
+                    logins[response.status_code] = logins.get(response.status_code, 0) + 1
+                attempt += options['flood_clients']
+            connections.close_all()
+
+        threads = [threading.Thread(target=vault_client, args=(tokens[number % len(tokens)],)) for number in range(options['vault_clients'])]
+        if flood:
+            threads += [threading.Thread(target=flood_client, args=(number,)) for number in range(options['flood_clients'])]
+        hashed = hashers.hashing_slots().stats()['hashed']
+        cpu_started, started = time.process_time(), time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        latencies.sort()
+        return {
+            'vault_requests': len(latencies),
+            'vault_errors': vault_errors[0],
+            'vault_throughput_rps': round(len(latencies) / elapsed, 1),
+            'vault_p50_ms': round(statistics.median(latencies), 3),
+            'vault_p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+            'logins': {str(code): count for code, count in sorted(logins.items())},
+            'hashes': hashers.hashing_slots().stats()['hashed'] - hashed,
+            'cpu_seconds': round(cpu, 2),
+        }
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        previous_slots = hashers._slots
+        # Every refused login would be logged as a warning.
+        request_logger = logging.getLogger('django.request')
+        previous_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        results = {}
+        try:
+            with local_services():
+                with transaction.atomic():
+                    users = seed_vault(options['users'], options['entries'])
+                login = Client(HTTP_HOST=BENCHMARK_HOST)
+                tokens = [login.post('/api/user/login', {'username': user.username, 'password': BENCHMARK_PASSWORD},
+                                     content_type='application/json').json()['access'] for user in users]
+                rounds = (
+                    # Unbounded: every flood thread may hash at once and waits as long as it takes.
+                    ('no flood', False, False, hashers.HashingSlots(options['flood_clients'], None)),
+                    ('flood, unprotected', True, False, hashers.HashingSlots(options['flood_clients'], None)),
+                    ('flood, protected', True, True, hashers.HashingSlots(settings.PASSWORD_HASHING_CONCURRENCY, settings.PASSWORD_HASHING_QUEUE_TIMEOUT)),
+                )
+                for name, flood, throttled, slots in rounds:
+                    caches['throttle'].clear()
+                    hashers._slots = slots
+                    settings.LOGIN_THROTTLE_ENABLED = throttled
+                    results[name] = result = self._round(tokens, options, flood)
+                    if not options['json']:
+                        self.stdout.write(f"{name:>18}: vault {result['vault_throughput_rps']:>7} req/s  p50 {result['vault_p50_ms']:>8} ms  "
+                                          f"p95 {result['vault_p95_ms']:>8} ms  errors {result['vault_errors']}  logins {result['logins']}  "
+                                          f"hashes {result['hashes']}  cpu {result['cpu_seconds']} s")
+        finally:
+            hashers._slots = previous_slots
+            request_logger.setLevel(previous_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in (
+                'users', 'entries', 'seconds', 'vault_clients', 'flood_clients', 'flood_addresses', 'flood_usernames')},
+                'settings': {name: getattr(settings, name) for name in (
+                    'LOGIN_THROTTLE_IP_RATE', 'LOGIN_THROTTLE_USERNAME_RATE', 'PASSWORD_HASHING_CONCURRENCY', 'PASSWORD_HASHING_QUEUE_TIMEOUT')},
+                'results': results}, indent=2))
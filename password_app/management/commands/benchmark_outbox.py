@@ -0,0 +1,79 @@
+import os
+import json
+import time
+from unittest import mock
+from django.db import connection
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from password_manager.celery import app
+from password_app.benchmarks import BenchmarkRunner, local_services
+from password_app.models import OutboxMessage
+from password_app.outbox import relay_messages
+from user_app import views as user_views
+
+class Command(BaseCommand):
+    """
+    Measure the latency of the register endpoint when the welcome email is published to a
+    slow broker inside the request, and when it is written to the outbox instead.
+
+    The broker is Celery's in-memory transport with every publish held for --broker-delay
+    seconds. 'inline' publishes the task during the request, as the view did before the
+    outbox; 'outbox' writes the outbox row in the user's transaction and then reports how
+    fast the relay drains the rows to the same broker. Runs against a fresh test database.
+    """
+    help = "Compare register latency with inline broker publishing and with the task outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['inline', 'outbox'], nargs='+', default=['inline', 'outbox'], help="Ways of queueing the welcome email to measure.")
+        parser.add_argument('--requests', type=int, default=100, help="Register requests per mode.")
+        parser.add_argument('--broker-delay', type=float, default=0.1, help="Seconds every publish to the broker takes.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _publish_inline(self, task, args=(), kwargs=None, dedupe_key=None):
+        return task.apply_async(args, kwargs)
+
+    def handle(self, *args, **options):
+        from kombu.transport import memory
+        # Celery reads the broker from the environment before its configuration.
+        os.environ['CELERY_BROKER_URL'] = 'memory://'
+        original_put = memory.Channel._put
+        broker_delay = options['broker_delay']
+
+        def slow_put(channel, queue, message, **kwargs):
+            time.sleep(broker_delay)
+            return original_put(channel, queue, message, **kwargs)
+
+        results = {}
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with local_services(), mock.patch.object(memory.Channel, '_put', slow_put):
+                app.conf.task_always_eager = False
+                for mode in options['mode']:
+                    runner = BenchmarkRunner([], options['requests'])
+                    if mode == 'inline':
+                        with mock.patch.object(user_views, 'enqueue', self._publish_inline):
+                            result = runner.run('register')
+                    else:
+                        result = runner.run('register')
+                        pending = OutboxMessage.objects.filter(published_at=None).count()
+                        started = time.perf_counter()
+                        published, error = relay_messages()
+                        elapsed = time.perf_counter() - started
+                        result['relay'] = {'pending': pending, 'published': published, 'seconds': round(elapsed, 3),
+                                           'messages_per_second': round(published / elapsed, 1) if elapsed else None,
+                                           'error': repr(error) if error is not None else None}
+                    User.objects.filter(username__startswith='bench_register_').delete()
+                    results[mode] = result
+                    if not options['json']:
+                        self.stdout.write(f"{mode:>7}: {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+                                          f"p99 {result['p99_ms']:>8} ms  queries {result['queries_mean']}  errors {result['errors']}")
+                        if 'relay' in result:
+                            relay = result['relay']
+                            self.stdout.write(f"  relay: {relay['published']}/{relay['pending']} messages in {relay['seconds']} s "
+                                              f"({relay['messages_per_second']} msg/s)")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in ('requests', 'broker_delay')},
+                                          'results': results}, indent=2))
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import statistics
+from contextlib import ExitStack
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.core.management.base import BaseCommand
+from password_manager import settings
+from password_manager.db_router import PRIMARY
+from password_app.benchmarks import BENCHMARK_HOST, BENCHMARK_PASSWORD, seed_vault, local_services
+from password_app.management.commands.sync_sqlite_replicas import copy_sqlite_database
+
+class Command(BaseCommand):
+    """
+    Measure vault listing throughput as read replicas are added.
+
+    A fresh SQLite test database is seeded and copied to --max-replicas replica files.
+    For 0 up to --max-replicas replicas, --concurrency threads send --requests listing
+    requests (the vault page cache is off) and the queries served by the primary and by
+    the replicas are counted. --query-delay makes every database serve one query at a
+    time, each taking that many seconds, as a stand-in for database servers with a
+    fixed capacity; without it all the databases share this machine's CPU and disk.
+    """
+    help = "Report vault listing throughput and query distribution with 0..N read replicas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-replicas', type=int, default=3, help="Largest number of replicas measured.")
+        parser.add_argument('--users', type=int, default=20, help="Number of seeded users.")
+        parser.add_argument('--entries', type=int, default=100, help="Vault entries per seeded user.")
+        parser.add_argument('--requests', type=int, default=400, help="Listing requests per replica count.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Client threads.")
+        parser.add_argument('--query-delay', type=float, default=0.0, help="Seconds each database spends on a query, one query at a time.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _load(self, tokens, requests, concurrency, aliases, query_delay):
+        gates = {alias: threading.Lock() for alias in aliases}
+        queries = {alias: 0 for alias in aliases}
+        latencies, errors, lock = [], [0], threading.Lock()
+        numbers = iter(range(requests))
+
+        def count(alias):
+            def wrapper(execute, sql, params, many, context):
+                with lock:
+                    queries[alias] += 1
+                if query_delay:
+                    with gates[alias]:
+                        time.sleep(query_delay)
+                        return execute(sql, params, many, context)
+                return execute(sql, params, many, context)
+            return wrapper
+
+        def client():
+            session = Client(HTTP_HOST=BENCHMARK_HOST)
+            with ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(connections[alias].execute_wrapper(count(alias)))
+                while True:
+                    with lock:
+                        number = next(numbers, None)
+                    if number is None:
+                        break
+                    started = time.perf_counter()
+                    response = session.get('/api/password/all?page_size=100', HTTP_AUTHORIZATION=f"Bearer {tokens[number % len(tokens)]}")
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed * 1000)
+                        errors[0] += response.status_code >= 400
+            connections.close_all()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'requests': requests,
+            'errors': errors[0],
+            'throughput_rps': round(requests / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+            'primary_queries': queries[PRIMARY],
+            'replica_queries': sum(count for alias, count in queries.items() if alias != PRIMARY),
+        }
+
+    def handle(self, *args, **options):
+        max_replicas = options['max_replicas']
+        overrides = {name: getattr(settings, name) for name in ('DATABASE_REPLICA_ALIASES', 'VAULT_CACHE_ENABLED')}
+        results = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            primary_path = os.path.join(temp_dir, 'primary.sqlite3')
+            connection.settings_dict['TEST']['NAME'] = primary_path
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            aliases = [f"benchmark_replica{number}" for number in range(1, max_replicas + 1)]
+            try:
+                with local_services():
+                    with transaction.atomic():
+                        users = seed_vault(options['users'], options['entries'])
+                    login = Client(HTTP_HOST=BENCHMARK_HOST)
+                    tokens = [login.post('/api/user/login', {'username': user.username, 'password': BENCHMARK_PASSWORD},
+                                         content_type='application/json').json()['access'] for user in users]
+                    connection.close()
+                    for alias in aliases:
+                        path = os.path.join(temp_dir, f"{alias}.sqlite3")
+                        copy_sqlite_database(primary_path, path)
+                        connections.settings[alias] = {**connection.settings_dict, 'NAME': path}
+                    settings.VAULT_CACHE_ENABLED = False
+                    for replicas in range(max_replicas + 1):
+                        settings.DATABASE_REPLICA_ALIASES = aliases[:replicas]
+                        result = self._load(tokens, options['requests'], options['concurrency'], [PRIMARY, *aliases[:replicas]], options['query_delay'])
+                        results[replicas] = result
+                        if not options['json']:
+                            self.stdout.write(f"{replicas} replica(s): {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>8} ms  "
+                                              f"p95 {result['p95_ms']:>8} ms  queries primary {result['primary_queries']} "
+                                              f"replicas {result['replica_queries']}  errors {result['errors']}")
+            finally:
+                for name, value in overrides.items():
+                    setattr(settings, name, value)
+                for alias in aliases:
+                    if alias in connections.settings:
+                        connections[alias].close()
+                        del connections.settings[alias]
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                connection.settings_dict['TEST']['NAME'] = None
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in ('users', 'entries', 'requests', 'concurrency', 'query_delay')},
+                                          'results': results}, indent=2))
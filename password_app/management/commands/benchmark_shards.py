@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import statistics
+from contextlib import ExitStack
+from django.db import connection, connections
+from django.test import Client
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from password_manager import settings
+from password_manager.db_router import PRIMARY
+from password_app.benchmarks import BENCHMARK_HOST, BENCHMARK_PASSWORD, seed_vault, local_services
+from password_app.models import PasswordVault
+
+class Command(BaseCommand):
+    """
+    Measure vault write throughput as the vault is sharded over more databases.
+
+    A fresh SQLite test database and --max-shards shard files are migrated. For 1 up to
+    --max-shards databases, new users are spread over the shards by the directory and
+    --concurrency threads send --requests add requests; the queries and entries landing
+    on each database are counted. --query-delay makes every database serve one query at
+    a time, each taking that many seconds, as a stand-in for database servers with a
+    fixed capacity; without it all the databases share this machine's CPU and disk.
+    """
+    help = "Report vault add throughput and query distribution with 1..N shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-shards', type=int, default=3, help="Largest number of databases measured, the primary included.")
+        parser.add_argument('--users', type=int, default=30, help="Number of users adding entries per shard count.")
+        parser.add_argument('--requests', type=int, default=300, help="Add requests per shard count.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Client threads.")
+        parser.add_argument('--query-delay', type=float, default=0.0, help="Seconds each database spends on a query, one query at a time.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _load(self, tokens, requests, concurrency, aliases, query_delay):
+        gates = {alias: threading.Lock() for alias in aliases}
+        queries = {alias: 0 for alias in aliases}
+        latencies, errors, lock = [], [0], threading.Lock()
+        numbers = iter(range(requests))
+
+        def count(alias):
+            def wrapper(execute, sql, params, many, context):
+                with lock:
+                    queries[alias] += 1
+                if query_delay:
+                    # Only the service time is serialized: running the query under the gate would
+                    # deadlock with a transaction waiting for SQLite's write lock.
+                    with gates[alias]:
+                        time.sleep(query_delay)
+                return execute(sql, params, many, context)
+            return wrapper
+
+        def client():
+            session = Client(HTTP_HOST=BENCHMARK_HOST)
+            with ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(connections[alias].execute_wrapper(count(alias)))
+                while True:
+                    with lock:
+                        number = next(numbers, None)
+                    if number is None:
+                        break
+                    data = {'website_name': f"shard{len(aliases)}-{number}", 'website_url': f"https://site{number}.example.com",
+                            'password': 'xQ9#vLm2$Rt7!pZw'}
+                    started = time.perf_counter()
+                    response = session.post('/api/password/add', data, content_type='application/json',
+                                            HTTP_AUTHORIZATION=f"Bearer {tokens[number % len(tokens)]}")
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed * 1000)
+                        errors[0] += response.status_code >= 400
+            connections.close_all()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'requests': requests,
+            'errors': errors[0],
+            'throughput_rps': round(requests / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+            'queries': queries,
+            'entries': {alias: PasswordVault.objects.using(alias).filter(website_name__startswith=f"shard{len(aliases)}-").count() for alias in aliases},
+        }
+
+    def handle(self, *args, **options):
+        max_shards = options['max_shards']
+        overrides = {name: getattr(settings, name) for name in ('DATABASE_SHARD_ALIASES', 'DATABASE_REPLICA_ALIASES')}
+        results = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'primary.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            aliases = [f"benchmark_shard{number}" for number in range(1, max_shards)]
+            try:
+                for alias in aliases:
+                    connections.settings[alias] = {**connection.settings_dict, 'NAME': os.path.join(temp_dir, f"{alias}.sqlite3")}
+                settings.DATABASE_SHARD_ALIASES = [PRIMARY, *aliases]
+                settings.DATABASE_REPLICA_ALIASES = []
+                for alias in aliases:
+                    call_command('migrate', database=alias, verbosity=0)
+                with local_services():
+                    for shards in range(1, max_shards + 1):
+                        settings.DATABASE_SHARD_ALIASES = [PRIMARY, *aliases[:shards - 1]]
+                        caches['vault'].clear()
+                        # Fresh users, so the directory places them over this round's shards.
+                        users = seed_vault(options['users'], 0, prefix=f"shards{shards}")
+                        login = Client(HTTP_HOST=BENCHMARK_HOST)
+                        tokens = [login.post('/api/user/login', {'username': user.username, 'password': BENCHMARK_PASSWORD},
+                                             content_type='application/json').json()['access'] for user in users]
+                        result = self._load(tokens, options['requests'], options['concurrency'], settings.DATABASE_SHARD_ALIASES, options['query_delay'])
+                        results[shards] = result
+                        if not options['json']:
+                            self.stdout.write(f"{shards} shard(s): {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>8} ms  "
+                                              f"p95 {result['p95_ms']:>8} ms  queries {result['queries']}  entries {result['entries']}  errors {result['errors']}")
+            finally:
+                for name, value in overrides.items():
+                    setattr(settings, name, value)
+                for alias in aliases:
+                    if alias in connections.settings:
+                        connections[alias].close()
+                        del connections.settings[alias]
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                connection.settings_dict['TEST']['NAME'] = None
+
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {name: options[name] for name in ('users', 'requests', 'concurrency', 'query_delay')},
+                                          'results': results}, indent=2))
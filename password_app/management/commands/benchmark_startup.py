@@ -0,0 +1,100 @@
+import re
+import sys
+import json
+import statistics
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+# Code run in a fresh interpreter for each entry point. Each snippet imports
+# what a process of that kind loads before it serves its first request or task.
+ENTRY_POINTS = {
+    'web': (
+        "import os\n"
+        "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_manager.settings')\n"
+        "from password_manager.wsgi import application\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+    'worker': (
+        "import os\n"
+        "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_manager.settings')\n"
+        "import django\n"
+        "from password_manager.celery import app\n"
+        "django.setup()\n"
+        "app.loader.import_default_modules()\n"
+    ),
+}
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+def parse_importtime(stderr):
+    """
+    Parse the output of `python -X importtime`.
+
+    Parameters: stderr (str): Standard error of the interpreter.
+    Returns: tuple: (total_us, modules) where modules maps each top-level import to its cumulative microseconds.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Imports made directly by the entry point are indented by one space, nested ones further.
+        if indent == 1:
+            modules[module] = modules.get(module, 0) + cumulative
+    return sum(modules.values()), modules
+
+class Command(BaseCommand):
+    """
+    Measure the cold-start import cost of the web and Celery worker entry points
+    with `python -X importtime`, each run in a fresh interpreter.
+    """
+    help = "Benchmark import time of the web and worker entry points."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry-point', choices=sorted(ENTRY_POINTS), nargs='+', default=sorted(ENTRY_POINTS), help="Entry points to measure.")
+        parser.add_argument('--repeat', type=int, default=5, help="Interpreter runs per entry point; the median is reported.")
+        parser.add_argument('--top', type=int, default=10, help="Number of slowest top-level imports to list.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+        parser.add_argument('--max-ms', type=float, help="Fail if the median import time of an entry point exceeds this many milliseconds.")
+
+    def _run(self, snippet):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', snippet],
+                                cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f"Entry point failed to start:\n{result.stderr[-2000:]}")
+        return parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        results = {}
+        for name in options['entry_point']:
+            totals, modules = [], {}
+            for _ in range(options['repeat']):
+                total, run_modules = self._run(ENTRY_POINTS[name])
+                totals.append(total)
+                for module, cumulative in run_modules.items():
+                    modules.setdefault(module, []).append(cumulative)
+            slowest = sorted(((module, statistics.median(times)) for module, times in modules.items()),
+                             key=lambda item: item[1], reverse=True)[:options['top']]
+            results[name] = {
+                'median_ms': round(statistics.median(totals) / 1000, 1),
+                'min_ms': round(min(totals) / 1000, 1),
+                'max_ms': round(max(totals) / 1000, 1),
+                'top_imports': [{'module': module, 'ms': round(cumulative / 1000, 1)} for module, cumulative in slowest],
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for name, result in results.items():
+                self.stdout.write(f"{name}: median {result['median_ms']} ms (min {result['min_ms']}, max {result['max_ms']}) over {options['repeat']} runs")
+                for entry in result['top_imports']:
+                    self.stdout.write(f"  {entry['ms']:>8.1f} ms  {entry['module']}")
+
+        limit = options['max_ms']
+        if limit is not None:
+            over = [name for name, result in results.items() if result['median_ms'] > limit]
+            if over:
+                raise CommandError(f"Import time above {limit} ms for: {', '.join(over)}")
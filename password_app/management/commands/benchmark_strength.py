@@ -0,0 +1,63 @@
+import re
+import time
+from django.core.management.base import BaseCommand
+from password_manager.strength import (PasswordDictionary,
+                                       character_classes,
+                                       estimate_strength,
+                                       get_password_dictionary,
+                                       meets_policy)
+from password_manager.utility import generate_passwords
+
+def legacy_policy(raw_password):
+    # The five-regex check used before the strength engine, kept for comparison.
+    return len(raw_password) >= 8 and re.search('[A-Z]', raw_password) and re.search('[a-z]', raw_password) and re.search('[0-9]', raw_password) \
+        and re.search(r'[~`!@#\$%\^&\*\(\)_\-\+\=\[\]\{\}\:\;\.\?]', raw_password)
+
+class Command(BaseCommand):
+    """
+    Microbenchmarks of the password strength engine: per-call cost of the
+    character-class policy (legacy regexes and the single pass) and of the full
+    estimate on typical inputs, generator throughput and dictionary load time.
+    """
+    help = "Benchmark password strength estimation and generation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help="Calls per measurement.")
+        parser.add_argument('--batch', type=int, default=100, help="Passwords per generator call.")
+
+    def _microseconds(self, iterations, function, value):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function(value)
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        dictionary = get_password_dictionary()
+        if dictionary.path:
+            started = time.perf_counter()
+            PasswordDictionary.open(dictionary.path).close()
+            self.stdout.write(f"dictionary: {dictionary.word_count} words, mmap open {(time.perf_counter() - started) * 1e3:.2f} ms")
+        else:
+            self.stdout.write(f"dictionary: bundled list, {dictionary.word_count} words")
+
+        samples = [('common', 'password'), ('l33t', 'P@ssw0rd1'), ('keyboard', '1qaz2wsx!Q'), ('sequence', 'abcd1234!A'),
+                   ('random 12', generate_passwords(1, 12)[0]), ('random 16', generate_passwords(1, 16)[0]),
+                   ('random 32', generate_passwords(1, 32)[0]), ('random 64', generate_passwords(1, 64)[0])]
+        self.stdout.write(f"{'password':>10} {'score':>6} {'legacy policy us':>17} {'single pass us':>15} {'estimate us':>12}")
+        for name, password in samples:
+            estimate_strength(password)
+            results = [
+                self._microseconds(iterations, legacy_policy, password),
+                self._microseconds(iterations, lambda value: meets_policy(value, character_classes(value)), password),
+                self._microseconds(iterations, estimate_strength, password),
+            ]
+            self.stdout.write(f"{name:>10} {estimate_strength(password)['score']:>6} {results[0]:>17.2f} {results[1]:>15.2f} {results[2]:>12.1f}")
+
+        batch = options['batch']
+        rounds = max(1, iterations // batch)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            generate_passwords(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"generator: {rounds * batch / elapsed:,.0f} passwords/s in batches of {batch}")
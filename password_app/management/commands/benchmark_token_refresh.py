@@ -0,0 +1,93 @@
+import json
+import time
+import logging
+import statistics
+from django.db import connection, transaction
+from django.test import Client
+from django.core.management.base import BaseCommand
+from password_manager import settings
+from password_app.benchmarks import BENCHMARK_HOST, BENCHMARK_PASSWORD, seed_vault, local_services
+from user_app.hashers import hashing_slots
+
+class Command(BaseCommand):
+    """
+    Measure the password hashing a fleet of long-lived clients costs with and without refresh tokens.
+
+    --clients clients stay signed in for --hours hours and renew their session every
+    ACCESS_TOKEN_LIFETIME. In the 'login' mode every renewal sends the password to
+    /api/user/login, as clients did before refresh tokens; in the 'refresh' mode the client
+    logs in once and renews through /api/user/token/refresh with the refresh token it got
+    last. Each renewal is followed by one vault listing with the new access token. The
+    renewals are sent back to back; the report gives the password hashes computed, the CPU
+    seconds of this process and the renewal latency.
+    """
+    help = "Compare hashing CPU of a fleet renewing sessions by login and by refresh token."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help="Number of signed-in clients.")
+        parser.add_argument('--hours', type=float, default=2.0, help="Hours the clients stay signed in.")
+        parser.add_argument('--mode', choices=['login', 'refresh'], nargs='+', default=['login', 'refresh'], help="Renewal modes to measure.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def _run(self, users, renewals, mode):
+        client = Client(HTTP_HOST=BENCHMARK_HOST)
+        latencies, errors, replays_refused = [], 0, 0
+        hashed = hashing_slots().stats()['hashed']
+        cpu_started = time.process_time()
+        for user in users:
+            refresh = None
+            for renewal in range(renewals):
+                started = time.perf_counter()
+                if mode == 'login' or refresh is None:
+                    response = client.post('/api/user/login', {'username': user.username, 'password': BENCHMARK_PASSWORD}, content_type='application/json')
+                else:
+                    response = client.post('/api/user/token/refresh', {'refresh': refresh}, content_type='application/json')
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                used, refresh = refresh, response.json()['refresh']
+                if mode == 'refresh' and used is not None and renewal == renewals - 1:
+                    # A rotated refresh token must not work a second time.
+                    replays_refused += client.post('/api/user/token/refresh', {'refresh': used}, content_type='application/json').status_code == 401
+                errors += client.get('/api/password/all', HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}").status_code != 200
+        cpu = time.process_time() - cpu_started
+        return {
+            'renewals': len(latencies),
+            'errors': errors,
+            'hashes': hashing_slots().stats()['hashed'] - hashed,
+            'cpu_seconds': round(cpu, 2),
+            'renewal_p50_ms': round(statistics.median(latencies), 3),
+            'renewal_mean_ms': round(statistics.mean(latencies), 3),
+            **({'replays_refused': replays_refused} if mode == 'refresh' else {}),
+        }
+
+    def handle(self, *args, **options):
+        lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+        renewals = max(1, int(options['hours'] * 3600 // lifetime))
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # The refused replays would be logged as warnings.
+        request_logger = logging.getLogger('django.request')
+        previous_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        results = {}
+        try:
+            with local_services():
+                with transaction.atomic():
+                    users = seed_vault(options['clients'], 10)
+                for mode in options['mode']:
+                    results[mode] = result = self._run(users, renewals, mode)
+                    if not options['json']:
+                        self.stdout.write(f"{mode:>7}: {result['renewals']} renewals  hashes {result['hashes']}  cpu {result['cpu_seconds']} s  "
+                                          f"renewal p50 {result['renewal_p50_ms']} ms  mean {result['renewal_mean_ms']} ms  errors {result['errors']}"
+                                          + (f"  replays refused {result['replays_refused']}/{options['clients']}" if 'replays_refused' in result else ""))
+        finally:
+            request_logger.setLevel(previous_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if 'login' in results and 'refresh' in results and results['login']['cpu_seconds'] and not options['json']:
+            saved = 1 - results['refresh']['cpu_seconds'] / results['login']['cpu_seconds']
+            self.stdout.write(f"Refresh tokens: {results['login']['hashes'] - results['refresh']['hashes']} fewer hashes, {saved:.0%} less CPU")
+        if options['json']:
+            self.stdout.write(json.dumps({'parameters': {**{name: options[name] for name in ('clients', 'hours')}, 'renewals_per_client': renewals},
+                                          'results': results}, indent=2))
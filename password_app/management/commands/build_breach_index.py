@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from password_manager import settings
+from password_manager.breach_index import (BreachIndex,
+                                           iter_dump,
+                                           iter_cached_ranges,
+                                           merge_blocks,
+                                           write_breach_index)
+
+class Command(BaseCommand):
+    """
+    Build or refresh the local breach index used by pwned_password.
+
+    With --dump the index is rebuilt from a bulk HIBP download (a single
+    'SHA1:COUNT' file ordered by hash, or a directory of per-prefix files).
+    Without it, fresh range responses cached by earlier API fallbacks are
+    merged into the existing index.
+    """
+    help = "Build the breach index from a Pwned Passwords dump or refresh it from cached range responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dump', help="Path to a Pwned Passwords SHA-1 dump file or per-prefix directory.")
+        parser.add_argument('--output', default=settings.BREACH_INDEX_PATH, help="Index file to write.")
+        parser.add_argument('--ttl', type=int, default=settings.BREACH_RANGE_TTL, help="Ignore cached ranges older than this many seconds.")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fresh = iter_cached_ranges(options['ttl'])
+        if options['dump']:
+            # Dump prefixes never expire; cached ranges are newer, so they win on overlap.
+            dump_blocks = ((prefix, 0, digests) for prefix, digests in iter_dump(options['dump']))
+            fresh = merge_blocks(dump_blocks, fresh)
+
+        existing = None
+        if not options['dump']:
+            try:
+                existing = BreachIndex(output)
+            except FileNotFoundError:
+                existing = None
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        try:
+            blocks = merge_blocks(existing.iter_prefixes(), fresh) if existing else fresh
+            prefix_count, record_count = write_breach_index(output, blocks)
+        finally:
+            if existing is not None:
+                existing.close()
+        self.stdout.write(self.style.SUCCESS(f"Breach index written to {output}: {prefix_count} prefixes, {record_count} hashes"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from password_manager import settings
+from password_manager.strength import BUNDLED_WORD_LIST, rank_words, write_password_dictionary
+
+class Command(BaseCommand):
+    """
+    Build the ranked dictionary used by the password strength estimator.
+
+    Each source is a word list ordered from most to least common, one entry
+    per line (for example a leaked-password frequency list, English words
+    or first names). A word found in several lists keeps its best rank. The
+    bundled list of common passwords is always included unless --skip-bundled.
+    """
+    help = "Build the memory-mapped password dictionary from frequency-ordered word lists."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', nargs='*', default=[], help="Frequency-ordered word list files.")
+        parser.add_argument('--limit', type=int, help="Maximum words taken from each list.")
+        parser.add_argument('--skip-bundled', action='store_true', help="Leave out the bundled list of common passwords.")
+        parser.add_argument('--output', default=settings.PASSWORD_DICTIONARY_PATH, help="Dictionary file to write.")
+
+    def handle(self, *args, **options):
+        sources = options['source'] if options['skip_bundled'] else [BUNDLED_WORD_LIST, *options['source']]
+        if not sources:
+            raise CommandError("No word lists given.")
+        try:
+            ranks = rank_words(sources, options['limit'])
+        except OSError as e:
+            raise CommandError(str(e))
+        count = write_password_dictionary(options['output'], ranks)
+        self.stdout.write(self.style.SUCCESS(f"Password dictionary written to {options['output']}: {count} words"))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from password_manager import settings
+from password_manager.db_router import PRIMARY, is_sharded
+from password_app.models import VaultShard
+from password_app.rebalance import move_vault, shard_usage, VaultMoveFailed
+
+class Command(BaseCommand):
+    """
+    Move vaults between shards while the service keeps running.
+
+    --user moves the vaults of the given users to --to. --from moves the vaults of up to
+    --limit users from one shard to --to. Without either, the users and entries per shard
+    are listed. A vault refuses writes (HTTP 503) from the start of its move until it is
+    switched to the new shard, which takes about twice --grace seconds plus the copy; reads
+    are served throughout.
+    """
+    help = "Move user vaults between shards, or show how the vault is spread over them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='+', help="Ids of the users whose vaults are moved.")
+        parser.add_argument('--from', dest='source', help="Shard to move vaults away from.")
+        parser.add_argument('--to', dest='target', help="Shard to move vaults to.")
+        parser.add_argument('--limit', type=int, default=1, help="Number of vaults moved with --from.")
+        parser.add_argument('--grace', type=float, help="Seconds to wait for every process to see a directory change; SHARD_DIRECTORY_CACHE_TIMEOUT by default.")
+
+    def _show_usage(self):
+        for alias, usage in shard_usage().items():
+            self.stdout.write(f"{alias:>10}: {usage['users']} user(s), {usage['entries']} entries")
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError("The vault is not sharded; list the shards in DATABASE_SHARDS")
+        if not options['user'] and not options['source']:
+            self._show_usage()
+            return
+        if options['target'] not in settings.DATABASE_SHARD_ALIASES:
+            raise CommandError(f"--to must be one of {', '.join(settings.DATABASE_SHARD_ALIASES)}")
+
+        user_ids = options['user'] or []
+        if options['source']:
+            user_ids += list(VaultShard.objects.using(PRIMARY).filter(shard=options['source'], moving=False)
+                             .order_by('user_id').values_list('user_id', flat=True)[:options['limit']])
+        for user_id in user_ids:
+            try:
+                copied = move_vault(user_id, options['target'], options['grace'])
+            except VaultMoveFailed as e:
+                self.stderr.write(str(e))
+                continue
+            if copied:
+                self.stdout.write(f"Moved the vault of user {user_id} to {options['target']}: "
+                                  + ", ".join(f"{count} {name}" for name, count in copied.items()))
+            else:
+                self.stdout.write(f"The vault of user {user_id} already is on {options['target']}")
+        self._show_usage()
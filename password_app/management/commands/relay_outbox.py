@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from password_manager import settings
+from password_app.outbox import relay_messages
+
+class Command(BaseCommand):
+    """
+    Publish the tasks waiting in the outbox to the Celery broker.
+
+    The command polls every --interval seconds and publishes due messages in batches
+    of --batch-size. When a publish fails the message is retried with backoff and the
+    relay carries on at the next poll. Several relays, and the relay_outbox beat task,
+    can run at once. With --once it drains the outbox a single time and exits.
+    """
+    help = "Relay outbox messages to the Celery broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the outbox once and exit.")
+        parser.add_argument('--batch-size', type=int, help="Messages per batch; OUTBOX_BATCH_SIZE by default.")
+        parser.add_argument('--interval', type=float, help="Seconds between polls; OUTBOX_POLL_INTERVAL by default.")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] if options['interval'] is not None else settings.OUTBOX_POLL_INTERVAL
+        while True:
+            published, error = relay_messages(options['batch_size'])
+            if published or error is not None:
+                self.stdout.write(f"Published {published} outbox message(s)" + (f"; publishing stopped on {error!r}" if error is not None else ''))
+            if options['once']:
+                return
+            time.sleep(interval)
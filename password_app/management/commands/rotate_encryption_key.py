@@ -0,0 +1,97 @@
+import json
+import time
+import threading
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+from password_manager.keyring import UnknownEncryptionKey
+from password_app.models import KeyRotationJob
+from password_app.rotation import start_key_rotation, resume_key_rotation, run_rotation_worker, rotation_progress, fail_key_rotation
+from password_app.tasks import rotate_encryption_key
+
+class Command(BaseCommand):
+    """
+    Start, resume and follow the re-encryption of the vault under a new key.
+
+    'start' plans a job for every entry not yet under --key-id (ENCRYPTION_KEY_ID by
+    default) and dispatches --workers Celery tasks to work through it. 'resume' restarts
+    the workers of a failed or interrupted job. 'status' reports the progress of a job,
+    the latest one by default. With --inline the workers run as threads of this command
+    instead of Celery tasks.
+    """
+    help = "Re-encrypt the vault under a new encryption key and report progress."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['start', 'resume', 'status'])
+        parser.add_argument('--job', type=int, help="Job to resume or report on; the latest job by default.")
+        parser.add_argument('--key-id', type=int, help="Key to re-encrypt under; ENCRYPTION_KEY_ID by default.")
+        parser.add_argument('--chunk-size', type=int, help="Ids per chunk; KEY_ROTATION_CHUNK_SIZE by default.")
+        parser.add_argument('--workers', type=int, help="Parallel workers; KEY_ROTATION_WORKERS by default.")
+        parser.add_argument('--inline', action='store_true', help="Run the workers in this process instead of on Celery.")
+        parser.add_argument('--watch', type=float, metavar='SECONDS', help="Report progress every SECONDS until the job ends.")
+        parser.add_argument('--json', action='store_true', help="Print the progress as JSON.")
+
+    def _job(self, job_id):
+        jobs = KeyRotationJob.objects.order_by('-id')
+        job = jobs.filter(id=job_id).first() if job_id else jobs.first()
+        if job is None:
+            raise CommandError(f"Key rotation job {job_id} does not exist" if job_id else "No key rotation job has been started")
+        return job
+
+    def _run_inline(self, job):
+        def worker():
+            try:
+                run_rotation_worker(job.id)
+            except Exception as exc:
+                fail_key_rotation(job.id, exc)
+                raise
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=worker) for _ in range(job.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _report(self, job, as_json):
+        progress = rotation_progress(job)
+        if as_json:
+            self.stdout.write(json.dumps(progress))
+            return
+        percent = 100 * progress['rotated'] / progress['total'] if progress['total'] else 100
+        eta = f"  eta {progress['eta_seconds']}s" if progress['eta_seconds'] is not None else ''
+        self.stdout.write(f"Job #{progress['job']} to key {progress['key_id']}: {progress['status']}  "
+                          f"{progress['rotated']}/{progress['total']} rows ({percent:.1f}%)  "
+                          f"chunks {progress['chunks_done']}/{progress['chunks_total']}  "
+                          f"{progress['rows_per_second']} rows/s{eta}  "
+                          f"{progress['remaining_under_other_keys']} rows under other keys")
+        if progress['error']:
+            self.stdout.write(f"Error: {progress['error']}")
+
+    def handle(self, *args, **options):
+        try:
+            if options['action'] == 'start':
+                job = start_key_rotation(options['key_id'], options['chunk_size'], options['workers'])
+            elif options['action'] == 'resume':
+                job = resume_key_rotation(self._job(options['job']).id)
+            else:
+                job = self._job(options['job'])
+        except UnknownEncryptionKey as exc:
+            raise CommandError(str(exc))
+
+        threads = []
+        if options['action'] != 'status' and job.status == KeyRotationJob.RUNNING:
+            if options['inline']:
+                threads = self._run_inline(job)
+            else:
+                for _ in range(job.workers):
+                    rotate_encryption_key.delay(job.id)
+
+        interval = options['watch'] or 1
+        following = options['watch'] or threads
+        while following and job.status == KeyRotationJob.RUNNING and (not threads or any(thread.is_alive() for thread in threads)):
+            self._report(job, options['json'])
+            time.sleep(interval)
+            job.refresh_from_db()
+        for thread in threads:
+            thread.join()
+        job.refresh_from_db()
+        self._report(job, options['json'])
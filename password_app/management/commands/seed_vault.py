@@ -0,0 +1,22 @@
+import time
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from password_app.benchmarks import seed_vault, BENCHMARK_PASSWORD
+
+class Command(BaseCommand):
+    """
+    Create N users with M vault entries each, for load tests and benchmarks.
+    """
+    help = "Seed the database with benchmark users and vault entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help="Number of users to create.")
+        parser.add_argument('--entries', type=int, default=50, help="Vault entries per user.")
+        parser.add_argument('--prefix', default='bench', help="Prefix of the generated usernames.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            users = seed_vault(options['users'], options['entries'], options['prefix'])
+        self.stdout.write(f"Created {len(users)} users with {options['entries']} entries each in {time.perf_counter() - started:.1f}s. "
+                          f"Log in as '{options['prefix']}_user_<n>' with password '{BENCHMARK_PASSWORD}'.")
@@ -0,0 +1,49 @@
+import time
+import sqlite3
+from django.db import connections
+from django.core.management.base import BaseCommand, CommandError
+from password_manager import settings
+from password_manager.db_router import PRIMARY
+
+def copy_sqlite_database(source, destination):
+    """
+    Copy a SQLite database file onto another with the online backup API. The copy is consistent
+    even while the source is written to, and readers of the destination see either the old or
+    the new copy.
+
+    Parameters:
+    - source (str): Path of the database to copy.
+    - destination (str): Path of the copy.
+    """
+    with sqlite3.connect(source) as source_db, sqlite3.connect(destination) as destination_db:
+        source_db.backup(destination_db)
+    source_db.close()
+    destination_db.close()
+
+class Command(BaseCommand):
+    """
+    Refresh the SQLite read replicas listed in DATABASE_REPLICAS from the primary database.
+
+    SQLite has no replication, so local replicas are plain copies of the primary. Run the
+    command once after migrating, or with --interval to copy every few seconds and so get
+    replicas that lag behind the primary like real ones.
+    """
+    help = "Copy the SQLite primary database onto its local read replicas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help="Copy again every INTERVAL seconds until interrupted.")
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Replicas are only copied for SQLite; PostgreSQL replicas are kept in sync by streaming replication")
+        if not settings.DATABASE_REPLICA_ALIASES:
+            raise CommandError("No replica is configured in DATABASE_REPLICAS")
+        while True:
+            started = time.perf_counter()
+            for alias in settings.DATABASE_REPLICA_ALIASES:
+                copy_sqlite_database(str(primary['NAME']), str(connections[alias].settings_dict['NAME']))
+            self.stdout.write(f"Copied the primary to {len(settings.DATABASE_REPLICA_ALIASES)} replica(s) in {time.perf_counter() - started:.2f} s")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def link_entries_to_users(apps, schema_editor):
+    """
+    Resolve the stored usernames to users, drop entries whose user no longer exists
+    and rename duplicate (user, website_name) entries so the unique constraint can be added.
+    """
+    alias = schema_editor.connection.alias
+    PasswordVault = apps.get_model('password_app', 'PasswordVault')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user_ids = dict(User.objects.using(alias).values_list('username', 'id'))
+    seen = set()
+    for entry in PasswordVault.objects.using(alias).order_by('-id').iterator(chunk_size=2000):
+        user_id = user_ids.get(entry.username)
+        if user_id is None:
+            entry.delete()
+            continue
+        entry.owner_id = user_id
+        key = (user_id, entry.website_name)
+        if key in seen:
+            suffix = f"-{entry.id}"
+            entry.website_name = entry.website_name[:30 - len(suffix)] + suffix
+        seen.add(key)
+        entry.save(update_fields=['owner', 'website_name'])
+
+
+def restore_usernames(apps, schema_editor):
+    PasswordVault = apps.get_model('password_app', 'PasswordVault')
+    for entry in PasswordVault.objects.using(schema_editor.connection.alias).select_related('owner').iterator(chunk_size=2000):
+        entry.username = entry.owner.username
+        entry.save(update_fields=['username'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('password_app', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='passwordvault',
+            old_name='user',
+            new_name='username',
+        ),
+        migrations.AlterField(
+            model_name='passwordvault',
+            name='username',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='passwordvault',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vault_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(link_entries_to_users, restore_usernames),
+        migrations.RemoveField(
+            model_name='passwordvault',
+            name='username',
+        ),
+        migrations.RenameField(
+            model_name='passwordvault',
+            old_name='owner',
+            new_name='user',
+        ),
+        migrations.AlterField(
+            model_name='passwordvault',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vault_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='passwordvault',
+            index=models.Index(fields=['user', 'id'], name='vault_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='passwordvault',
+            index=models.Index(fields=['created_at'], name='vault_created_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='passwordvault',
+            constraint=models.UniqueConstraint(fields=('user', 'website_name'), name='unique_vault_entry_per_website'),
+        ),
+    ]
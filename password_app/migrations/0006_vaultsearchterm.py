@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from password_app.models import search_terms
+
+
+def build_search_index(apps, schema_editor):
+    PasswordVault = apps.get_model('password_app', 'PasswordVault')
+    VaultSearchTerm = apps.get_model('password_app', 'VaultSearchTerm')
+    alias = schema_editor.connection.alias
+    terms = []
+    for entry_id, user_id, website_name, website_url in PasswordVault.objects.using(alias).values_list('id', 'user_id', 'website_name', 'website_url').iterator(chunk_size=1000):
+        terms.extend(VaultSearchTerm(entry_id=entry_id, user_id=user_id, term=term) for term in search_terms(website_name, website_url))
+        if len(terms) >= 5000:
+            VaultSearchTerm.objects.using(alias).bulk_create(terms)
+            terms = []
+    VaultSearchTerm.objects.using(alias).bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('password_app', '0005_pendingnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VaultSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('term', models.CharField(max_length=3)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='password_app.passwordvault')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'term', 'entry'], name='vault_search_term_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='vaultsearchterm',
+            constraint=models.UniqueConstraint(fields=('entry', 'term'), name='unique_search_term_per_entry'),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def start_vault_versions(apps, schema_editor):
+    # Existing entries become version 1, so a first sync with since=0 returns them.
+    PasswordVault = apps.get_model('password_app', 'PasswordVault')
+    VaultVersion = apps.get_model('password_app', 'VaultVersion')
+    alias = schema_editor.connection.alias
+    PasswordVault.objects.using(alias).update(version=1)
+    VaultVersion.objects.using(alias).bulk_create(VaultVersion(user_id=user_id, version=1)
+                                                  for user_id in PasswordVault.objects.using(alias).values_list('user_id', flat=True).distinct())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('password_app', '0006_vaultsearchterm'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VaultVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vault_version', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='passwordvault',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vaulttombstone',
+            name='version',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='passwordvault',
+            index=models.Index(fields=['user', 'version'], name='vault_user_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaulttombstone',
+            index=models.Index(fields=['user_id', 'version'], name='tombstone_user_version_idx'),
+        ),
+        migrations.RunPython(start_vault_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('password_app', '0010_vault_shards'),
+    ]
+
+    # 0001 records the column as it was before migrations were committed. Ciphertexts with a
+    # per-record nonce are longer than 100 characters, so databases that were migrated with
+    # --fake-initial need the column widened explicitly.
+    operations = [
+        migrations.AlterField(
+            model_name='passwordvault',
+            name='password',
+            field=models.CharField(max_length=255),
+        ),
+    ]
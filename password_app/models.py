@@ -1,17 +1,481 @@
-from django.db import models
+import uuid
+from urllib.parse import urlsplit
+from django.db import models, transaction, connections, router, IntegrityError
+from django.utils import timezone
+from django.dispatch import receiver
+from django.db.models.signals import pre_delete
+from django.contrib.auth.models import User
+from password_manager.keyring import ciphertext_key_id
+from password_manager.db_router import PRIMARY, is_sharded
+from password_manager.sharding import allocate_vault_ids
+
+# Start and end markers of an indexed value. The start marker lets prefix searches use the
+# index; the two end markers make every substring of one or two characters begin a trigram.
+TERM_START = '^'
+TERM_END = '$$'
+SEARCH_URL_LENGTH = 100
+
+def normalize_website_url(website_url):
+    """Return the host and path of a URL in lower case, without scheme, 'www.' or trailing slash."""
+    parts = urlsplit(website_url.lower())
+    host = (parts.hostname or '').removeprefix('www.')
+    return f"{host}{parts.path}".rstrip('/')[:SEARCH_URL_LENGTH]
+
+def trigrams(text):
+    """Return the set of three-character terms of a marked value."""
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+def search_terms(website_name, website_url):
+    """Return the trigrams indexed for an entry's website name and URL."""
+    return (trigrams(f"{TERM_START}{website_name.lower()}{TERM_END}")
+            | trigrams(f"{TERM_START}{normalize_website_url(website_url)}{TERM_END}"))
+
+class PasswordVaultQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the matched entries, leaving a tombstone for each one in the same transaction and bumping the vault version of their owners."""
+        with transaction.atomic(using=self.db):
+            tombstones = VaultTombstone.for_entries(self)
+            versions = {user_id: VaultVersion.next_for(user_id, using=self.db) for user_id in {tombstone.user_id for tombstone in tombstones}}
+            for tombstone in tombstones:
+                tombstone.version = versions[tombstone.user_id]
+            deleted = super().delete()
+            VaultTombstone.objects.using(self.db).bulk_create(tombstones)
+        return deleted
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Insert the entries, recording the key each password is encrypted with and, when sharded, giving them ids unique across shards."""
+        objs = list(objs)
+        for obj in objs:
+            obj.key_id = ciphertext_key_id(obj.password)
+        if is_sharded():
+            new = [obj for obj in objs if obj.pk is None]
+            for obj, entry_id in zip(new, allocate_vault_ids(len(new))):
+                obj.pk = entry_id
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """Update the entries, keeping key_id in step with the password when it is among the fields."""
+        objs = list(objs)
+        if 'password' in fields:
+            for obj in objs:
+                obj.key_id = ciphertext_key_id(obj.password)
+            fields = [*fields, 'key_id'] if 'key_id' not in fields else fields
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def bulk_update_passwords(self, objs):
+        """
+        Write the password, key_id and updated_at of many entries with one prepared UPDATE run through executemany.
+        Same result as bulk_update(objs, ['password', 'updated_at']), whose CASE expression per entry costs far more
+        to build than the database takes to run it on large batches. Like bulk_update it bypasses save(), so the
+        vault version does not change.
+        """
+        connection = connections[self.db]
+        fields = [self.model._meta.get_field(name) for name in ('password', 'key_id', 'updated_at')]
+        pk = self.model._meta.pk
+        quote = connection.ops.quote_name
+        sql = (f"UPDATE {quote(self.model._meta.db_table)} SET "
+               f"{', '.join(f'{quote(field.column)} = %s' for field in fields)} WHERE {quote(pk.column)} = %s")
+        rows = []
+        for obj in objs:
+            obj.key_id = ciphertext_key_id(obj.password)
+            rows.append([*(field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields), obj.pk])
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
 
 class PasswordVault(models.Model):
     """
     Model representing a password entry in the vault. 
     Each entry contains information such as the user, website name, website URL, password, and creation timestamp.
+    A user can hold only one entry per website name. Deleting entries records a VaultTombstone
+    so that change exports can replay the deletion. 'version' is the user's vault version at the
+    entry's last change, which lets clients fetch only what changed since their last sync.
+    'key_id' is the id of the keyring key the password is encrypted with; key rotation uses it
+    to find the entries still under an old key. Entries live on the shard of their user
+    (password_manager.db_router), so 'user' has no database-level foreign key; when sharded, ids
+    come from allocate_vault_ids and stay unique across shards.
 
-    Methods:  __str__: Returns a string representation of the password entry.
+    Methods:
+    - save: Saves the entry under a new vault version, records the key of its password and refreshes its search terms when the website name or URL may have changed.
+    - delete: Deletes the entry, bumps the vault version and records its tombstone.
+    - __str__: Returns a string representation of the password entry.
     """
-    user = models.CharField(max_length=40,blank=False)
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'vault_entries', db_constraint = False)
     website_name = models.CharField(max_length = 30, blank = False)
     website_url = models.URLField(blank = False)
-    password = models.CharField(max_length = 100,blank = False)
+    password = models.CharField(max_length = 255,blank = False)
+    created_at = models.DateTimeField(auto_now_add = True)
+    updated_at = models.DateTimeField(auto_now = True)
+    version = models.PositiveBigIntegerField(default = 0)
+    key_id = models.PositiveSmallIntegerField(default = 0)
+
+    objects = PasswordVaultQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also serves the (user, website_name[, website_url]) lookups of add, update and delete.
+            models.UniqueConstraint(fields = ['user', 'website_name'], name = 'unique_vault_entry_per_website'),
+        ]
+        indexes = [
+            # Keyset pagination of /api/password/all filters on user and orders by id.
+            models.Index(fields = ['user', 'id'], name = 'vault_user_id_idx'),
+            models.Index(fields = ['created_at'], name = 'vault_created_at_idx'),
+            # Change exports scan the (watermark, upper bound] range of updated_at.
+            models.Index(fields = ['updated_at', 'id'], name = 'vault_updated_at_idx'),
+            # Delta sync reads the entries changed after a given vault version.
+            models.Index(fields = ['user', 'version'], name = 'vault_user_version_idx'),
+            # Key rotation counts and walks the entries that are not yet under the target key.
+            models.Index(fields = ['key_id', 'id'], name = 'vault_key_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        adding = self._state.adding
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(PasswordVault, instance=self)
+        if adding and self.pk is None and is_sharded():
+            self.pk = allocate_vault_ids(1)[0]
+            kwargs.setdefault('force_insert', True)
+        with transaction.atomic(using=using):
+            self.version = VaultVersion.next_for(self.user_id, using=using)
+            self.key_id = ciphertext_key_id(self.password)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version', *(['key_id'] if 'password' in update_fields else [])}
+            super().save(*args, **kwargs)
+            if update_fields is None or {'website_name', 'website_url'} & set(update_fields):
+                VaultSearchTerm.reindex([self], using=using, replace=not adding)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(PasswordVault, instance=self)
+        with transaction.atomic(using=using):
+            version = VaultVersion.next_for(self.user_id, using=using)
+            VaultTombstone.objects.using(using).create(entry_id=self.id, user_id=self.user_id, website_name=self.website_name, version=version)
+            return super().delete(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.user}'s vault for {self.website_name}"
+
+class VaultVersion(models.Model):
+    """
+    Model holding the version counter of a user's vault.
+    The counter is bumped in the same transaction as every add, update or delete, so clients can
+    tell from this single row whether anything changed since their last sync. Vaults that were
+    never changed have no row and are at version 0.
+
+    Methods:
+    - next_for: Bumps the counter of a user and returns the new version.
+    - current: Returns the current version of a user's vault.
+    - __str__: Returns a string representation of the version.
+    """
+    user = models.OneToOneField(User, on_delete = models.CASCADE, primary_key = True, related_name = 'vault_version', db_constraint = False)
+    version = models.PositiveBigIntegerField(default = 0)
+
+    @classmethod
+    def next_for(cls, user_id, using=None):
+        """
+        Bump the vault version of a user. Must run inside the transaction that makes the change;
+        the row stays locked until it commits, so concurrent writers get increasing versions in commit order.
+
+        Parameters:
+        - user_id (int): Id of the vault owner.
+        - using (str): Database alias, the user's shard by default.
+        Returns: int: The new version.
+        """
+        manager = cls.objects.using(using or router.db_for_write(cls, instance=cls(user_id=user_id)))
+        if not manager.filter(user_id=user_id).update(version=models.F('version') + 1):
+            try:
+                with transaction.atomic(using=using):
+                    manager.create(user_id=user_id, version=1)
+                return 1
+            except IntegrityError:
+                manager.filter(user_id=user_id).update(version=models.F('version') + 1)
+        return manager.filter(user_id=user_id).values_list('version', flat=True).get()
+
+    @classmethod
+    def current(cls, user_id, using=None):
+        """Return the vault version of a user, 0 if the vault was never changed."""
+        return cls.objects.using(using).filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+    def __str__(self):
+        return f"{self.user}'s vault at version {self.version}"
+
+class VaultSearchTerm(models.Model):
+    """
+    Model holding the trigram index used to search a user's vault by website name and URL.
+    Every entry has one row per distinct trigram of its marked website name and URL. The user
+    id is copied onto each row so that lookups are answered by the (user_id, term) index alone.
+    Rows are removed together with their entry by the foreign key cascade.
+
+    Methods:
+    - reindex: Replaces the terms of the given entries.
+    - __str__: Returns a string representation of the term.
+    """
+    entry = models.ForeignKey(PasswordVault, on_delete = models.CASCADE, related_name = 'search_terms')
+    user_id = models.IntegerField()
+    term = models.CharField(max_length = 3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['entry', 'term'], name = 'unique_search_term_per_entry'),
+        ]
+        indexes = [
+            models.Index(fields = ['user_id', 'term', 'entry'], name = 'vault_search_term_idx'),
+        ]
+
+    @classmethod
+    def reindex(cls, entries, using=None, replace=True):
+        """
+        Replace the search terms of saved entries with terms built from their current website name and URL.
+        Pass replace=False for entries that were just inserted and have no terms yet.
+        """
+        entries = [entry for entry in entries if entry.pk is not None]
+        if not entries:
+            return
+        manager = cls.objects.using(using)
+        if replace:
+            manager.filter(entry__in=[entry.pk for entry in entries]).delete()
+        manager.bulk_create([cls(entry_id=entry.pk, user_id=entry.user_id, term=term)
+                             for entry in entries for term in search_terms(entry.website_name, entry.website_url)],
+                            batch_size=1000)
+
+    def __str__(self):
+        return f"Search term '{self.term}' of vault entry {self.entry_id}"
+
+class VaultTombstone(models.Model):
+    """
+    Model recording a deleted password entry so that change exports can emit the deletion.
+    The user is stored as a plain id so tombstones outlive the deletion of the user.
+    'version' is the vault version the deletion was made under; it is empty for deletions made
+    before vault versions existed and for entries removed together with their user.
+
+    Methods:
+    - for_entries: Builds unsaved tombstones for the entries of a queryset.
+    - __str__: Returns a string representation of the tombstone.
+    """
+    entry_id = models.BigIntegerField()
+    user_id = models.IntegerField()
+    website_name = models.CharField(max_length = 30)
+    deleted_at = models.DateTimeField(auto_now_add = True)
+    version = models.PositiveBigIntegerField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['deleted_at', 'id'], name = 'tombstone_deleted_at_idx'),
+            models.Index(fields = ['user_id', 'version'], name = 'tombstone_user_version_idx'),
+        ]
+
+    @classmethod
+    def for_entries(cls, entries):
+        return [cls(entry_id=entry_id, user_id=user_id, website_name=website_name)
+                for entry_id, user_id, website_name in entries.values_list('id', 'user_id', 'website_name')]
+
+    def __str__(self):
+        return f"Tombstone of vault entry {self.entry_id}"
+
+@receiver(pre_delete, sender=User)
+def record_tombstones_for_deleted_user(sender, instance, using, **kwargs):
+    """
+    Record tombstones for the vault entries removed by the cascade when a user is deleted.
+    The cascade only reaches the database the user is deleted from, so a vault on another shard is deleted here.
+    """
+    shard = VaultShard.objects.using(PRIMARY).filter(user_id=instance.pk).values_list('shard', flat=True).first() or using
+    VaultTombstone.objects.using(shard).bulk_create(VaultTombstone.for_entries(PasswordVault.objects.using(shard).filter(user=instance)))
+    if shard != using:
+        with transaction.atomic(using=shard):
+            for model in (PendingNotification, VaultVersion):
+                model.objects.using(shard).filter(user_id=instance.pk).delete()
+            # The tombstones are already recorded; skip the ones PasswordVaultQuerySet.delete() would add.
+            models.QuerySet.delete(PasswordVault.objects.using(shard).filter(user_id=instance.pk))
+
+class ExportWatermark(models.Model):
+    """
+    Model holding the high-water mark of an incremental export stream.
+    'watermark' is the upper bound of the last exported window. While a run is in progress or
+    after it failed, 'pending_until' keeps the upper bound of that window so a retry exports
+    exactly the same window to the same files.
+
+    Methods:  __str__: Returns a string representation of the watermark.
+    """
+    stream = models.CharField(max_length = 50, unique = True)
+    watermark = models.DateTimeField()
+    pending_until = models.DateTimeField(null = True, blank = True)
+    updated_at = models.DateTimeField(auto_now = True)
+
+    def __str__(self):
+        return f"{self.stream} exported up to {self.watermark}"
+
+class ImportJob(models.Model):
+    """
+    Model tracking a bulk vault import that runs as a Celery job.
+    The rows waiting to be imported are kept encrypted and cleared once the job finishes;
+    the per-row report is kept so the client can poll for the outcome.
+
+    Methods:  __str__: Returns a string representation of the import job.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (COMPLETED, 'Completed'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'import_jobs')
+    status = models.CharField(max_length = 10, choices = STATUS_CHOICES, default = PENDING)
+    total = models.PositiveIntegerField(default = 0)
+    processed = models.PositiveIntegerField(default = 0)
+    imported = models.PositiveIntegerField(default = 0)
+    rows = models.JSONField(default = list)
+    report = models.JSONField(default = list)
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return f"{self.user}'s import #{self.id} ({self.status})"
+
+class KeyRotationJob(models.Model):
+    """
+    Model tracking the re-encryption of the vault under a new key.
+    When the job starts, the id range of the entries not yet under 'key_id' is split into
+    KeyRotationChunk rows. Chunks are both the unit of parallel work and the checkpoint:
+    a chunk is marked done in the transaction that rewrites its entries, so a job resumed
+    after a crash only redoes the chunks that were in flight.
+
+    Methods:  __str__: Returns a string representation of the rotation job.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (COMPLETED, 'Completed'), (FAILED, 'Failed')]
+
+    key_id = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length = 10, choices = STATUS_CHOICES, default = PENDING)
+    workers = models.PositiveSmallIntegerField(default = 1)
+    total = models.PositiveIntegerField(default = 0)
+    rotated = models.PositiveIntegerField(default = 0)
+    chunks_total = models.PositiveIntegerField(default = 0)
+    chunks_done = models.PositiveIntegerField(default = 0)
+    error = models.TextField(blank = True)
+    created_at = models.DateTimeField(auto_now_add = True)
+    updated_at = models.DateTimeField(auto_now = True)
+    finished_at = models.DateTimeField(null = True, blank = True)
+
+    def __str__(self):
+        return f"Key rotation #{self.id} to key {self.key_id} ({self.status})"
+
+class KeyRotationChunk(models.Model):
+    """
+    Model holding one id range [start_id, end_id) of a key rotation job on one vault shard.
+    A worker claims a pending chunk by moving it to running; 'claimed_at' lets another worker
+    take over a chunk whose worker died before finishing it.
+
+    Methods:  __str__: Returns a string representation of the chunk.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (COMPLETED, 'Completed')]
+
+    job = models.ForeignKey(KeyRotationJob, on_delete = models.CASCADE, related_name = 'chunks')
+    shard = models.CharField(max_length = 50, default = PRIMARY)
+    start_id = models.BigIntegerField()
+    end_id = models.BigIntegerField()
+    status = models.CharField(max_length = 10, choices = STATUS_CHOICES, default = PENDING)
+    rotated = models.PositiveIntegerField(default = 0)
+    claimed_at = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['job', 'status', 'id'], name = 'rotation_chunk_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ids {self.start_id}-{self.end_id} on {self.shard} of key rotation #{self.job_id} ({self.status})"
+
+class PendingNotification(models.Model):
+    """
+    Model queueing a vault event that still has to be mailed to the user.
+    Events are collected per user and sent as one digest email once the notification window has passed.
+
+    Methods:  __str__: Returns a string representation of the notification.
+    """
+    ADDED = 'added'
+    UPDATED = 'updated'
+    EVENT_CHOICES = [(ADDED, 'Password added'), (UPDATED, 'Password updated')]
+
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'pending_notifications', db_constraint = False)
+    event = models.CharField(max_length = 10, choices = EVENT_CHOICES)
+    website_name = models.CharField(max_length = 30)
     created_at = models.DateTimeField(auto_now_add = True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields = ['created_at'], name = 'notification_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} notification for {self.user} ({self.website_name})"
+
+class OutboxMessage(models.Model):
+    """
+    Model holding a Celery task that is published to the broker only after the transaction that
+    wrote it has committed. Views write the message together with their change, so a request
+    never waits on the broker and no task is lost when the broker is down; the relay publishes
+    pending messages later (see password_app.outbox).
+
+    'dedupe_key' keeps the same logical task from being queued twice. 'task_id' is the Celery task
+    id the message is published under; a message published twice is still run only once because
+    'delivered_at' is set when a worker first runs it. 'claim' and 'available_at' hand each
+    pending message to a single relay and delay retries after a failed publish.
+
+    Methods:  __str__: Returns a string representation of the message.
+    """
+    task = models.CharField(max_length = 200)
+    args = models.JSONField(default = list)
+    kwargs = models.JSONField(default = dict)
+    dedupe_key = models.CharField(max_length = 100, unique = True, null = True, blank = True)
+    task_id = models.UUIDField(default = uuid.uuid4, unique = True, editable = False)
+    claim = models.UUIDField(null = True, blank = True)
+    attempts = models.PositiveIntegerField(default = 0)
+    last_error = models.TextField(blank = True)
+    created_at = models.DateTimeField(auto_now_add = True)
+    available_at = models.DateTimeField(default = timezone.now)
+    published_at = models.DateTimeField(null = True, blank = True)
+    delivered_at = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            # The relay looks for unpublished messages that are due, oldest first.
+            models.Index(fields = ['published_at', 'available_at', 'id'], name = 'outbox_pending_idx'),
+            models.Index(fields = ['claim'], name = 'outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"Outbox message {self.task_id} for {self.task}"
+
+class VaultShard(models.Model):
+    """
+    Model recording the database a user's vault lives on when the vault is sharded (see
+    password_manager.db_router). A user gets a row, on the shard picked by a stable hash of their
+    id, the first time their vault is routed; rebalance_vault moves a vault by changing the row.
+    'moving' is set while a move copies the vault, and writes to it are refused meanwhile.
+
+    Methods:  __str__: Returns a string representation of the directory entry.
+    """
+    user = models.OneToOneField(User, on_delete = models.CASCADE, primary_key = True, related_name = 'vault_shard')
+    shard = models.CharField(max_length = 50)
+    moving = models.BooleanField(default = False)
+    updated_at = models.DateTimeField(auto_now = True)
+
+    def __str__(self):
+        return f"{self.user}'s vault on {self.shard}" + (" (moving)" if self.moving else "")
+
+class VaultIdSequence(models.Model):
+    """
+    Model holding the next free vault entry id when the vault is sharded. Processes reserve
+    blocks of ids from it (password_manager.sharding.allocate_vault_ids), so entry ids are unique
+    across shards and an entry keeps its id when its vault is moved.
+
+    Methods:  __str__: Returns a string representation of the sequence.
+    """
+    name = models.CharField(max_length = 50, unique = True)
+    next_id = models.PositiveBigIntegerField()
+
     def __str__(self):
-        return f"{self.user}'s vault for {self.website_name}"
\ No newline at end of file
+        return f"Sequence {self.name} at {self.next_id}"
@@ -0,0 +1,195 @@
+import smtplib
+from itertools import groupby, count
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.core.cache import caches
+from django.core.mail import EmailMessage, get_connection
+from django.contrib.auth.models import User
+from password_manager import settings
+from password_manager.db_router import PRIMARY
+from password_manager.sharding import for_each_shard
+from .models import PendingNotification
+
+def password_added_message(user, website_name):
+    """Return the subject and body of the email sent when a single password is added."""
+    subject = "New Password Added Successfully!"
+    message = f"Dear {user},\n\nWe are pleased to inform you that a new password for {website_name} has been added to your account successfully.\n\nThank you for entrusting us with your password management needs.\n\nBest regards,\nTeam Password Manager"
+    return subject, message
+
+def password_updated_message(user, website_name):
+    """Return the subject and body of the email sent when a single password is updated."""
+    subject = f"Password Updated for {website_name}"
+    message = f"Dear {user},\n\nWe would like to inform you that the password for {website_name} has been successfully updated in your account.\n\nThank you for keeping your account secure and up-to-date.\n\nBest regards,\nTeam Password Manager"
+    return subject, message
+
+def digest_message(user, events):
+    """
+    Return the subject and body of the email summarising several vault events.
+
+    Parameters:
+    - user (str): The username of the user.
+    - events (list): (event, website_name) pairs in the order they happened.
+    """
+    if len(events) == 1:
+        event, website_name = events[0]
+        builder = password_added_message if event == PendingNotification.ADDED else password_updated_message
+        return builder(user, website_name)
+    lines = "\n".join(f"- {'New password added' if event == PendingNotification.ADDED else 'Password updated'} for {website_name}"
+                      for event, website_name in events)
+    subject = f"{len(events)} changes to your Password Manager vault"
+    message = f"Dear {user},\n\nThe following changes were made to your account:\n\n{lines}\n\nThank you for keeping your account secure and up-to-date.\n\nBest regards,\nTeam Password Manager"
+    return subject, message
+
+def queue_notification(user, event, website_name):
+    """
+    Queue a vault event for the user's next digest email.
+
+    Parameters:
+    - user (User): User the event belongs to.
+    - event (str): PendingNotification.ADDED or PendingNotification.UPDATED.
+    - website_name (str): The name of the website concerned.
+    """
+    PendingNotification.objects.create(user=user, event=event, website_name=website_name)
+
+def _email_domain(email):
+    return email.rsplit('@', 1)[-1].lower()
+
+def _domain_key(domain):
+    return f"{domain}:{int(timezone.now().timestamp() // 60)}"
+
+def _domain_has_room(domain):
+    """Tell whether a recipient domain is below NOTIFICATION_DOMAIN_RATE_LIMIT messages this minute, without counting one."""
+    return (caches['notification_rate'].get(_domain_key(domain)) or 0) < settings.NOTIFICATION_DOMAIN_RATE_LIMIT
+
+def _take_domain_slot(domain):
+    """
+    Count a message about to be sent to a recipient domain against its per-minute limit.
+
+    Returns: str | None: The counter key to hand back with _release_domain_slot if the send fails, None if the limit is reached.
+    """
+    cache = caches['notification_rate']
+    key = _domain_key(domain)
+    cache.add(key, 0, timeout=60)
+    try:
+        if cache.incr(key) <= settings.NOTIFICATION_DOMAIN_RATE_LIMIT:
+            return key
+        cache.decr(key)
+    except ValueError:
+        # The counter expired with its minute; the message counts against the next one.
+        return key
+    return None
+
+def _release_domain_slot(key):
+    """Give back the slot of a message that was not sent."""
+    try:
+        caches['notification_rate'].decr(key)
+    except ValueError:
+        pass
+
+def _due_users(notifications, cutoff):
+    """
+    Return the users with an event queued before the cutoff, at most NOTIFICATION_FLUSH_BATCH of them.
+    Users are taken oldest pending event first, skipping those whose email domain has reached its
+    limit this minute, so held-back users never crowd the others out of the batch.
+
+    Returns: dict: User (username and email loaded) by id.
+    """
+    batch = settings.NOTIFICATION_FLUSH_BATCH
+    candidates = (notifications.filter(created_at__lte=cutoff).values('user_id')
+                  .annotate(oldest=Min('created_at')).order_by('oldest', 'user_id'))
+    due, full_domains = {}, set()
+    for offset in count(0, batch):
+        page = [row['user_id'] for row in candidates[offset:offset + batch]]
+        # Users stay on the primary when the vault is sharded.
+        users = User.objects.using(PRIMARY).only('username', 'email').in_bulk(page)
+        for user_id in page:
+            user = users.get(user_id)
+            if user is None:
+                continue
+            domain = _email_domain(user.email)
+            if domain in full_domains or not _domain_has_room(domain):
+                full_domains.add(domain)
+                continue
+            due[user_id] = user
+            if len(due) == batch:
+                return due
+        if len(page) < batch:
+            return due
+
+def _send_digests(digests):
+    """
+    Send digests one by one over a single SMTP connection.
+
+    Parameters: digests (list): (user, EmailMessage, ids of the events it covers) tuples.
+    Returns: tuple: (number of digests sent, ids of the events they delivered, ids of the events dropped
+    because their recipient was refused, error that stopped the sending or None).
+    """
+    sent, delivered, dropped, error = 0, [], [], None
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        for user, message, event_ids in digests:
+            slot = _take_domain_slot(_email_domain(user.email))
+            if slot is None:
+                continue
+            try:
+                connection.send_messages([message])
+            except smtplib.SMTPRecipientsRefused as e:
+                # The address would be refused on every run; its events are dropped rather than retried.
+                _release_domain_slot(slot)
+                print(f"Error: Notification digest to {user.email} refused, dropping {len(event_ids)} event(s): {e}")
+                dropped.extend(event_ids)
+                continue
+            except Exception as e:
+                _release_domain_slot(slot)
+                error = e
+                break
+            sent += 1
+            delivered.extend(event_ids)
+    finally:
+        try:
+            connection.close()
+        except Exception as e:
+            # Every digest was accepted already; a failed QUIT must not get them sent again.
+            print(f"Error: Unable to close the SMTP connection: {e}")
+    return sent, delivered, dropped, error
+
+def flush_notifications():
+    """
+    Send one digest email to every user whose oldest queued event is older than NOTIFICATION_WINDOW.
+
+    Every vault shard is flushed in parallel, and all digests of a shard go through
+    a single SMTP connection, one message at a time. Users whose email domain has
+    reached NOTIFICATION_DOMAIN_RATE_LIMIT messages this minute, counted across all
+    workers in the 'notification_rate' cache, are left queued for the next run. The
+    events of each accepted digest are deleted in the same transaction; if the
+    connection fails part way, the digests already accepted are not sent again and
+    the error is raised once they are recorded.
+
+    Returns: tuple: (number of emails sent, number of events delivered).
+    """
+    flushed = for_each_shard(_flush_shard).values()
+    return sum(sent for sent, _ in flushed), sum(delivered for _, delivered in flushed)
+
+def _flush_shard(alias):
+    cutoff = timezone.now() - timedelta(seconds=settings.NOTIFICATION_WINDOW)
+    notifications = PendingNotification.objects.using(alias)
+    users = _due_users(notifications, cutoff)
+    if not users:
+        return 0, 0
+
+    with transaction.atomic(using=alias):
+        pending = list(notifications.select_for_update(skip_locked=True).filter(user_id__in=users).order_by('user_id', 'id'))
+        digests = []
+        for user_id, events in groupby(pending, key=lambda notification: notification.user_id):
+            events = list(events)
+            user = users[user_id]
+            subject, body = digest_message(user.username, [(event.event, event.website_name) for event in events])
+            digests.append((user, EmailMessage(subject, body, settings.EMAIL_HOST_USER, [user.email]), [event.id for event in events]))
+        sent, delivered, dropped, error = _send_digests(digests) if digests else (0, [], [], None)
+        notifications.filter(id__in=delivered + dropped).delete()
+    if error is not None:
+        raise error
+    return sent, len(delivered)
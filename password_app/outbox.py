@@ -0,0 +1,129 @@
+import uuid
+from datetime import timedelta
+from celery import Task
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from password_manager import settings
+from password_manager.celery import app
+from .models import OutboxMessage
+
+def enqueue(task, args=(), kwargs=None, dedupe_key=None):
+    """
+    Write a task to the outbox. Call it inside the transaction that makes the change the task
+    is about: the task is published by the relay only if that transaction commits.
+
+    Parameters:
+    - task (Task or str): The Celery task or its name.
+    - args (tuple): Positional arguments of the task, JSON serializable.
+    - kwargs (dict): Keyword arguments of the task, JSON serializable.
+    - dedupe_key (str): Optional key of the logical task; a second message with the same key is not written.
+    Returns: OutboxMessage: The new message, or the existing one with the same dedupe key.
+    """
+    name = task if isinstance(task, str) else task.name
+    try:
+        with transaction.atomic():
+            return OutboxMessage.objects.create(task=name, args=list(args), kwargs=kwargs or {}, dedupe_key=dedupe_key)
+    except IntegrityError:
+        if dedupe_key is None:
+            raise
+        return OutboxMessage.objects.get(dedupe_key=dedupe_key)
+
+def claim_messages(batch_size):
+    """
+    Claim up to batch_size due messages for this relay, oldest first.
+    The claim is a conditional UPDATE that also pushes available_at out by OUTBOX_LEASE, so
+    concurrent relays never publish the same message while a claim is held.
+
+    Parameters: batch_size (int): Most messages to claim.
+    Returns: list: The claimed OutboxMessage objects.
+    """
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(published_at=None, available_at__lte=now)
+    ids = list(due.order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    claim = uuid.uuid4()
+    due.filter(id__in=ids).update(claim=claim, available_at=now + timedelta(seconds=settings.OUTBOX_LEASE))
+    return list(OutboxMessage.objects.filter(claim=claim, published_at=None).order_by('id'))
+
+def publish_messages(messages):
+    """
+    Publish claimed messages to the broker over one producer connection, in order.
+    Published messages are marked with a single UPDATE. On the first failure the message gets
+    an exponential backoff and the rest of the batch is released for the next run, since the
+    broker is most likely down.
+
+    Delivery is at least once: a relay that dies between publishing and marking leaves the
+    messages claimed, and they are published again once the lease runs out, under the same
+    task id, which OutboxTask runs only once.
+
+    Parameters: messages (list): OutboxMessage objects claimed by this relay.
+    Returns: tuple: (number of messages published, error of the failed publish or None).
+    """
+    published, error = [], None
+    with app.producer_or_acquire() as producer:
+        for message in messages:
+            try:
+                app.send_task(message.task, args=message.args, kwargs=message.kwargs, task_id=str(message.task_id), producer=producer)
+            except Exception as exc:
+                error = exc
+                break
+            published.append(message.id)
+    now = timezone.now()
+    if published:
+        OutboxMessage.objects.filter(id__in=published).update(published_at=now, claim=None)
+    if error is not None:
+        failed = messages[len(published)]
+        backoff = min(2 ** failed.attempts, settings.TASK_RETRY_BACKOFF_MAX)
+        OutboxMessage.objects.filter(id=failed.id).update(attempts=failed.attempts + 1, last_error=repr(error), claim=None,
+                                                          available_at=now + timedelta(seconds=backoff))
+        OutboxMessage.objects.filter(id__in=[message.id for message in messages[len(published) + 1:]]).update(claim=None, available_at=now)
+    return len(published), error
+
+def relay_messages(batch_size=None, max_batches=None):
+    """
+    Publish due outbox messages batch by batch until none is left, a publish fails or
+    max_batches batches were sent, then drop messages published more than OUTBOX_RETENTION
+    seconds ago.
+
+    Parameters:
+    - batch_size (int): Messages per batch, by default OUTBOX_BATCH_SIZE.
+    - max_batches (int): Most batches to send, no limit by default.
+    Returns: tuple: (number of messages published, error of a failed publish or None).
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    total, batches, error = 0, 0, None
+    while error is None and (max_batches is None or batches < max_batches):
+        messages = claim_messages(batch_size)
+        if not messages:
+            break
+        published, error = publish_messages(messages)
+        total += published
+        batches += 1
+    OutboxMessage.objects.filter(published_at__lt=timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)).delete()
+    return total, error
+
+class OutboxTask(Task):
+    """
+    Base class of tasks queued through the outbox. A copy of a message that was published
+    twice is skipped: the first worker to run the task id marks the message delivered, and
+    the mark is removed again if the task fails so a retry still runs. Tasks called directly
+    with delay() have no outbox message and always run.
+    """
+
+    def __call__(self, *args, **kwargs):
+        task_id = self.request.id
+        if task_id is None:
+            return super().__call__(*args, **kwargs)
+        try:
+            task_id = uuid.UUID(task_id)
+        except ValueError:
+            return super().__call__(*args, **kwargs)
+        messages = OutboxMessage.objects.filter(task_id=task_id)
+        if not messages.filter(delivered_at=None).update(delivered_at=timezone.now()) and messages.exists():
+            return None
+        try:
+            return super().__call__(*args, **kwargs)
+        except BaseException:
+            messages.update(delivered_at=None)
+            raise
@@ -0,0 +1,106 @@
+import time
+from django.db import models, transaction
+from django.db.models import Count, Max
+from password_manager import settings
+from password_manager.db_router import PRIMARY, lookup_shard, forget_shard
+from .models import PasswordVault, VaultVersion, VaultSearchTerm, VaultTombstone, PendingNotification, VaultShard
+
+# Rows copied per INSERT when a vault is moved.
+MOVE_BATCH_SIZE = 500
+# Times a vault is copied again when it changed during the copy before the move gives up.
+MOVE_ATTEMPTS = 3
+
+class VaultMoveFailed(Exception):
+    """Raised when a vault kept changing while it was copied; it stays on its shard."""
+
+def _fingerprint(user_id, alias):
+    """Return what changes whenever anything is written to a vault: its version, entry count, latest update and tombstone count."""
+    entries = PasswordVault.objects.using(alias).filter(user_id=user_id).aggregate(count=Count('id'), updated=Max('updated_at'))
+    return (VaultVersion.current(user_id, using=alias), entries['count'], entries['updated'],
+            VaultTombstone.objects.using(alias).filter(user_id=user_id).count())
+
+def _delete_vault(user_id, alias):
+    """Delete every row of a vault from a shard, without the tombstones and version bump of a user-facing delete."""
+    with transaction.atomic(using=alias):
+        VaultSearchTerm.objects.using(alias).filter(user_id=user_id).delete()
+        models.QuerySet.delete(PasswordVault.objects.using(alias).filter(user_id=user_id))
+        for model in (VaultTombstone, PendingNotification, VaultVersion):
+            model.objects.using(alias).filter(user_id=user_id).delete()
+
+def _copy_rows(model, user_id, source, target, keep_ids):
+    """Copy the rows of a user from one shard to another as they are, timestamps included; returns the copied rows."""
+    fields = [field for field in model._meta.concrete_fields if keep_ids or not field.primary_key]
+    rows = list(model.objects.using(source).filter(user_id=user_id).order_by('pk'))
+    for start in range(0, len(rows), MOVE_BATCH_SIZE):
+        # A raw insert keeps created_at and updated_at instead of stamping the time of the copy.
+        model._base_manager._insert(rows[start:start + MOVE_BATCH_SIZE], fields=fields, raw=True, using=target)
+    return rows
+
+def _copy_vault(user_id, source, target):
+    """Replace the copy of a vault on the target shard with the rows on the source shard, in one transaction."""
+    with transaction.atomic(using=target):
+        _delete_vault(user_id, target)
+        entries = _copy_rows(PasswordVault, user_id, source, target, keep_ids=True)
+        VaultSearchTerm.reindex(entries, using=target, replace=False)
+        copied = {'entries': len(entries)}
+        for name, model, keep_ids in (('versions', VaultVersion, True), ('tombstones', VaultTombstone, False), ('notifications', PendingNotification, False)):
+            copied[name] = len(_copy_rows(model, user_id, source, target, keep_ids))
+    return copied
+
+def move_vault(user_id, target, grace=None):
+    """
+    Move a user's vault to another shard while the service keeps running.
+
+    The directory entry is marked as moving first and the move waits `grace` seconds, until
+    every process has dropped its cached entry; from then on writes to the vault are refused
+    with HTTP 503 while reads keep being served from the source. The vault is copied to the
+    target in one transaction, entry ids and timestamps included, and copied again if its
+    fingerprint on the source changed meanwhile. The directory is then switched to the target,
+    and after another grace period, during which processes may still read the source, the
+    source rows are deleted. If anything fails before the switch the vault stays where it was.
+
+    Parameters:
+    - user_id (int): Id of the vault owner.
+    - target (str): Alias of the shard to move to.
+    - grace (float): Seconds to wait for processes to see a directory change, SHARD_DIRECTORY_CACHE_TIMEOUT by default.
+    Returns: dict: Number of rows copied per kind, empty if the vault already was on the target.
+    Raises: ValueError: If the target is not a shard. VaultMoveFailed: If the vault kept changing during the copy.
+    """
+    if target not in settings.DATABASE_SHARD_ALIASES:
+        raise ValueError(f"Unknown shard '{target}'; shards are {', '.join(settings.DATABASE_SHARD_ALIASES)}")
+    grace = settings.SHARD_DIRECTORY_CACHE_TIMEOUT if grace is None else grace
+    source, _ = lookup_shard(user_id)
+    if source == target:
+        return {}
+    directory = VaultShard.objects.using(PRIMARY).filter(user_id=user_id)
+    directory.update(moving=True)
+    forget_shard(user_id)
+    try:
+        time.sleep(grace)
+        for _ in range(MOVE_ATTEMPTS):
+            fingerprint = _fingerprint(user_id, source)
+            copied = _copy_vault(user_id, source, target)
+            if _fingerprint(user_id, source) == fingerprint == _fingerprint(user_id, target):
+                break
+        else:
+            raise VaultMoveFailed(f"The vault of user {user_id} kept changing while it was copied to {target}")
+    except BaseException:
+        _delete_vault(user_id, target)
+        directory.update(moving=False)
+        forget_shard(user_id)
+        raise
+    directory.update(shard=target, moving=False)
+    forget_shard(user_id)
+    time.sleep(grace)
+    _delete_vault(user_id, source)
+    return copied
+
+def shard_usage():
+    """
+    Return how the vault is spread over the shards.
+
+    Returns: dict: For each shard alias, the number of users the directory places on it and the number of entries it holds.
+    """
+    users = dict(VaultShard.objects.using(PRIMARY).values_list('shard').annotate(count=Count('user')).order_by())
+    return {alias: {'users': users.get(alias, 0), 'entries': PasswordVault.objects.using(alias).count()}
+            for alias in settings.DATABASE_SHARD_ALIASES}
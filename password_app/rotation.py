@@ -0,0 +1,181 @@
+import time
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Q, Min, Max
+from django.utils import timezone
+from password_manager import settings
+from password_manager.keyring import get_key, current_key_id
+from password_manager.db_router import PRIMARY
+from password_manager.sharding import for_each_shard
+from password_manager.utility import encrypt_passwords, decrypt_passwords
+from .models import PasswordVault, KeyRotationJob, KeyRotationChunk
+
+def start_key_rotation(key_id=None, chunk_size=None, workers=None):
+    """
+    Plan a rotation of every vault entry that is not yet encrypted under a key.
+    The id range of those entries on each shard is split into chunks of chunk_size ids; the
+    chunks are then processed by rotation workers (run_rotation_worker) in any order and in parallel.
+
+    Parameters:
+    - key_id (int): Key to re-encrypt under, by default ENCRYPTION_KEY_ID.
+    - chunk_size (int): Ids per chunk, by default KEY_ROTATION_CHUNK_SIZE.
+    - workers (int): Number of workers the job is meant to run on, by default KEY_ROTATION_WORKERS.
+    Returns: KeyRotationJob: The job, already completed when there is nothing to rotate.
+    Raises: UnknownEncryptionKey: If the key, or a key entries are encrypted under, is not in the keyring.
+    """
+    key_id = current_key_id() if key_id is None else key_id
+    shards = for_each_shard(lambda alias: _plan_shard(alias, key_id))
+    # Every key the entries are under has to be in the keyring to decrypt them.
+    for used_key_id in {key_id}.union(*(used_key_ids for used_key_ids, _, _ in shards.values())):
+        get_key(used_key_id)
+    chunk_size = chunk_size or settings.KEY_ROTATION_CHUNK_SIZE
+    workers = workers or settings.KEY_ROTATION_WORKERS
+    with transaction.atomic():
+        job = KeyRotationJob.objects.create(key_id=key_id, workers=workers, total=sum(total for _, _, total in shards.values()), status=KeyRotationJob.RUNNING)
+        for alias, (_, bounds, _) in shards.items():
+            if bounds['low'] is not None:
+                KeyRotationChunk.objects.bulk_create((KeyRotationChunk(job=job, shard=alias, start_id=start, end_id=min(start + chunk_size, bounds['high'] + 1))
+                                                      for start in range(bounds['low'], bounds['high'] + 1, chunk_size)),
+                                                     batch_size=1000)
+        job.chunks_total = job.chunks.count()
+        if not job.chunks_total:
+            job.status, job.finished_at = KeyRotationJob.COMPLETED, timezone.now()
+        job.save()
+    return job
+
+def _plan_shard(alias, key_id):
+    entries = PasswordVault.objects.using(alias)
+    pending = entries.exclude(key_id=key_id)
+    return (set(entries.values_list('key_id', flat=True).order_by('key_id').distinct()),
+            pending.aggregate(low=Min('id'), high=Max('id')), pending.count())
+
+def resume_key_rotation(job_id):
+    """
+    Put a failed or interrupted job back to running so workers pick up its remaining chunks.
+    Chunks that a dead worker left running are handed out again once their lease expires.
+
+    Parameters: job_id (int): Id of the KeyRotationJob.
+    Returns: KeyRotationJob: The job.
+    """
+    job = KeyRotationJob.objects.get(id=job_id)
+    get_key(job.key_id)
+    if job.status != KeyRotationJob.COMPLETED:
+        KeyRotationJob.objects.filter(id=job_id).update(status=KeyRotationJob.RUNNING, error='', updated_at=timezone.now())
+        job.refresh_from_db()
+    return job
+
+def claim_chunk(job):
+    """
+    Claim the next chunk of a job that is pending or whose lease has expired.
+    The claim is a conditional UPDATE, so two workers never get the same chunk while its lease runs.
+
+    Parameters: job (KeyRotationJob): The job.
+    Returns: KeyRotationChunk or None: The claimed chunk, None when no chunk is left to claim.
+    """
+    while True:
+        now = timezone.now()
+        claimable = Q(status=KeyRotationChunk.PENDING) | Q(status=KeyRotationChunk.RUNNING, claimed_at__lt=now - timedelta(seconds=settings.KEY_ROTATION_LEASE))
+        candidates = list(KeyRotationChunk.objects.filter(claimable, job=job).order_by('id').values_list('id', flat=True)[:10])
+        if not candidates:
+            return None
+        for chunk_id in candidates:
+            if KeyRotationChunk.objects.filter(claimable, id=chunk_id).update(status=KeyRotationChunk.RUNNING, claimed_at=now):
+                return KeyRotationChunk.objects.get(id=chunk_id)
+
+def rotate_chunk(chunk, key_id):
+    """
+    Re-encrypt the entries of a chunk that are not yet under a key and mark the chunk done,
+    all in one transaction. The entries are locked while they are rewritten, so a concurrent
+    update of an entry is never overwritten with its old password. For a chunk on another shard
+    than the primary, the shard commits first and the chunk is marked done right after; if that
+    fails, the chunk is redone and finds nothing left to rotate.
+
+    Only the password, key_id and updated_at change: the plain-text password and so the vault
+    version stay the same and clients do not resync, while change exports pick the new
+    ciphertext up through updated_at.
+
+    Parameters:
+    - chunk (KeyRotationChunk): A chunk claimed by this worker.
+    - key_id (int): Key to re-encrypt under.
+    Returns: int: Number of entries re-encrypted.
+    """
+    with transaction.atomic(using=PRIMARY), transaction.atomic(using=chunk.shard):
+        now = timezone.now()
+        # Renew the lease first: writing before reading makes SQLite take its write lock up front
+        # (waiting out other writers) instead of failing to upgrade a read transaction later.
+        KeyRotationChunk.objects.filter(id=chunk.id).update(claimed_at=now)
+        entries = list(PasswordVault.objects.using(chunk.shard).select_for_update()
+                       .filter(id__gte=chunk.start_id, id__lt=chunk.end_id).exclude(key_id=key_id)
+                       .only('id', 'password'))
+        if entries:
+            passwords = encrypt_passwords(decrypt_passwords([entry.password for entry in entries]), key_id=key_id)
+            for entry, password in zip(entries, passwords):
+                entry.password = password
+                entry.updated_at = now
+            PasswordVault.objects.using(chunk.shard).bulk_update_passwords(entries)
+        # A chunk taken over after its lease expired may already have been finished by its first worker.
+        if KeyRotationChunk.objects.filter(id=chunk.id).exclude(status=KeyRotationChunk.COMPLETED).update(status=KeyRotationChunk.COMPLETED, rotated=len(entries)):
+            KeyRotationJob.objects.filter(id=chunk.job_id).update(rotated=F('rotated') + len(entries), chunks_done=F('chunks_done') + 1, updated_at=now)
+    return len(entries)
+
+def release_chunk(chunk):
+    """Hand a chunk this worker could not finish back to the other workers."""
+    KeyRotationChunk.objects.filter(id=chunk.id, status=KeyRotationChunk.RUNNING).update(status=KeyRotationChunk.PENDING, claimed_at=None)
+
+def fail_key_rotation(job_id, error):
+    """Mark a job failed; its workers stop after their current chunk."""
+    KeyRotationJob.objects.filter(id=job_id).exclude(status=KeyRotationJob.COMPLETED).update(status=KeyRotationJob.FAILED, error=str(error), updated_at=timezone.now())
+
+def run_rotation_worker(job_id):
+    """
+    Process chunks of a running job until none is left to claim, then complete the job if all
+    of its chunks are done. Each worker re-encrypts at most KEY_ROTATION_MAX_ROWS_PER_SECOND
+    divided by the job's workers rows per second, sleeping between chunks to keep to it.
+
+    Parameters: job_id (int): Id of the KeyRotationJob.
+    Returns: int: Number of entries this worker re-encrypted.
+    """
+    job = KeyRotationJob.objects.get(id=job_id)
+    rate = settings.KEY_ROTATION_MAX_ROWS_PER_SECOND / max(job.workers, 1)
+    rotated = 0
+    while KeyRotationJob.objects.filter(id=job_id, status=KeyRotationJob.RUNNING).exists():
+        chunk = claim_chunk(job)
+        if chunk is None:
+            break
+        started = time.monotonic()
+        try:
+            count = rotate_chunk(chunk, job.key_id)
+        except Exception:
+            release_chunk(chunk)
+            raise
+        rotated += count
+        if rate:
+            time.sleep(max(0.0, count / rate - (time.monotonic() - started)))
+    now = timezone.now()
+    KeyRotationJob.objects.filter(id=job_id, status=KeyRotationJob.RUNNING, chunks_done=F('chunks_total')).update(status=KeyRotationJob.COMPLETED, finished_at=now, updated_at=now)
+    return rotated
+
+def rotation_progress(job):
+    """
+    Return the progress of a rotation job.
+
+    Parameters: job (KeyRotationJob): The job.
+    Returns: dict: Status, counters, throughput in rows per second and estimated seconds left,
+    plus the entries still not under the job's key, including ones written since the job started.
+    """
+    elapsed = ((job.finished_at or timezone.now()) - job.created_at).total_seconds()
+    rate = job.rotated / elapsed if elapsed > 0 else 0.0
+    left = max(job.total - job.rotated, 0)
+    return {
+        'job': job.id,
+        'key_id': job.key_id,
+        'status': job.status,
+        'rotated': job.rotated,
+        'total': job.total,
+        'chunks_done': job.chunks_done,
+        'chunks_total': job.chunks_total,
+        'rows_per_second': round(rate, 1),
+        'eta_seconds': round(left / rate) if rate and job.status == KeyRotationJob.RUNNING else None,
+        'remaining_under_other_keys': sum(for_each_shard(lambda alias: PasswordVault.objects.using(alias).exclude(key_id=job.key_id).count()).values()),
+        'error': job.error,
+    }
@@ -0,0 +1,121 @@
+import math
+from django.db.models import Count, Exists, OuterRef, F, Q
+from password_manager import settings
+from .models import (PasswordVault,
+                     VaultSearchTerm,
+                     TERM_START,
+                     TERM_END,
+                     normalize_website_url,
+                     trigrams)
+
+PREFIX = 'prefix'
+SUBSTRING = 'substring'
+FUZZY = 'fuzzy'
+SEARCH_MODES = (PREFIX, SUBSTRING, FUZZY)
+# Postings counted per trigram when choosing the rarest one; larger counts are all "common".
+SELECTIVITY_SAMPLE = 1000
+
+def normalize_query(query):
+    """Lower-case a search query and strip the scheme and 'www.' of URL-like queries."""
+    query = query.strip().lower()
+    if '://' in query:
+        return normalize_website_url(query)
+    return query.removeprefix('www.')
+
+def _matches(entry, query, mode):
+    name, url = entry['website_name'].lower(), normalize_website_url(entry['website_url'])
+    if mode == PREFIX:
+        return name.startswith(query) or url.startswith(query)
+    return query in name or query in url
+
+def _candidate_ids(user, query, mode):
+    """
+    Return a queryset of entry ids whose indexed terms can contain the query, in id order.
+
+    Postings of the rarest query trigram are walked in entry order and every other
+    trigram is checked with an index lookup on (entry, term), so a page is found after
+    reading about as many postings as the query is selective, not the whole vault.
+    """
+    marked = f"{TERM_START}{query}" if mode == PREFIX else query
+    if len(marked) < 3:
+        # Every substring of one or two characters starts at least one trigram of the marked value.
+        return (PasswordVault.objects.filter(user=user).annotate(entry_id=F('id'))
+                .filter(Exists(VaultSearchTerm.objects.filter(entry_id=OuterRef('id'), term__startswith=marked)))
+                .values_list('entry_id', flat=True).order_by('entry_id'))
+
+    postings = VaultSearchTerm.objects.filter(user_id=user.id)
+    sizes = {term: postings.filter(term=term)[:SELECTIVITY_SAMPLE].count() for term in sorted(trigrams(marked))}
+    rarest = min(sizes, key=sizes.get)
+    if not sizes[rarest]:
+        return postings.none().values_list('entry_id', flat=True)
+    candidates = postings.filter(term=rarest)
+    for term in sizes:
+        if term != rarest:
+            candidates = candidates.filter(Exists(VaultSearchTerm.objects.filter(entry_id=OuterRef('entry_id'), term=term)))
+    return candidates.values_list('entry_id', flat=True).order_by('entry_id')
+
+def search_exact(user, query, mode, fields, cursor=0, page_size=None):
+    """
+    Find the vault entries whose website name or URL starts with (prefix) or contains (substring) the query.
+
+    Candidates come from the trigram index, so the work grows with the number of
+    matching entries rather than the size of the vault. Candidates are then checked
+    against the actual values, since sharing all trigrams does not guarantee a match.
+
+    Parameters:
+    - user (User): Owner of the vault.
+    - query (str): Normalized search query.
+    - mode (str): PREFIX or SUBSTRING.
+    - fields (tuple): Vault columns to return.
+    - cursor (int): Id of the last entry of the previous page.
+    - page_size (int): Number of entries per page.
+    Returns: tuple: (entries, next_cursor) with entries as dicts holding the encrypted password.
+    """
+    page_size = page_size or settings.VAULT_PAGE_SIZE
+    candidates = _candidate_ids(user, query, mode)
+    page, batch_size, last_id = [], page_size + 1, cursor
+    while len(page) <= page_size:
+        batch = list(candidates.filter(entry_id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        entries = PasswordVault.objects.filter(id__in=batch).order_by('id').values(*set(fields) | {'id', 'website_name', 'website_url'})
+        page.extend(entry for entry in entries if _matches(entry, query, mode))
+        last_id = batch[-1]
+    next_cursor = page[page_size - 1]['id'] if len(page) > page_size else None
+    return [{field: entry[field] for field in fields} for entry in page[:page_size]], next_cursor
+
+def search_fuzzy(user, query, fields, cursor=None, page_size=None):
+    """
+    Rank the vault entries by the share of the query's trigrams found in their website name or URL.
+
+    Entries sharing at least SEARCH_FUZZY_THRESHOLD of the trigrams are returned,
+    best first, with the score in 'score'. Pages follow the (score, id) order.
+
+    Parameters:
+    - user (User): Owner of the vault.
+    - query (str): Normalized search query.
+    - fields (tuple): Vault columns to return.
+    - cursor (str): 'next_cursor' of the previous page, '<matches>.<id>'.
+    - page_size (int): Number of entries per page.
+    Returns: tuple: (entries, next_cursor) with entries as dicts holding the encrypted password.
+    Raises: ValueError: If the cursor is malformed.
+    """
+    page_size = page_size or settings.VAULT_PAGE_SIZE
+    terms = trigrams(f"{TERM_START}{query}{TERM_END}")
+    required = max(1, math.ceil(len(terms) * settings.SEARCH_FUZZY_THRESHOLD))
+    ranked = (VaultSearchTerm.objects.filter(user_id=user.id, term__in=terms).values('entry_id')
+              .annotate(matches=Count('term')).filter(matches__gte=required).order_by('-matches', 'entry_id'))
+    if cursor:
+        matches, entry_id = (int(part) for part in cursor.split('.', 1))
+        ranked = ranked.filter(Q(matches__lt=matches) | Q(matches=matches, entry_id__gt=entry_id))
+
+    ranking = list(ranked.values_list('entry_id', 'matches')[:page_size + 1])
+    next_cursor = "{}.{}".format(*reversed(ranking[page_size - 1])) if len(ranking) > page_size else None
+    ranking = ranking[:page_size]
+    entries = {entry['id']: entry for entry in PasswordVault.objects.filter(id__in=[entry_id for entry_id, _ in ranking]).values(*set(fields) | {'id'})}
+    page = []
+    for entry_id, matches in ranking:
+        entry = {field: entries[entry_id][field] for field in fields}
+        entry['score'] = round(matches / len(terms), 3)
+        page.append(entry)
+    return page, next_cursor
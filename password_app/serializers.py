@@ -2,6 +2,10 @@ from rest_framework import serializers
 from .models import PasswordVault
 
 class PasswordSerializer(serializers.ModelSerializer):
+    # The model stores the longer encrypted value; the plain-text password stays limited to 100 characters.
+    password = serializers.CharField(max_length = 100)
+
     class Meta:
         model = PasswordVault
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+        read_only_fields = ['user', 'version']
\ No newline at end of file
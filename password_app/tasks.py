@@ -1,53 +1,63 @@
-import os
 from celery import shared_task
-from firebase_admin import storage
 from password_manager import settings
+from django.db import DatabaseError, transaction
 from django.core.mail import send_mail
 from password_manager.utility import weekly_password_report
+from password_manager.storage import export_ndjson_gzip, StorageUnavailable
+from password_manager.celery import MAIL_RETRY_POLICY, RETRY_BACKOFF
+from password_manager.change_export import export_changes, vault_changes
+from .models import ImportJob
+from .importers import import_vault_entries
+from .rotation import run_rotation_worker, fail_key_rotation
+from .outbox import OutboxTask, enqueue, relay_messages
+from .notifications import flush_notifications
 
-@shared_task
-def send_password_add_mail(target_mail, user, website_name):
+@shared_task(ignore_result=True)
+def send_notification_digests():
 
     """
-    This task sends an email notification to the user informing them that a new password
-    has been successfully added to their account for a specific website.
+    This task sends the queued add/update notifications as one digest email per user,
+    reusing a single SMTP connection for every email of the run.
 
-    Parameters:
-    - target_mail (str): The email address of the recipient.
-    - user (str): The username of the user.
-    - website_name (str): The name of the website for which the password was added.
+    Returns: A message indicating how many digests were sent.
+    """
+
+    sent, delivered = flush_notifications()
+    return f"Sent {sent} notification digest(s) covering {delivered} event(s)"
+
+@shared_task(ignore_result=True)
+def relay_outbox():
 
-    Returns: A message indicating that the email has been sent to the user.
     """
-    
-    mail_subject = "New Password Added Successfully!"
-    message = f"Dear {user},\n\nWe are pleased to inform you that a new password for {website_name} has been added to your account successfully.\n\nThank you for entrusting us with your password management needs.\n\nBest regards,\nTeam Password Manager"
-    send_mail(
-        subject = mail_subject,
-        message=message,
-        from_email=settings.EMAIL_HOST_USER,
-        recipient_list=[target_mail],
-        fail_silently=False,
-        )
-    return f"Mail sent to {user} for adding new password"
+    This task publishes the tasks waiting in the outbox. It backs up the relay_outbox command:
+    both can run at the same time since every message is claimed by a single relay.
 
-@shared_task
-def send_password_update_mail(target_mail, user, website_name):
+    Returns: A message indicating how many tasks were published.
+    """
+
+    published, error = relay_messages()
+    if error is not None:
+        return f"Published {published} outbox message(s); publishing stopped on {error!r}"
+    return f"Published {published} outbox message(s)"
+
+@shared_task(base=OutboxTask, ignore_result=True, **MAIL_RETRY_POLICY)
+def send_password_import_mail(target_mail, user, imported, rejected):
 
     """
-    This task sends an email notification to the user informing them that the password
-    for a specific website in their account has been successfully updated.
+    This task sends a single summary email to the user once a bulk import has finished,
+    instead of one email per imported password.
 
     Parameters:
     - target_mail (str): The email address of the recipient.
     - user (str): The username of the user.
-    - website_name (str): The name of the website for which the password was updated.
+    - imported (int): Number of passwords added to the vault.
+    - rejected (int): Number of rows skipped or rejected.
 
     Returns: A message indicating that the email has been sent to the user.
     """
 
-    mail_subject = f"Password Updated for {website_name}"
-    message = f"Dear {user},\n\nWe would like to inform you that the password for {website_name} has been successfully updated in your account.\n\nThank you for keeping your account secure and up-to-date.\n\nBest regards,\nTeam Password Manager"
+    mail_subject = "Password Import Completed"
+    message = f"Dear {user},\n\nYour password import has finished. {imported} password(s) were added to your account and {rejected} entr(y/ies) were skipped or rejected.\n\nYou can review the details of every entry in the import report.\n\nBest regards,\nTeam Password Manager"
     send_mail(
         subject = mail_subject,
         message=message,
@@ -55,22 +65,88 @@ def send_password_update_mail(target_mail, user, website_name):
         recipient_list=[target_mail],
         fail_silently=False,
         )
-    return f"Mail sent to {user} for updating a password"
+    return f"Mail sent to {user} for importing passwords"
 
-@shared_task
+@shared_task(base=OutboxTask, ignore_result=True)
+def import_passwords(job_id):
+
+    """
+    This task imports the rows of a bulk import job into the user's vault, recording progress
+    on the job so the client can poll it, and sends one summary email when done.
+
+    Parameters: job_id (int): Id of the ImportJob to run.
+
+    Returns: A message indicating how many passwords were imported.
+    """
+
+    job = ImportJob.objects.select_related('user').get(id=job_id)
+    ImportJob.objects.filter(id=job_id).update(status=ImportJob.RUNNING)
+    # Rows rejected while parsing the upload are already counted as processed.
+    parsed = job.processed
+    try:
+        imported, report = import_vault_entries(job.user, job.rows,
+                                                progress=lambda processed: ImportJob.objects.filter(id=job_id).update(processed=parsed + processed))
+    except Exception:
+        ImportJob.objects.filter(id=job_id).update(status=ImportJob.FAILED, rows=[])
+        raise
+    job.report = sorted(job.report + report, key=lambda entry: entry['row'])
+    with transaction.atomic():
+        ImportJob.objects.filter(id=job_id).update(status=ImportJob.COMPLETED, processed=job.total, imported=imported, rows=[], report=job.report)
+        enqueue(send_password_import_mail, (job.user.email, job.user.username, imported, len(job.report) - imported), dedupe_key=f"import-mail:{job_id}")
+    return f"Imported {imported} passwords for {job.user.username}"
+
+@shared_task(autoretry_for=(StorageUnavailable,), **RETRY_BACKOFF)
 def upload_password_data_weekly_to_firebase():
 
     """
-    This task uploads the weekly password data to Firebase Storage. It generates a JSON file
-    containing the password data for the previous week and uploads it to the specified bucket
-    in Firebase Storage.
+    This task uploads the weekly password data to Firebase Storage. It streams the password data
+    for the previous week as gzip-compressed NDJSON to the configured storage backend, so the
+    week's data is never held in memory at once.
 
     Returns: A message indicating the successful upload of the weekly data to Firebase Storage.
     """
 
-    bucket = storage.bucket(os.environ.get('BUCKET_NAME'))
     weekly_data,last_week,today = weekly_password_report()
-    destination = f"weekly_data/password_data_{last_week.strftime("%Y-%m-%d")}_to_{today.strftime("%Y-%m-%d")}.json"
-    blob = bucket.blob(destination)
-    blob.upload_from_string(weekly_data, content_type='text/plain')
-    return f"Weekly data uploaded to Firebase Storage: {destination} "
\ No newline at end of file
+    destination = f"weekly_data/password_data_{last_week.strftime("%Y-%m-%d")}_to_{today.strftime("%Y-%m-%d")}.ndjson.gz"
+    count = export_ndjson_gzip(weekly_data, destination)
+    return f"Weekly data uploaded to Firebase Storage: {destination} ({count} rows)"
+
+@shared_task(autoretry_for=(StorageUnavailable,), **RETRY_BACKOFF)
+def export_vault_changes():
+
+    """
+    This task exports the password entries added, updated or deleted since the last successful
+    run as gzip-compressed NDJSON files partitioned by day. It is safe to retry: a failed run
+    is repeated over exactly the same window.
+
+    Returns: A message indicating how many changes were exported.
+    """
+
+    exported, destinations = export_changes('password_vault', vault_changes)
+    return f"Exported {exported} password changes to {len(destinations)} file(s)"
+
+@shared_task(bind=True, ignore_result=True, acks_late=True, reject_on_worker_lost=True, max_retries=5)
+def rotate_encryption_key(self, job_id):
+
+    """
+    This task is one worker of a key rotation job: it re-encrypts chunks of the vault until
+    none is left. Several run in parallel on the same job. The task is acknowledged only when
+    it finishes, so a worker lost mid-chunk is redelivered; database errors such as lock
+    timeouts are retried with backoff before the job is marked failed.
+
+    Parameters: job_id (int): Id of the KeyRotationJob to work on.
+
+    Returns: A message indicating how many passwords this worker re-encrypted.
+    """
+
+    try:
+        rotated = run_rotation_worker(job_id)
+    except DatabaseError as exc:
+        if self.request.retries >= self.max_retries:
+            fail_key_rotation(job_id, exc)
+            raise
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+    except Exception as exc:
+        fail_key_rotation(job_id, exc)
+        raise
+    return f"Re-encrypted {rotated} passwords for key rotation #{job_id}"
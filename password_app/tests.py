@@ -1,3 +1,805 @@
-from django.test import TestCase
+import os
+import base64
+import smtplib
+import asyncio
+import time
+import socket
+import hashlib
+from io import StringIO
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.utils import timezone
+from django.db.models import QuerySet
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.db import connections
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+from password_manager import settings
+from password_manager.utility import encrypt_password, decrypt_passwords
+from password_manager.keyring import get_keyring
+from password_manager.breach_index import (HEADER, PREFIX_ENTRY, RECORD_SIZE, INDEX_MAGIC, INDEX_VERSION,
+                                           BreachIndex, lookup_breach_index, cache_range_response, range_cache_path)
+from password_manager.db_router import PRIMARY, SHARDED_MODELS, STICKY_CACHE, lookup_shard, stick_to_primary, pick_read_alias
+from password_manager.change_export import vault_changes
+from password_manager import hibp
+from password_manager.hibp import HIBPClient, AsyncHIBPClient, CircuitBreaker, BreachCheckUnavailable, hibp_stats
+from user_app.authentication import user_cache
+from .models import PasswordVault, VaultVersion, VaultSearchTerm, VaultTombstone, PendingNotification, VaultShard
+from .rotation import start_key_rotation, run_rotation_worker
+from .rebalance import move_vault
+from . import notifications
+from .benchmarks import BENCHMARK_HOST, start_stub_hibp, local_services
 
-# Create your tests here.
+def _closed_port_url():
+    """Return the URL of a localhost port nothing listens on, so requests to it are refused."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{probe.getsockname()[1]}"
+
+class HIBPClientTests(SimpleTestCase):
+    """HIBPClient against the stub range server of password_app.benchmarks."""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        # No breach index and an empty range cache, so every lookup goes to the stub.
+        patcher = mock.patch.multiple(settings, BREACH_INDEX_PATH=f"{temp_dir.name}/breach_index.bin",
+                                      BREACH_RANGE_CACHE_DIR=f"{temp_dir.name}/ranges")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start_stub(self, delay=0):
+        server = start_stub_hibp(delay)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def hibp_client(self, api_url, **options):
+        options = {'connect_timeout': 1.0, 'read_timeout': 1.0, 'failure_threshold': 2, 'reset_timeout': 60, 'fail_open': False, **options}
+        client = HIBPClient(api_url=api_url, **options)
+        self.addCleanup(client.session.close)
+        return client
+
+    @staticmethod
+    def breached_hash(prefix):
+        # The stub answers every prefix with the suffixes of sha1(prefix + n).
+        return prefix + hashlib.sha1(f"{prefix}0".encode()).hexdigest()[5:].upper()
+
+    def test_concurrent_lookups_of_a_prefix_share_one_request(self):
+        stub = self.start_stub(delay=0.3)
+        client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}")
+        barrier = threading.Barrier(8)
+        texts = []
+
+        def lookup():
+            barrier.wait()
+            texts.append(client.fetch_range('ABCDE'))
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(len(texts), 8)
+        self.assertEqual(len(set(texts)), 1)
+        self.assertEqual(client.stats()['coalesced'], 7)
+
+    def test_breaker_opens_after_threshold_and_fails_fast(self):
+        client = self.hibp_client(_closed_port_url())
+        for _ in range(2):
+            with self.assertRaises(BreachCheckUnavailable):
+                client.fetch_range('ABCDE')
+        self.assertTrue(client.breaker.is_open)
+
+        with self.assertRaisesMessage(BreachCheckUnavailable, "circuit breaker is open"):
+            client.fetch_range('ABCDE')
+        self.assertEqual(client.stats()['errors'], 2)
+        self.assertEqual(client.stats()['breaker_open'], 1)
+
+    def test_half_open_trial_closes_the_breaker(self):
+        stub = self.start_stub()
+        client = self.hibp_client(_closed_port_url(), reset_timeout=0.2)
+        for _ in range(2):
+            with self.assertRaises(BreachCheckUnavailable):
+                client.fetch_range('ABCDE')
+        self.assertTrue(client.breaker.is_open)
+
+        client.api_url = f"http://127.0.0.1:{stub.server_port}"
+        with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3):
+            self.assertIn(':', client.fetch_range('ABCDE'))
+        self.assertFalse(client.breaker.is_open)
+        self.assertEqual(stub.requests, 1)
+
+    def test_failed_half_open_trial_reopens_the_breaker(self):
+        client = self.hibp_client(_closed_port_url(), reset_timeout=0.2)
+        for _ in range(2):
+            with self.assertRaises(BreachCheckUnavailable):
+                client.fetch_range('ABCDE')
+        opened_at = client.breaker._opened_at
+
+        with mock.patch('password_manager.hibp.time.monotonic', return_value=opened_at + 0.3):
+            with self.assertRaisesMessage(BreachCheckUnavailable, "Unable to reach"):
+                client.fetch_range('ABCDE')
+        self.assertTrue(client.breaker.is_open)
+        self.assertFalse(client.breaker._trial_running)
+
+    def test_unexpected_error_in_half_open_trial_does_not_wedge_the_breaker(self):
+        stub = self.start_stub()
+        client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}", reset_timeout=0.2)
+        client.breaker.record_failure()
+        client.breaker.record_failure()
+        opened_at = client.breaker._opened_at
+
+        with mock.patch('password_manager.hibp.time.monotonic', return_value=opened_at + 0.3), \
+                mock.patch('password_manager.hibp.cache_range_response', side_effect=RuntimeError("disk full")):
+            with self.assertRaisesMessage(BreachCheckUnavailable, "disk full"):
+                client.fetch_range('ABCDE')
+        self.assertFalse(client.breaker._trial_running)
+
+        # The next trial is let through and closes the breaker.
+        with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3):
+            client.fetch_range('ABCDE')
+        self.assertFalse(client.breaker.is_open)
+
+    def test_followers_get_the_leaders_error(self):
+        stub = self.start_stub(delay=0.3)
+        client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}")
+        barrier = threading.Barrier(4)
+        outcomes = []
+
+        def lookup():
+            barrier.wait()
+            try:
+                outcomes.append(client.fetch_range('ABCDE'))
+            except BreachCheckUnavailable as e:
+                outcomes.append(e)
+
+        with mock.patch('password_manager.hibp.cache_range_response', side_effect=RuntimeError("disk full")):
+            threads = [threading.Thread(target=lookup) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(len(outcomes), 4)
+        self.assertTrue(all(isinstance(outcome, BreachCheckUnavailable) for outcome in outcomes))
+
+    def test_read_timeout_counts_as_failure(self):
+        stub = self.start_stub(delay=1.0)
+        client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}", read_timeout=0.2)
+        with self.assertRaisesMessage(BreachCheckUnavailable, "Unable to reach"):
+            client.fetch_range('ABCDE')
+        self.assertEqual(client.breaker._failures, 1)
+        self.assertEqual(client.stats()['errors'], 1)
+
+    def test_fail_open_treats_unavailable_api_as_clean(self):
+        client = self.hibp_client(_closed_port_url(), fail_open=True)
+        self.assertFalse(client.is_breached(self.breached_hash('ABCDE')))
+        self.assertEqual(client.check_many([self.breached_hash('ABCDE')]), {self.breached_hash('ABCDE'): False})
+
+    def test_fail_closed_raises_when_api_is_unavailable(self):
+        client = self.hibp_client(_closed_port_url(), fail_open=False)
+        with self.assertRaises(BreachCheckUnavailable):
+            client.is_breached(self.breached_hash('ABCDE'))
+        self.assertEqual(client.check_many([self.breached_hash('ABCDE')]), {self.breached_hash('ABCDE'): None})
+
+    def test_lookups_use_the_range_cache_and_count_hits_and_misses(self):
+        stub = self.start_stub()
+        client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}")
+        self.assertTrue(client.is_breached(self.breached_hash('ABCDE')))
+        self.assertFalse(client.is_breached('ABCDE' + '0' * 35))
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(client.stats(), {'hits': 1, 'misses': 1, 'coalesced': 0, 'breaker_open': 0, 'errors': 0})
+
+class AsyncHIBPClientTests(HIBPClientTests):
+    """AsyncHIBPClient against the same stub, each test running in an event loop of its own."""
+
+    def run_async(self, api_url, scenario, **options):
+        """Run scenario(client) in a new event loop with an AsyncHIBPClient, closing the client afterwards."""
+        options = {'connect_timeout': 1.0, 'read_timeout': 1.0, 'failure_threshold': 2, 'reset_timeout': 60, 'fail_open': False, **options}
+
+        async def main():
+            client = AsyncHIBPClient(api_url=api_url, **options)
+            try:
+                return client, await scenario(client)
+            finally:
+                await client.session.aclose()
+        return asyncio.run(main())
+
+    def test_concurrent_lookups_of_a_prefix_share_one_request(self):
+        stub = self.start_stub(delay=0.3)
+
+        async def scenario(client):
+            return await asyncio.gather(*(client.fetch_range('ABCDE') for _ in range(8)))
+
+        client, texts = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario)
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(len(set(texts)), 1)
+        self.assertEqual(client.stats()['coalesced'], 7)
+
+    def test_breaker_opens_after_threshold_and_fails_fast(self):
+        async def scenario(client):
+            for _ in range(2):
+                with self.assertRaises(BreachCheckUnavailable):
+                    await client.fetch_range('ABCDE')
+            self.assertTrue(client.breaker.is_open)
+            with self.assertRaisesMessage(BreachCheckUnavailable, "circuit breaker is open"):
+                await client.fetch_range('ABCDE')
+
+        client, _ = self.run_async(_closed_port_url(), scenario)
+        self.assertEqual(client.stats()['errors'], 2)
+        self.assertEqual(client.stats()['breaker_open'], 1)
+
+    def test_half_open_trial_closes_the_breaker(self):
+        stub = self.start_stub()
+
+        async def scenario(client):
+            for _ in range(2):
+                with self.assertRaises(BreachCheckUnavailable):
+                    await client.fetch_range('ABCDE')
+            client.api_url = f"http://127.0.0.1:{stub.server_port}"
+            with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3):
+                self.assertIn(':', await client.fetch_range('ABCDE'))
+
+        client, _ = self.run_async(_closed_port_url(), scenario, reset_timeout=0.2)
+        self.assertFalse(client.breaker.is_open)
+        self.assertEqual(stub.requests, 1)
+
+    def test_failed_half_open_trial_reopens_the_breaker(self):
+        async def scenario(client):
+            for _ in range(2):
+                with self.assertRaises(BreachCheckUnavailable):
+                    await client.fetch_range('ABCDE')
+            with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3):
+                with self.assertRaisesMessage(BreachCheckUnavailable, "Unable to reach"):
+                    await client.fetch_range('ABCDE')
+
+        client, _ = self.run_async(_closed_port_url(), scenario, reset_timeout=0.2)
+        self.assertTrue(client.breaker.is_open)
+        self.assertFalse(client.breaker._trial_running)
+
+    def test_unexpected_error_in_half_open_trial_does_not_wedge_the_breaker(self):
+        stub = self.start_stub()
+
+        async def scenario(client):
+            client.breaker.record_failure()
+            client.breaker.record_failure()
+            with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3), \
+                    mock.patch('password_manager.hibp.cache_range_response', side_effect=RuntimeError("disk full")):
+                with self.assertRaisesMessage(BreachCheckUnavailable, "disk full"):
+                    await client.fetch_range('ABCDE')
+            self.assertFalse(client.breaker._trial_running)
+            with mock.patch('password_manager.hibp.time.monotonic', return_value=client.breaker._opened_at + 0.3):
+                await client.fetch_range('ABCDE')
+
+        client, _ = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario, reset_timeout=0.2)
+        self.assertFalse(client.breaker.is_open)
+
+    def test_followers_get_the_leaders_error(self):
+        stub = self.start_stub(delay=0.3)
+
+        async def scenario(client):
+            with mock.patch('password_manager.hibp.cache_range_response', side_effect=RuntimeError("disk full")):
+                return await asyncio.gather(*(client.fetch_range('ABCDE') for _ in range(4)), return_exceptions=True)
+
+        client, outcomes = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario)
+        self.assertEqual(stub.requests, 1)
+        self.assertTrue(all(isinstance(outcome, BreachCheckUnavailable) for outcome in outcomes))
+        self.assertEqual(client.stats()['coalesced'], 3)
+
+    def test_read_timeout_counts_as_failure(self):
+        stub = self.start_stub(delay=1.0)
+
+        async def scenario(client):
+            with self.assertRaisesMessage(BreachCheckUnavailable, "Unable to reach"):
+                await client.fetch_range('ABCDE')
+
+        client, _ = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario, read_timeout=0.2)
+        self.assertEqual(client.breaker._failures, 1)
+        self.assertEqual(client.stats()['errors'], 1)
+
+    def test_fail_open_treats_unavailable_api_as_clean(self):
+        client, breached = self.run_async(_closed_port_url(), lambda client: client.is_breached(self.breached_hash('ABCDE')), fail_open=True)
+        self.assertFalse(breached)
+        self.assertEqual(client.stats()['misses'], 1)
+
+    def test_fail_closed_raises_when_api_is_unavailable(self):
+        with self.assertRaises(BreachCheckUnavailable):
+            self.run_async(_closed_port_url(), lambda client: client.is_breached(self.breached_hash('ABCDE')))
+
+    def test_lookups_use_the_range_cache_and_count_hits_and_misses(self):
+        stub = self.start_stub()
+
+        async def scenario(client):
+            return [await client.is_breached(self.breached_hash('ABCDE')), await client.is_breached('ABCDE' + '0' * 35)]
+
+        client, results = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario)
+        self.assertEqual(results, [True, False])
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(client.stats(), {'hits': 1, 'misses': 1, 'coalesced': 0, 'breaker_open': 0, 'errors': 0})
+
+    def test_process_stats_include_the_async_clients(self):
+        stub = self.start_stub()
+        sync_client = self.hibp_client(f"http://127.0.0.1:{stub.server_port}")
+        sync_client.is_breached(self.breached_hash('ABCDE'))
+
+        async def scenario(client):
+            hibp._async_clients[asyncio.get_running_loop()] = client
+            await client.is_breached(self.breached_hash('BCDEF'))
+            await client.is_breached(self.breached_hash('BCDEF'))
+            return hibp_stats()
+
+        with mock.patch.object(hibp, '_client', sync_client):
+            _, totals = self.run_async(f"http://127.0.0.1:{stub.server_port}", scenario)
+        self.assertEqual(totals, {'hits': 1, 'misses': 2, 'coalesced': 0, 'breaker_open': 0, 'errors': 0})
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_single_trial_while_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        with mock.patch('password_manager.hibp.time.monotonic', return_value=breaker._opened_at + 11):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+class BreachIndexTests(SimpleTestCase):
+    """The memory-mapped breach index as written by build_breach_index, and its place in front of the range API."""
+    PREFIXES = ('00000', '7ABCD', 'FFFFF')
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.index_path = os.path.join(self.temp_dir, 'breach_index.bin')
+        patcher = mock.patch.multiple(settings, BREACH_INDEX_PATH=self.index_path, BREACH_RANGE_CACHE_DIR=os.path.join(self.temp_dir, 'ranges'),
+                                      BREACH_RANGE_TTL=3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def digest(prefix, number):
+        return prefix + hashlib.sha1(f"{prefix}-{number}".encode()).hexdigest()[5:].upper()
+
+    def build(self, *options, **dump):
+        """Run build_breach_index, from a per-prefix dump directory when prefixes are given."""
+        if dump:
+            dump_dir = os.path.join(self.temp_dir, 'dump')
+            os.makedirs(dump_dir, exist_ok=True)
+            for prefix, count in dump.items():
+                with open(os.path.join(dump_dir, f"{prefix}.txt"), 'w') as dump_file:
+                    dump_file.writelines(f"{self.digest(prefix, number)[5:]}:{number + 1}\n" for number in range(count))
+            options = ('--dump', dump_dir, *options)
+        call_command('build_breach_index', '--output', self.index_path, *options, stdout=StringIO())
+
+    def test_file_layout(self):
+        self.build(**{'00000': 2, '7ABCD': 3})
+        with open(self.index_path, 'rb') as index_file:
+            data = index_file.read()
+
+        magic, version, prefix_count, record_count, prefix_offset = HEADER.unpack_from(data, 0)
+        self.assertEqual((magic, version, prefix_count, record_count), (INDEX_MAGIC, INDEX_VERSION, 2, 5))
+        self.assertEqual(prefix_offset, HEADER.size + 5 * RECORD_SIZE)
+        self.assertEqual(len(data), prefix_offset + 2 * PREFIX_ENTRY.size)
+        records = [data[HEADER.size + position * RECORD_SIZE:HEADER.size + (position + 1) * RECORD_SIZE] for position in range(5)]
+        self.assertEqual(records[:2], sorted(bytes.fromhex(self.digest('00000', number)) for number in range(2)))
+        self.assertEqual(records[2:], sorted(bytes.fromhex(self.digest('7ABCD', number)) for number in range(3)))
+        # Dump prefixes have no fetch time and never expire.
+        self.assertEqual([PREFIX_ENTRY.unpack_from(data, prefix_offset + position * PREFIX_ENTRY.size) for position in range(2)],
+                         [(0x00000, 0, 0, 2), (0x7ABCD, 0, 2, 3)])
+
+    def test_lookup_at_the_first_and_last_prefixes(self):
+        self.build(**{prefix: 50 for prefix in self.PREFIXES})
+        for prefix in self.PREFIXES:
+            self.assertTrue(lookup_breach_index(self.digest(prefix, 0)), prefix)
+            self.assertTrue(lookup_breach_index(self.digest(prefix, 49)), prefix)
+            # An indexed prefix answers for the passwords it does not list as well.
+            self.assertFalse(lookup_breach_index(prefix + '0' * 35), prefix)
+            self.assertFalse(lookup_breach_index(prefix + 'F' * 35), prefix)
+        index = BreachIndex(self.index_path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.find_prefix('00000'), (0, 0, 50))
+        self.assertEqual(index.find_prefix('FFFFF'), (0, 100, 50))
+
+    def test_missing_prefix_is_left_to_the_network(self):
+        self.build(**{prefix: 5 for prefix in self.PREFIXES})
+        for prefix in ('00001', '7ABCC', '7ABCE', 'FFFFE'):
+            self.assertIsNone(lookup_breach_index(prefix + '0' * 35), prefix)
+
+    def test_stale_range_is_left_to_the_network(self):
+        cache_range_response('12345', f"{self.digest('12345', 0)[5:]}:1\r\n")
+        self.assertTrue(lookup_breach_index(self.digest('12345', 0)))
+        fetched_at = time.time() - 7200
+        os.utime(range_cache_path('12345'), (fetched_at, fetched_at))
+        # Refreshing the index with a longer TTL takes the range in with its fetch time.
+        self.build('--ttl', '86400')
+        index = BreachIndex(self.index_path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.find_prefix('12345'), (int(fetched_at), 0, 1))
+
+        self.assertIsNone(lookup_breach_index(self.digest('12345', 0)))
+        with mock.patch.object(settings, 'BREACH_RANGE_TTL', 86400):
+            self.assertTrue(lookup_breach_index(self.digest('12345', 0)))
+
+    def test_client_asks_the_network_only_on_a_miss(self):
+        self.build(**{'ABCDE': 5})
+        stub = start_stub_hibp()
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        client = HIBPClient(api_url=f"http://127.0.0.1:{stub.server_port}", fail_open=False)
+        self.addCleanup(client.session.close)
+
+        self.assertTrue(client.is_breached(self.digest('ABCDE', 3)))
+        self.assertFalse(client.is_breached('ABCDE' + '0' * 35))
+        self.assertEqual(stub.requests, 0)
+        stub_hash = 'BCDEF' + hashlib.sha1(b'BCDEF0').hexdigest()[5:].upper()
+        self.assertTrue(client.is_breached(stub_hash))
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(client.stats()['hits'], 2)
+        self.assertEqual(client.stats()['misses'], 1)
+
+        # The fetched range is cached, and a refresh moves it into the index.
+        self.build()
+        self.assertTrue(client.is_breached(stub_hash))
+        self.assertEqual(stub.requests, 1)
+        index = BreachIndex(self.index_path)
+        self.addCleanup(index.close)
+        self.assertEqual([prefix for prefix, _, _ in index.iter_prefixes()], ['ABCDE', 'BCDEF'])
+
+class ReplicaStickinessTests(SimpleTestCase):
+    """Read-your-writes markers of password_manager.db_router."""
+
+    def setUp(self):
+        caches[STICKY_CACHE].clear()
+        patcher = mock.patch.object(settings, 'DATABASE_REPLICA_ALIASES', ['replica1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_writer_reads_from_the_primary(self):
+        stick_to_primary(1)
+        self.assertEqual(pick_read_alias(1), PRIMARY)
+        self.assertEqual(pick_read_alias(2), 'replica1')
+
+    def test_marker_is_kept_apart_from_the_page_cache(self):
+        stick_to_primary(1)
+        self.assertTrue(caches[STICKY_CACHE].get('db-primary:1'))
+        # Page traffic filling up or clearing the vault cache does not unpin the user.
+        caches['vault'].clear()
+        self.assertEqual(pick_read_alias(1), PRIMARY)
+        self.assertIsNone(caches['vault'].get('db-primary:1'))
+
+class VaultViewQueryTests(TestCase):
+    """
+    Queries run by the vault endpoints for a user whose row is already in the auth cache.
+    Writes run inside the test's transaction, so their atomic blocks show up as SAVEPOINT and
+    RELEASE statements: one pair for the view, one for save() or delete() and, the first time a
+    vault changes, one for creating its VaultVersion row.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'Str0ng!Passw0rd#1')
+        PasswordVault.objects.create(user=cls.user, website_name='example', website_url='https://www.example.com/login',
+                                     password=encrypt_password('Old!Passw0rd#2024'))
+
+    def setUp(self):
+        self.enterContext(local_services())
+        caches['vault'].clear()
+        user_cache.clear()
+        self.api = Client(HTTP_HOST=BENCHMARK_HOST, HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        # Loads the user into the auth cache.
+        self.assertEqual(self.api.get('/api/password/search', {'q': 'nothing-matches'}).status_code, 200)
+
+    def add(self, website_name):
+        return self.api.post('/api/password/add', {'website_name': website_name, 'website_url': f"https://{website_name}.com",
+                                                   'password': 'New!Passw0rd#2024'}, content_type='application/json')
+
+    def test_add(self):
+        # exists() check, version bump and read back, entry, search terms, notification.
+        with self.assertNumQueries(10):
+            self.assertEqual(self.add('github').status_code, 201)
+
+    def test_add_duplicate_is_refused_after_the_exists_check(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.add('Example').status_code, 400)
+
+    def test_add_duplicate_racing_the_exists_check_is_refused(self):
+        # The insert hits the unique constraint and both savepoints roll back, taking the version bump with them.
+        with mock.patch.object(QuerySet, 'exists', return_value=False), self.assertNumQueries(9):
+            self.assertEqual(self.add('example').status_code, 400)
+        self.assertEqual(PasswordVault.objects.filter(user=self.user).count(), 1)
+
+    def test_all_reads_the_page_once_per_version(self):
+        # Vault version, then the page.
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.api.get('/api/password/all').json()['results']), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.api.get('/api/password/all').json()['results']), 1)
+
+    def test_export_streams_the_vault_with_one_select(self):
+        # Vault version, then every row in one query while the body is read.
+        with self.assertNumQueries(2):
+            response = self.api.get('/api/password/all', {'stream': 'ndjson'})
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1)
+
+    def test_search(self):
+        # Term counts of the query, the matching entry ids, then the entries.
+        with self.assertNumQueries(5):
+            results = self.api.get('/api/password/search', {'q': 'exam'}).json()['results']
+        self.assertEqual([result['website_name'] for result in results], ['example'])
+
+    def test_update(self):
+        data = {'website_name': 'example', 'website_url': 'https://www.example.com/login',
+                'old_password': 'Old!Passw0rd#2024', 'new_password': 'New!Passw0rd#2024'}
+        # Entry, version bump and read back, entry update, notification.
+        with self.assertNumQueries(9):
+            self.assertEqual(self.api.post('/api/password/update', data, content_type='application/json').status_code, 200)
+
+    def test_delete(self):
+        # Entries to tombstone, version bump and read back, cascade collection, search terms, entry, tombstone.
+        with self.assertNumQueries(9):
+            self.assertEqual(self.api.get('/api/password/delete', {'website_name': 'example'}).status_code, 200)
+        self.assertFalse(PasswordVault.objects.filter(user=self.user).exists())
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class NotificationDigestTests(TestCase):
+    """flush_notifications with the locmem email backend."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'Str0ng!Passw0rd#1')
+        cls.bob = User.objects.create_user('bob', 'bob@example.org', 'Str0ng!Passw0rd#1')
+
+    def setUp(self):
+        caches['notification_rate'].clear()
+
+    def queue(self, user, event, website_name, age=None):
+        notification = PendingNotification.objects.create(user=user, event=event, website_name=website_name)
+        created_at = timezone.now() - timedelta(seconds=settings.NOTIFICATION_WINDOW + 1 if age is None else age)
+        PendingNotification.objects.filter(id=notification.id).update(created_at=created_at)
+
+    def flush(self):
+        with mock.patch.object(notifications, 'get_connection', wraps=notifications.get_connection) as get_connection:
+            result = notifications.flush_notifications()
+        return result, get_connection.call_count
+
+    def test_one_digest_per_user_over_one_connection(self):
+        self.queue(self.alice, PendingNotification.ADDED, 'github')
+        self.queue(self.alice, PendingNotification.UPDATED, 'gitlab')
+        self.queue(self.alice, PendingNotification.ADDED, 'bitbucket')
+        self.queue(self.bob, PendingNotification.UPDATED, 'example')
+
+        (sent, delivered), connections_opened = self.flush()
+
+        self.assertEqual((sent, delivered), (2, 4))
+        self.assertEqual(connections_opened, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        digests = {message.to[0]: message for message in mail.outbox}
+        self.assertEqual(digests['alice@example.com'].subject, "3 changes to your Password Manager vault")
+        self.assertIn("- New password added for github\n- Password updated for gitlab\n- New password added for bitbucket",
+                      digests['alice@example.com'].body)
+        # A single event is mailed with the message of that event.
+        self.assertEqual(digests['bob@example.org'].subject, "Password Updated for example")
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_events_inside_the_window_wait_for_a_later_flush(self):
+        self.queue(self.alice, PendingNotification.ADDED, 'github', age=0)
+
+        (sent, delivered), connections_opened = self.flush()
+
+        self.assertEqual((sent, delivered), (0, 0))
+        self.assertEqual(connections_opened, 0)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(PendingNotification.objects.count(), 1)
+
+    def test_users_over_the_domain_limit_stay_queued(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'Str0ng!Passw0rd#1')
+        self.queue(self.alice, PendingNotification.ADDED, 'github')
+        self.queue(carol, PendingNotification.ADDED, 'gitlab')
+
+        with mock.patch.object(settings, 'NOTIFICATION_DOMAIN_RATE_LIMIT', 1):
+            (sent, delivered), connections_opened = self.flush()
+
+        self.assertEqual((sent, delivered), (1, 1))
+        self.assertEqual(connections_opened, 1)
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+        self.assertEqual(list(PendingNotification.objects.values_list('user_id', flat=True)), [carol.id])
+
+    def test_connection_lost_part_way_keeps_the_digests_already_sent(self):
+        carol = User.objects.create_user('carol', 'carol@example.net', 'Str0ng!Passw0rd#1')
+        for user in (self.alice, self.bob, carol):
+            self.queue(user, PendingNotification.ADDED, 'github')
+        send_messages = EmailBackend.send_messages
+
+        def drop_second_message(backend, messages):
+            if len(mail.outbox) == 1:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', drop_second_message):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                notifications.flush_notifications()
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+        self.assertEqual(sorted(PendingNotification.objects.values_list('user_id', flat=True)), [self.bob.id, carol.id])
+        # The failed send gave its slot back.
+        self.assertTrue(notifications._domain_has_room('example.org'))
+
+        (sent, delivered), _ = self.flush()
+        self.assertEqual((sent, delivered), (2, 2))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['alice@example.com', 'bob@example.org', 'carol@example.net'])
+
+    def test_refused_recipient_is_dropped(self):
+        self.queue(self.alice, PendingNotification.ADDED, 'github')
+        self.queue(self.bob, PendingNotification.ADDED, 'github')
+        send_messages = EmailBackend.send_messages
+
+        def refuse_alice(backend, messages):
+            if messages[0].to == ['alice@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'No such user')})
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', refuse_alice), mock.patch('builtins.print'):
+            (sent, delivered), _ = self.flush()
+        self.assertEqual((sent, delivered), (1, 1))
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_users_held_back_by_their_domain_do_not_take_the_batch(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'Str0ng!Passw0rd#1')
+        self.queue(self.alice, PendingNotification.ADDED, 'github', age=settings.NOTIFICATION_WINDOW + 30)
+        self.queue(carol, PendingNotification.ADDED, 'github', age=settings.NOTIFICATION_WINDOW + 20)
+        self.queue(self.bob, PendingNotification.ADDED, 'github')
+        # Another worker used up example.com's minute.
+        caches['notification_rate'].set(notifications._domain_key('example.com'), settings.NOTIFICATION_DOMAIN_RATE_LIMIT, 60)
+
+        with mock.patch.object(settings, 'NOTIFICATION_FLUSH_BATCH', 1):
+            (sent, delivered), _ = self.flush()
+
+        self.assertEqual((sent, delivered), (1, 1))
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.org']])
+
+    def test_oldest_pending_users_are_flushed_first(self):
+        self.queue(self.bob, PendingNotification.ADDED, 'github', age=settings.NOTIFICATION_WINDOW + 30)
+        self.queue(self.alice, PendingNotification.ADDED, 'github')
+
+        with mock.patch.object(settings, 'NOTIFICATION_FLUSH_BATCH', 1):
+            self.flush()
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.org']])
+
+class ShardedVaultTests(TransactionTestCase):
+    """
+    Routing, fan-out and rebalancing over the primary and two SQLite shard files.
+    The shards are read from threads with connections of their own, so the rows have to be committed.
+    """
+    SHARDS = ('shard1', 'shard2')
+    # Resolved in setUpClass, once the shards are registered: the primary and both shards.
+    databases = '__all__'
+    VAULT_TABLES = tuple(label.replace('.', '_') for label in SHARDED_MODELS)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        paths = [os.path.join(cls.temp_dir.name, f"{alias}.sqlite3") for alias in cls.SHARDS]
+        # Shard connections are built from settings.DATABASES at startup; add them as DATABASE_SHARDS would.
+        for alias, path in zip(cls.SHARDS, paths):
+            primary = connections.settings[PRIMARY]
+            connections.settings[alias] = {**primary, 'NAME': path, 'TEST': {**primary['TEST'], 'NAME': path}}
+        cls.patcher = mock.patch.multiple(settings, DATABASE_SHARDS=paths, DATABASE_SHARD_ALIASES=[PRIMARY, *cls.SHARDS])
+        cls.patcher.start()
+        for alias in cls.SHARDS:
+            call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.patcher.stop()
+        for alias in cls.SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.enterContext(local_services())
+        caches['vault'].clear()
+        user_cache.clear()
+        self.users = {}
+        for alias in (PRIMARY, *self.SHARDS):
+            user = User.objects.create_user(f"user-{alias}", f"{alias}@example.com", 'Str0ng!Passw0rd#1')
+            VaultShard.objects.create(user=user, shard=alias)
+            self.users[alias] = user
+
+    def api(self, user):
+        return Client(HTTP_HOST=BENCHMARK_HOST, HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+
+    def add(self, user, website_name, password='Str0ng!Vault#2024'):
+        response = self.api(user).post('/api/password/add', {'website_name': website_name, 'website_url': f"https://{website_name}.com",
+                                                             'password': password}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def vault_queries(self, captured):
+        return [query['sql'] for query in captured.captured_queries if any(table in query['sql'] for table in self.VAULT_TABLES)]
+
+    def test_reads_and_writes_stay_on_the_users_shard(self):
+        user = self.users['shard1']
+        api = self.api(user)
+        captures = {alias: CaptureQueriesContext(connections[alias]) for alias in (PRIMARY, *self.SHARDS)}
+        for capture in captures.values():
+            capture.__enter__()
+        try:
+            self.add(user, 'github')
+            self.assertEqual(api.post('/api/password/update', {'website_name': 'github', 'website_url': 'https://github.com', 'old_password': 'Str0ng!Vault#2024',
+                                                               'new_password': 'N3w!Vault#2024'}, content_type='application/json').status_code, 200)
+            self.assertEqual([entry['password'] for entry in api.get('/api/password/all').json()['results']], ['N3w!Vault#2024'])
+            self.assertEqual(len(api.get('/api/password/search', {'q': 'git'}).json()['results']), 1)
+            self.assertEqual(api.get('/api/password/delete', {'website_name': 'github'}).status_code, 200)
+        finally:
+            for capture in captures.values():
+                capture.__exit__(None, None, None)
+
+        self.assertTrue(self.vault_queries(captures['shard1']))
+        self.assertEqual(self.vault_queries(captures[PRIMARY]), [])
+        self.assertEqual(captures['shard2'].captured_queries, [])
+        self.assertEqual(VaultVersion.objects.using('shard1').get(user_id=user.id).version, 3)
+        self.assertEqual(VaultTombstone.objects.using('shard1').filter(user_id=user.id).count(), 1)
+
+    def test_change_export_reads_every_shard(self):
+        start = timezone.now() - timedelta(seconds=1)
+        for alias, user in self.users.items():
+            self.add(user, f"site-{alias}")
+        self.assertEqual(self.api(self.users['shard2']).get('/api/password/delete', {'website_name': 'site-shard2'}).status_code, 200)
+
+        rows = list(vault_changes(start, timezone.now()))
+
+        self.assertEqual(sorted((row['op'], row['website_name']) for row in rows),
+                         [('delete', 'site-shard2'), ('upsert', 'site-default'), ('upsert', 'site-shard1')])
+        self.assertEqual([row['changed_at'] for row in rows], sorted(row['changed_at'] for row in rows))
+
+    def test_key_rotation_covers_every_shard(self):
+        for alias, user in self.users.items():
+            self.add(user, f"site-{alias}")
+        patcher = mock.patch.dict(os.environ, {'ENCRYPTION_KEYS': f"1:{base64.b64encode(b'r' * 32).decode()}"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_keyring.cache_clear()
+        self.addCleanup(get_keyring.cache_clear)
+
+        with mock.patch.object(settings, 'KEY_ROTATION_MAX_ROWS_PER_SECOND', 0):
+            job = start_key_rotation(key_id=1)
+            self.assertEqual(sorted(job.chunks.values_list('shard', flat=True)), sorted(self.users))
+            self.assertEqual(run_rotation_worker(job.id), 3)
+
+        for alias in self.users:
+            passwords = list(PasswordVault.objects.using(alias).values_list('password', flat=True))
+            self.assertEqual(list(PasswordVault.objects.using(alias).values_list('key_id', flat=True)), [1])
+            self.assertTrue(passwords[0].startswith('v2$1$'))
+            self.assertEqual(decrypt_passwords(passwords), ['Str0ng!Vault#2024'])
+
+    def test_rebalance_moves_the_whole_vault(self):
+        user = self.users['shard1']
+        api = self.api(user)
+        for website_name in ('github', 'gitlab', 'bitbucket'):
+            self.add(user, website_name)
+        self.assertEqual(api.get('/api/password/delete', {'website_name': 'gitlab'}).status_code, 200)
+
+        copied = move_vault(user.id, 'shard2', grace=0)
+
+        self.assertEqual(copied, {'entries': 2, 'versions': 1, 'tombstones': 1, 'notifications': 3})
+        for model in (PasswordVault, VaultVersion, VaultSearchTerm, VaultTombstone, PendingNotification):
+            self.assertFalse(model.objects.using('shard1').filter(user_id=user.id).exists(), model.__name__)
+            self.assertTrue(model.objects.using('shard2').filter(user_id=user.id).exists(), model.__name__)
+        self.assertEqual(lookup_shard(user.id), ('shard2', False))
+        self.assertEqual(VaultVersion.objects.using('shard2').get(user_id=user.id).version, 4)
+        self.assertEqual(sorted(entry['website_name'] for entry in api.get('/api/password/all').json()['results']), ['bitbucket', 'github'])
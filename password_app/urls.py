@@ -1,12 +1,32 @@
 from django.urls import path
+from password_manager import settings
+from .async_views import AsyncAddPassword, AsyncViewAllPassword, AsyncUpdatePassword
 from .views import (AddPassword,
                     ViewAllPassword,
+                    SearchPassword,
+                    SyncPassword,
                     UpdatePassword,
-                    DeletePassword)
+                    DeletePassword,
+                    BatchPasswords,
+                    ImportPasswords,
+                    ImportStatus,
+                    PasswordStrength,
+                    GeneratePasswords)
+
+# Under ASGI, ASYNC_VIEWS=True serves the network-bound endpoints from async views.
+if settings.ASYNC_VIEWS:
+    AddPassword, ViewAllPassword, UpdatePassword = AsyncAddPassword, AsyncViewAllPassword, AsyncUpdatePassword
 
 urlpatterns = [
     path('add',AddPassword.as_view()),
     path('all',ViewAllPassword.as_view()),
+    path('search',SearchPassword.as_view()),
+    path('changes',SyncPassword.as_view()),
     path('update',UpdatePassword.as_view()),
-    path('delete',DeletePassword.as_view())
+    path('delete',DeletePassword.as_view()),
+    path('batch',BatchPasswords.as_view()),
+    path('import',ImportPasswords.as_view()),
+    path('import/<int:job_id>',ImportStatus.as_view()),
+    path('strength',PasswordStrength.as_view()),
+    path('generate',GeneratePasswords.as_view()),
 ]
\ No newline at end of file
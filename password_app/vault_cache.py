@@ -0,0 +1,108 @@
+import threading
+from django.core.cache import caches
+from password_manager import settings
+
+class VaultPageCache:
+    """
+    Read cache for pages of a user's vault listing.
+
+    Pages are stored exactly as read from the database, with the password still
+    encrypted, under a key made of the user id, the vault version (see
+    VaultVersion), the cursor and the page size. Every write bumps the version in
+    its own transaction, so a later read builds a new key and an entry can never
+    be served after the vault changed. Old versions are never deleted; they
+    fall out through the backend's timeout and size-bounded eviction.
+
+    A page is always read from the database after the version it is stored under,
+    so it reflects that version or a newer one, even when two writers race. With
+    read replicas both reads come from the one replica picked for the request.
+    """
+
+    def __init__(self, alias='vault'):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Return a snapshot of the hits, misses and errors counters, with the hit ratio."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    @staticmethod
+    def key(user_id, version, cursor, page_size):
+        return f"page:{user_id}:{version}:{cursor}:{page_size}"
+
+    def get_page(self, user_id, version, cursor, page_size, load):
+        """
+        Return a page of encrypted vault rows, reading through the cache.
+
+        A cache backend that is down is treated as a miss, so listings keep working
+        from the database.
+
+        Parameters:
+        - user_id (int): Id of the vault owner.
+        - version (int): Vault version read before the page is loaded.
+        - cursor (int): Id after which the page starts.
+        - page_size (int): Number of entries per page.
+        - load (callable): Returns (rows, next_cursor) from the database on a miss.
+        Returns: tuple: (rows, next_cursor) with the passwords still encrypted.
+        """
+        if not settings.VAULT_CACHE_ENABLED:
+            return load()
+        key = self.key(user_id, version, cursor, page_size)
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            print(f"Error: Vault cache unavailable: {e}")
+            self._count('errors')
+            cached = None
+        if cached is not None:
+            self._count('hits')
+            return cached
+
+        self._count('misses')
+        rows, next_cursor = load()
+        try:
+            # Backends pickle on set, so the caller may decrypt the returned rows in place afterwards.
+            self.backend.set(key, (rows, next_cursor))
+        except Exception as e:
+            print(f"Error: Vault cache unavailable: {e}")
+            self._count('errors')
+        return rows, next_cursor
+
+    async def aget_page(self, user_id, version, cursor, page_size, load):
+        """Async version of get_page; `load` is a coroutine function and the backend is reached through its async API."""
+        if not settings.VAULT_CACHE_ENABLED:
+            return await load()
+        key = self.key(user_id, version, cursor, page_size)
+        try:
+            cached = await self.backend.aget(key)
+        except Exception as e:
+            print(f"Error: Vault cache unavailable: {e}")
+            self._count('errors')
+            cached = None
+        if cached is not None:
+            self._count('hits')
+            return cached
+
+        self._count('misses')
+        rows, next_cursor = await load()
+        try:
+            await self.backend.aset(key, (rows, next_cursor))
+        except Exception as e:
+            print(f"Error: Vault cache unavailable: {e}")
+            self._count('errors')
+        return rows, next_cursor
+
+vault_page_cache = VaultPageCache()
@@ -1,15 +1,53 @@
+import hmac
 from rest_framework import views
 from rest_framework import status
-from .models import PasswordVault
-from django.contrib.auth.models import User
+from .models import PasswordVault, ImportJob, PendingNotification, VaultTombstone, VaultVersion
 from .serializers import PasswordSerializer
+from password_manager import settings
+from password_manager.db_router import replica_view, vault_db
+from django.db import IntegrityError, transaction
 from rest_framework.response import Response
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.cache import patch_vary_headers, add_never_cache_headers
 from rest_framework.exceptions import ValidationError
-from password_app.tasks import send_password_add_mail, send_password_update_mail
+from password_app.tasks import send_password_import_mail, import_passwords
+from .notifications import queue_notification
+from .outbox import enqueue
+from .importers import parse_export, encrypt_rows, import_vault_entries
+from .batch import apply_vault_batch
+from .vault_cache import vault_page_cache
+from .search import SEARCH_MODES, FUZZY, normalize_query, search_exact, search_fuzzy
+from password_manager.strength import estimate_strength
 from password_manager.utility import (check_password_strength,
                                       generate_password,
+                                      generate_passwords,
                                       decrypt_password,
-                                      encrypt_password)
+                                      decrypt_passwords,
+                                      encrypt_password,
+                                      stream_vault_entries)
+
+# Columns returned by /api/password/all; 'user' is filled in with the requesting username.
+VAULT_ENTRY_FIELDS = ('id', 'website_name', 'website_url', 'password', 'created_at')
+
+def vault_etag(user, version):
+    """Return the entity tag of a user's vault at a given version."""
+    return f'"{user.id}-{version}"'
+
+def is_not_modified(request, etag):
+    """Return True if the request's If-None-Match header already names the current entity tag."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags or etag in [tag.removeprefix('W/') for tag in etags]
+
+def with_etag(response, etag):
+    """Attach the vault's entity tag to a response and keep shared caches from storing it."""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
 
 class AddPassword(views.APIView):
 
@@ -28,12 +66,10 @@ class AddPassword(views.APIView):
     def post(self, request, *args, **kwargs):
         autogenerate = request.GET.get('autogenerate')
         data = request.data
-        current_user = request.user.username
-        data['user'] = current_user
         data['website_name'] = data['website_name'].lower()
-        email = User.objects.get(username = current_user).email
-        if PasswordVault.objects.filter(user=current_user, website_name=(data['website_name']).lower()).exists():
-            raise ValidationError({"Error": f"Passwords for '{data['website_name']}' already exist. Consider updating the existing password for enhanced security."})
+        duplicate_error = {"Error": f"Passwords for '{data['website_name']}' already exist. Consider updating the existing password for enhanced security."}
+        if PasswordVault.objects.filter(user=request.user, website_name=data['website_name']).exists():
+            raise ValidationError(duplicate_error)
 
         if autogenerate:
             data['password'] = generate_password()
@@ -47,30 +83,155 @@ class AddPassword(views.APIView):
                 return resultant_data
             else:
                 serializer.validated_data['password'] = resultant_data['password']
-                serializer.save()
-                send_password_add_mail.delay(email, current_user, resultant_data['website_name'])
+                try:
+                    with transaction.atomic(using=vault_db()):
+                        serializer.save(user=request.user)
+                        queue_notification(request.user, PendingNotification.ADDED, resultant_data['website_name'])
+                except IntegrityError:
+                    # A concurrent request added the same website between the exists() check and the insert.
+                    raise ValidationError(duplicate_error)
                 return Response({"Message": f"Password for {serializer.validated_data['website_name']} has been added successfully"}, status=status.HTTP_201_CREATED)
         raise ValidationError(serializer.errors)
     
 class ViewAllPassword(views.APIView):
     """
     View to retrieve all password entries for the authenticated user.
-    This view handles GET requests to retrieve all password entries associated
-    with the authenticated user. It returns a JSON response containing details of
-    all the password entries.
+    This view handles GET requests to retrieve the password entries associated
+    with the authenticated user. Entries are returned one page at a time using
+    keyset pagination on the entry id, or streamed in full when 'stream' is given.
+    Pages are read through the vault page cache, keyed by the vault version.
 
     Parameters:
     - request (Request): HTTP GET request object.
-    - current_user (str): Username of the authenticated user.
+    - cursor (str): Optional query parameter, the 'next_cursor' value of the previous page.
+    - page_size (str): Optional query parameter, number of entries per page.
+    - stream (str): Optional query parameter, 'json' or 'ndjson' to stream the whole vault.
 
-    Return: Response: JSON response containing details of all the password entries associated with the authenticated user.
+    Return: Response: JSON response containing a page of password entries and the cursor of the next page,
+    or a StreamingHttpResponse containing every password entry of the authenticated user.
     """
+    @replica_view
     def get(self, request, *args, **kwargs):
         current_user = request.user.username
-        all_entries = PasswordVault.objects.filter(user=current_user).values()
-        for data in all_entries:
-            data['password'] = decrypt_password(data['password'])
-        return Response(all_entries)
+        version = VaultVersion.current(request.user.id)
+        etag = vault_etag(request.user, version)
+        if is_not_modified(request, etag):
+            return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        all_entries = PasswordVault.objects.filter(user=request.user).order_by('id').values(*VAULT_ENTRY_FIELDS)
+
+        output_format = request.GET.get('stream')
+        if output_format:
+            if output_format not in ('json', 'ndjson'):
+                return Response({"Error": "stream must be either 'json' or 'ndjson'"}, status=status.HTTP_400_BAD_REQUEST)
+            content_type = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+            # The body is read after the view returns, so bind it to the database picked for this request.
+            rows = stream_vault_entries(all_entries.using(all_entries.db), output_format, settings.VAULT_STREAM_CHUNK_SIZE, current_user)
+            return with_etag(StreamingHttpResponse(rows, content_type=content_type), etag)
+
+        try:
+            cursor = int(request.GET.get('cursor', 0))
+            page_size = int(request.GET.get('page_size', settings.VAULT_PAGE_SIZE))
+        except ValueError:
+            return Response({"Error": "cursor and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = max(1, min(page_size, settings.VAULT_MAX_PAGE_SIZE))
+
+        def load_page():
+            page = list(all_entries.filter(id__gt=cursor)[:page_size + 1])
+            next_cursor = page[page_size - 1]['id'] if len(page) > page_size else None
+            return page[:page_size], next_cursor
+
+        page, next_cursor = vault_page_cache.get_page(request.user.id, version, cursor, page_size, load_page)
+        passwords = decrypt_passwords([data['password'] for data in page])
+        for data, password in zip(page, passwords):
+            data['user'] = current_user
+            data['password'] = password
+        return with_etag(Response({"results": page, "next_cursor": next_cursor, "version": version}), etag)
+
+class SyncPassword(views.APIView):
+    """
+    View to fetch only what changed in the authenticated user's vault since a known version.
+    This view handles GET requests carrying in 'since' the version of the client's last sync. When nothing
+    changed, only the vault version row is read. Otherwise the entries added or updated after that
+    version are returned decrypted, with the ids of the deleted entries. Clients apply the deletions
+    first and then the changes. If more than VAULT_SYNC_MAX_CHANGES entries changed, or the version is
+    unknown, 'reset' is true and the client should reload the vault through ViewAllPassword.
+    Also answers If-None-Match with 304 when the vault is unchanged.
+
+    Parameters:
+    - request (Request): HTTP GET request object.
+    - since (str): Vault version of the client's last sync, 0 for a first sync.
+
+    Return: Response: JSON response with the current 'version', the 'changed' entries, the 'deleted' entries and 'reset'.
+    """
+    @replica_view
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET['since'])
+        except (KeyError, ValueError):
+            return Response({"Error": "since must be an integer vault version"}, status=status.HTTP_400_BAD_REQUEST)
+        version = VaultVersion.current(request.user.id)
+        etag = vault_etag(request.user, version)
+        if is_not_modified(request, etag):
+            return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        if since == version:
+            return with_etag(Response({"version": version, "changed": [], "deleted": [], "reset": False}), etag)
+        if since < 0 or since > version:
+            return with_etag(Response({"version": version, "changed": [], "deleted": [], "reset": True}), etag)
+
+        limit = settings.VAULT_SYNC_MAX_CHANGES
+        changed = list(PasswordVault.objects.filter(user=request.user, version__gt=since, version__lte=version)
+                       .order_by('version', 'id').values(*VAULT_ENTRY_FIELDS, 'version')[:limit + 1])
+        deleted = list(VaultTombstone.objects.filter(user_id=request.user.id, version__gt=since, version__lte=version)
+                       .order_by('version', 'id').values('entry_id', 'website_name', 'version')[:limit + 1])
+        if len(changed) + len(deleted) > limit:
+            return with_etag(Response({"version": version, "changed": [], "deleted": [], "reset": True}), etag)
+
+        passwords = decrypt_passwords([data['password'] for data in changed])
+        for data, password in zip(changed, passwords):
+            data['user'] = request.user.username
+            data['password'] = password
+        deleted = [{"id": data['entry_id'], "website_name": data['website_name'], "version": data['version']} for data in deleted]
+        return with_etag(Response({"version": version, "changed": changed, "deleted": deleted, "reset": False}), etag)
+
+class SearchPassword(views.APIView):
+    """
+    View to search the password entries of the authenticated user by website name and URL.
+    This view handles GET requests and answers from the vault's trigram index, so only the
+    matched entries are read and decrypted. Results are paged like ViewAllPassword.
+
+    Parameters:
+    - request (Request): HTTP GET request object.
+    - q (str): Search query, matched against the website name and the host and path of the website URL.
+    - mode (str): Optional query parameter, 'prefix', 'substring' (default) or 'fuzzy'.
+    - cursor (str): Optional query parameter, the 'next_cursor' value of the previous page.
+    - page_size (str): Optional query parameter, number of entries per page.
+
+    Return: Response: JSON response containing a page of matching password entries and the cursor of the next page.
+    """
+    @replica_view
+    def get(self, request, *args, **kwargs):
+        query = normalize_query(request.GET.get('q', ''))
+        mode = request.GET.get('mode', 'substring')
+        if not query:
+            return Response({"Error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if mode not in SEARCH_MODES:
+            return Response({"Error": f"mode must be one of {', '.join(SEARCH_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page_size = int(request.GET.get('page_size', settings.VAULT_PAGE_SIZE))
+            page_size = max(1, min(page_size, settings.VAULT_MAX_PAGE_SIZE))
+            cursor = request.GET.get('cursor')
+            if mode == FUZZY:
+                page, next_cursor = search_fuzzy(request.user, query, VAULT_ENTRY_FIELDS, cursor, page_size)
+            else:
+                page, next_cursor = search_exact(request.user, query, mode, VAULT_ENTRY_FIELDS, int(cursor or 0), page_size)
+        except ValueError:
+            return Response({"Error": "Invalid cursor or page_size"}, status=status.HTTP_400_BAD_REQUEST)
+
+        passwords = decrypt_passwords([data['password'] for data in page])
+        for data, password in zip(page, passwords):
+            data['user'] = request.user.username
+            data['password'] = password
+        return Response({"results": page, "next_cursor": next_cursor})
 
 class UpdatePassword(views.APIView):
 
@@ -82,7 +243,6 @@ class UpdatePassword(views.APIView):
     Parameters:
     - request (Request): HTTP POST request object.
     - current_user (str): Username of the authenticated user.
-    - email (str): Email associated with the authenticated user.
     - data (dict): Dictionary containing request data.
 
     Returns: Response: JSON response indicating the status of the password update request.
@@ -90,21 +250,19 @@ class UpdatePassword(views.APIView):
 
     def post(self, request, *args, **kwargs):
         data = request.data
-        current_user = request.user.username
-        email = User.objects.get(username = current_user).email
         if 'old_password' not in data.keys() or 'new_password' not in data.keys():
             return Response({"Error":"old_password/new_password key is required"}, status=status.HTTP_400_BAD_REQUEST)
-        encrypted_old_password = encrypt_password(data['old_password'])
         try:
-            user_info = PasswordVault.objects.get(user = current_user, website_name = data['website_name'], website_url = data['website_url'])
-            if user_info.password != encrypted_old_password:
+            user_info = PasswordVault.objects.get(user = request.user, website_name = data['website_name'], website_url = data['website_url'])
+            # Ciphertexts carry a random nonce, so the stored value is decrypted rather than re-encrypting the old password.
+            if not hmac.compare_digest(decrypt_password(user_info.password).encode('utf-8'), str(data['old_password']).encode('utf-8')):
                 return Response({"Error": "Old password does not match."}, status=status.HTTP_400_BAD_REQUEST)
             
             encrypted_new_password = encrypt_password(data['new_password'])
             user_info.password = encrypted_new_password
-            user_info.save(update_fields=['password'])
-
-            send_password_update_mail.delay(email,current_user,user_info.website_name)
+            with transaction.atomic(using=vault_db()):
+                user_info.save(update_fields=['password', 'updated_at'])
+                queue_notification(request.user, PendingNotification.UPDATED, user_info.website_name)
             return Response({"Message":f"Password for {data['website_name']} updated successfully."},status=status.HTTP_200_OK) 
         except PasswordVault.DoesNotExist:
             return Response({"Error": "Invalid data provided. Please ensure that the input is accurate and complete."}, status=status.HTTP_404_NOT_FOUND)
@@ -126,13 +284,167 @@ class DeletePassword(views.APIView):
         
     def get(self,request,*args,**kwargs):
         website_name = request.GET.get('website_name')
-        current_user = request.user.username
         if not website_name:
             return Response({"Error": "Website_name required"}, status=status.HTTP_404_NOT_FOUND)
-        try:
-            password_info = PasswordVault.objects.get(user = current_user, website_name = website_name)
-            password_info.delete()
-            return Response({"Message":f"Password for {website_name} deleted successfully"},status=status.HTTP_200_OK)
-        except:
+        deleted, _ = PasswordVault.objects.filter(user = request.user, website_name = website_name).delete()
+        if not deleted:
             return Response({"Error":f"No password found for {website_name}"},status=status.HTTP_404_NOT_FOUND)
+        return Response({"Message":f"Password for {website_name} deleted successfully"},status=status.HTTP_200_OK)
+
+
+class BatchPasswords(views.APIView):
+
+    """
+    View to update and delete many password entries in one request.
+    This view handles POST requests with an 'operations' list, each item holding 'op' ('update' or
+    'delete') and 'website_name', plus 'old_password' and 'new_password' for updates and optionally
+    'website_url'. All operations are applied in one transaction and the updates are mailed as one
+    digest. With 'atomic' true (the default) nothing is applied unless every operation succeeds;
+    with 'atomic' false the valid operations are applied and the failed ones reported.
+
+    Parameters:
+    - request (Request): HTTP POST request object containing the operations.
+
+    Returns: Response: JSON response with the outcome of every operation; HTTP 400 if nothing was
+    applied because of errors, HTTP 207 if only some operations were applied.
+    """
 
+    def post(self, request, *args, **kwargs):
+        operations = request.data.get('operations')
+        atomic = request.data.get('atomic', True)
+        if not isinstance(operations, list) or not 1 <= len(operations) <= settings.VAULT_BATCH_MAX_OPERATIONS:
+            return Response({"Error": f"operations must be a list of 1 to {settings.VAULT_BATCH_MAX_OPERATIONS} operations"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(atomic, bool):
+            return Response({"Error": "atomic must be true or false"}, status=status.HTTP_400_BAD_REQUEST)
+
+        applied, results = apply_vault_batch(request.user, operations, atomic)
+        updated = sum(result['status'] == 'updated' for result in results)
+        deleted = sum(result['status'] == 'deleted' for result in results)
+        failed = sum(result['status'] == 'error' for result in results)
+        body = {"updated": updated, "deleted": deleted, "failed": failed, "results": results, "version": VaultVersion.current(request.user.id)}
+        if not failed:
+            return Response({"Message": f"{updated} password(s) updated and {deleted} deleted successfully.", **body}, status=status.HTTP_200_OK)
+        if not applied:
+            return Response({"Error": f"{failed} operation(s) failed; no changes were made.", **body}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"Message": f"{updated} password(s) updated and {deleted} deleted; {failed} operation(s) failed.", **body}, status=status.HTTP_207_MULTI_STATUS)
+
+class ImportPasswords(views.APIView):
+
+    """
+    View to import many password entries at once from a browser or password manager export.
+    This view handles POST requests with a 'file' upload holding a Chrome, Firefox, Bitwarden or
+    1Password CSV export, or a Bitwarden JSON export. Small uploads are imported within the request;
+    larger ones are handed to a Celery job whose progress can be polled through ImportStatus.
+    A single summary email is sent once the import is complete.
+
+    Parameters:
+    - request (Request): HTTP POST request object containing the uploaded export.
+
+    Returns: Response: JSON response with the per-row import report, or the id of the import job.
+    """
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"Error": "An export file is required in the 'file' field."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rows, report = parse_export(upload)
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({"Error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        encrypt_rows(rows)
+
+        if len(rows) > settings.IMPORT_SYNC_MAX_ROWS:
+            with transaction.atomic():
+                job = ImportJob.objects.create(user=request.user, total=len(rows) + len(report), processed=len(report), rows=rows, report=report)
+                enqueue(import_passwords, (job.id,), dedupe_key=f"import-job:{job.id}")
+            return Response({"Message": f"Import of {job.total} entries has started.", "job_id": job.id, "status": job.status}, status=status.HTTP_202_ACCEPTED)
+
+        # The entries are written chunk by chunk with breach checks in between, so the summary is queued once they are in.
+        imported, import_report = import_vault_entries(request.user, rows)
+        report = sorted(report + import_report, key=lambda entry: entry['row'])
+        if report:
+            enqueue(send_password_import_mail, (request.user.email, request.user.username, imported, len(report) - imported))
+        return Response({"Message": f"{imported} passwords imported successfully", "imported": imported, "report": report}, status=status.HTTP_201_CREATED)
+
+class ImportStatus(views.APIView):
+
+    """
+    View to poll the progress of a bulk import job.
+    This view handles GET requests for an import job owned by the authenticated user and returns
+    its status, progress and, once finished, the per-row import report.
+
+    Parameters:
+    - request (Request): HTTP GET request object.
+    - job_id (int): Id of the import job.
+
+    Returns: Response: JSON response describing the import job.
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = ImportJob.objects.filter(id=job_id, user=request.user).values('id', 'status', 'total', 'processed', 'imported', 'report').first()
+        if job is None:
+            return Response({"Error": f"No import job found with id {job_id}"}, status=status.HTTP_404_NOT_FOUND)
+        if job['status'] != ImportJob.COMPLETED:
+            del job['report']
+        return Response(job, status=status.HTTP_200_OK)
+
+class PasswordStrength(views.APIView):
+
+    """
+    View to score a password while it is being typed.
+    This view handles POST requests with a 'password' key and an optional 'website_name'.
+    Nothing is stored and the breach API is not called, so clients can send a request
+    on every keystroke. The username, the local part of the email and the website name
+    count as guessable words.
+
+    Parameters:
+    - request (Request): HTTP POST request object.
+
+    Returns: Response: JSON response with the score (0-4), guesses_log10, entropy_bits, crack_time_seconds,
+    classes, meets_policy, sequence, feedback and whether the password would be accepted.
+    """
+
+    def post(self, request, *args, **kwargs):
+        password = request.data.get('password')
+        if not isinstance(password, str):
+            return Response({"Error": "password key is required"}, status=status.HTTP_400_BAD_REQUEST)
+        user_inputs = [request.user.username, (request.user.email or '').split('@')[0], str(request.data.get('website_name') or '')]
+        result = estimate_strength(password, user_inputs)
+        result['min_score'] = settings.PASSWORD_MIN_SCORE
+        result['acceptable'] = result['meets_policy'] and result['score'] >= settings.PASSWORD_MIN_SCORE
+        response = Response(result, status=status.HTTP_200_OK)
+        add_never_cache_headers(response)
+        return response
+
+class GeneratePasswords(views.APIView):
+
+    """
+    View to generate a batch of random passwords for a requested policy.
+
+    Parameters:
+    - request (Request): HTTP GET request object.
+    - count (str): Optional query parameter, number of passwords (up to PASSWORD_GENERATOR_MAX_BATCH).
+    - length (str): Optional query parameter, characters per password.
+    - lowercase, uppercase, digits, symbols (str): Optional query parameters, 'false' to leave a character class out.
+    - exclude_ambiguous (str): Optional query parameter, 'true' to leave out easily confused characters.
+
+    Returns: Response: JSON response containing the generated passwords.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            count = int(request.GET.get('count', 1))
+            length = int(request.GET.get('length', settings.PASSWORD_GENERATOR_LENGTH))
+        except ValueError:
+            return Response({"Error": "count and length must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= count <= settings.PASSWORD_GENERATOR_MAX_BATCH:
+            return Response({"Error": f"count must be between 1 and {settings.PASSWORD_GENERATOR_MAX_BATCH}"}, status=status.HTTP_400_BAD_REQUEST)
+        options = {name: request.GET.get(name, str(default)).lower() in ('true', '1', 'yes')
+                   for name, default in (('lowercase', True), ('uppercase', True), ('digits', True), ('symbols', True), ('exclude_ambiguous', False))}
+        try:
+            passwords = generate_passwords(count, length, **options)
+        except ValueError as e:
+            return Response({"Error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = Response({"passwords": passwords}, status=status.HTTP_200_OK)
+        add_never_cache_headers(response)
+        return response
@@ -0,0 +1,76 @@
+import json
+import math
+from asgiref.sync import sync_to_async
+from django.views import View
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework_simplejwt.exceptions import InvalidToken
+from user_app.authentication import CachedJWTAuthentication
+from .middleware import TokenExpirationMiddleware
+
+class AsyncAPIView(View):
+    """
+    Base class of the async views served under ASGI.
+
+    Django REST framework views are synchronous, so these views are plain async
+    Django views that keep the API's contract: JWT authentication through
+    CachedJWTAuthentication, the parsed JSON or form body in request.data, REST
+    framework throttle classes in `throttle_classes`, and REST framework exceptions
+    rendered as JSON with their status code.
+    Handlers are `async def get/post(...)` methods.
+    """
+    authentication_required = True
+    throttle_classes = ()
+    authentication = CachedJWTAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authentication does not rely on cookies, so CSRF checks do not apply (as with APIView).
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def _parse_body(self, request):
+        if not request.body:
+            return {}
+        if request.content_type == 'application/json':
+            return json.loads(request.body)
+        return request.POST.dict()
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None) if method in self.http_method_names else None
+        if handler is None:
+            return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            if self.authentication_required:
+                result = await self.authentication.aauthenticate(request)
+                if result is None:
+                    response = JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+                    response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+                    return response
+                request.user = result[0]
+            try:
+                request.data = self._parse_body(request)
+            except ValueError as e:
+                return JsonResponse({"detail": f"JSON parse error - {e}"}, status=status.HTTP_400_BAD_REQUEST)
+            await sync_to_async(self.check_throttles)(request)
+            return await handler(request, *args, **kwargs)
+        except InvalidToken:
+            # Same body TokenExpirationMiddleware gives the sync views for an expired or invalid token.
+            return TokenExpirationMiddleware.expired_response()
+        except APIException as e:
+            response = JsonResponse(e.detail if isinstance(e.detail, (dict, list)) else {"detail": e.detail},
+                                    status=e.status_code, safe=False)
+            if e.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            if getattr(e, 'wait', None):
+                response['Retry-After'] = str(math.ceil(e.wait))
+            return response
+
+    def check_throttles(self, request):
+        """Raise Throttled with the longest wait if any of the view's throttles refuses the request, like APIView."""
+        waits = [throttle.wait() for throttle in (throttle_class() for throttle_class in self.throttle_classes)
+                 if not throttle.allow_request(request, self)]
+        if waits:
+            raise Throttled(wait=max((wait for wait in waits if wait is not None), default=None))
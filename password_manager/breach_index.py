@@ -0,0 +1,317 @@
+import os
+import mmap
+import time
+import struct
+import tempfile
+import threading
+from password_manager import settings
+
+# On-disk layout of the breach index (all integers little-endian):
+#   header  : magic, version, prefix_count, record_count, prefix_table_offset
+#   records : record_count raw 20-byte SHA-1 digests, sorted
+#   prefixes: prefix_count entries of (prefix, fetched_at, start, count), sorted by prefix
+# A prefix entry with fetched_at == 0 comes from a bulk dump and never expires.
+INDEX_MAGIC = b'PMBI'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sHIIQ')
+PREFIX_ENTRY = struct.Struct('<IIII')
+RECORD_SIZE = 20
+
+def _prefix_to_int(prefix):
+    return int(prefix, 16)
+
+class BreachIndex:
+    """
+    Read-only view over a breach index file, backed by a memory map.
+
+    Lookups binary search the prefix table for the 5-char SHA-1 prefix and then
+    binary search that prefix's block of digests, so only a handful of pages
+    are touched per password regardless of the index size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.mtime = os.fstat(self._file.fileno()).st_mtime
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.prefix_count, self.record_count, self._prefix_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a breach index (version {INDEX_VERSION})")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _prefix_entry(self, position):
+        return PREFIX_ENTRY.unpack_from(self._mm, self._prefix_offset + position * PREFIX_ENTRY.size)
+
+    def find_prefix(self, prefix):
+        """
+        Locate the block of digests stored for a 5-char SHA-1 prefix.
+
+        Parameters: prefix (str): Upper-case 5-char hex prefix.
+        Returns: tuple | None: (fetched_at, start, count) or None if the prefix is not indexed.
+        """
+        target = _prefix_to_int(prefix)
+        low, high = 0, self.prefix_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._prefix_entry(middle)
+            if entry[0] < target:
+                low = middle + 1
+            elif entry[0] > target:
+                high = middle
+            else:
+                return entry[1:]
+        return None
+
+    def _contains(self, digest, start, count):
+        low, high = start, start + count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD_SIZE
+            record = self._mm[offset:offset + RECORD_SIZE]
+            if record < digest:
+                low = middle + 1
+            elif record > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def lookup(self, sha1_password, ttl=None):
+        """
+        Check a SHA-1 hash against the index.
+
+        Parameters:
+        - sha1_password (str): Upper-case hex SHA-1 of the password.
+        - ttl (int): Maximum age in seconds of range-cache entries, None to accept any age.
+        Returns: bool | None: True if breached, False if known clean, None if the prefix is missing or stale.
+        """
+        entry = self.find_prefix(sha1_password[:5])
+        if entry is None:
+            return None
+        fetched_at, start, count = entry
+        if fetched_at and ttl is not None and time.time() - fetched_at > ttl:
+            return None
+        return self._contains(bytes.fromhex(sha1_password), start, count)
+
+    def iter_prefixes(self):
+        """Yield (prefix, fetched_at, digests) for every indexed prefix, in prefix order."""
+        for position in range(self.prefix_count):
+            prefix, fetched_at, start, count = self._prefix_entry(position)
+            offset = HEADER.size + start * RECORD_SIZE
+            digests = [self._mm[offset + i * RECORD_SIZE:offset + (i + 1) * RECORD_SIZE] for i in range(count)]
+            yield f"{prefix:05X}", fetched_at, digests
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_breach_index():
+    """
+    Return the process-wide breach index, reopening it when the file has been rebuilt.
+
+    Returns: BreachIndex | None: The open index, or None if no index file exists.
+    """
+    global _index
+    path = settings.BREACH_INDEX_PATH
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path or _index.mtime != mtime:
+            if _index is not None:
+                _index.close()
+            try:
+                _index = BreachIndex(path)
+            except (OSError, ValueError):
+                _index = None
+        return _index
+
+def parse_range_lines(prefix, lines):
+    """
+    Turn 'SUFFIX:COUNT' lines of a range response or dump file into sorted digests.
+
+    Parameters:
+    - prefix (str): 5-char prefix the suffixes belong to.
+    - lines (iterable): Lines of text in 'SUFFIX:COUNT' format.
+    Returns: list: Sorted 20-byte digests.
+    """
+    digests = []
+    for line in lines:
+        suffix = line.split(':', 1)[0].strip()
+        if len(suffix) == 35:
+            digests.append(bytes.fromhex(prefix + suffix))
+    digests.sort()
+    return digests
+
+def range_cache_path(prefix):
+    return os.path.join(settings.BREACH_RANGE_CACHE_DIR, f"{prefix}.txt")
+
+def read_cached_range(prefix, ttl=None):
+    """
+    Read a cached range response if it exists and is younger than the TTL.
+
+    Parameters:
+    - prefix (str): 5-char SHA-1 prefix.
+    - ttl (int): Maximum age in seconds, None to accept any age.
+    Returns: str | None: The cached response body, or None on a miss.
+    """
+    path = range_cache_path(prefix)
+    try:
+        if ttl is not None and time.time() - os.stat(path).st_mtime > ttl:
+            return None
+        with open(path, encoding='utf-8') as cached:
+            return cached.read()
+    except OSError:
+        return None
+
+def cache_range_response(prefix, text):
+    """
+    Store a range API response so the next index refresh can pick it up.
+
+    Parameters:
+    - prefix (str): 5-char SHA-1 prefix.
+    - text (str): Body of the range API response.
+    """
+    cache_dir = settings.BREACH_RANGE_CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'w', encoding='utf-8') as cached:
+            cached.write(text)
+        os.replace(temp_path, range_cache_path(prefix))
+    except OSError as e:
+        print(f"Error: Unable to cache Pwned Passwords range {prefix}: {e}")
+
+def iter_dump(path):
+    """
+    Yield (prefix, digests) from a bulk HIBP dump.
+
+    Accepts either a single file of 'SHA1:COUNT' lines ordered by hash, or a
+    directory of '<PREFIX>.txt' files holding 'SUFFIX:COUNT' lines, as written
+    by the official downloader. Only one prefix is held in memory at a time.
+
+    Parameters: path (str): Dump file or directory.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            prefix = name.split('.', 1)[0].upper()
+            if len(prefix) != 5:
+                continue
+            with open(os.path.join(path, name), encoding='utf-8') as dump:
+                yield prefix, parse_range_lines(prefix, dump)
+        return
+
+    current_prefix, suffixes = None, []
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            sha1_password = line[:40].upper()
+            if len(sha1_password) != 40:
+                continue
+            if sha1_password[:5] != current_prefix:
+                if current_prefix is not None:
+                    yield current_prefix, parse_range_lines(current_prefix, suffixes)
+                current_prefix, suffixes = sha1_password[:5], []
+            suffixes.append(sha1_password[5:])
+    if current_prefix is not None:
+        yield current_prefix, parse_range_lines(current_prefix, suffixes)
+
+def iter_cached_ranges(ttl=None):
+    """
+    Yield (prefix, fetched_at, digests) for every fresh range response in the cache, in prefix order.
+
+    Parameters: ttl (int): Maximum age in seconds, None to accept any age.
+    """
+    cache_dir = settings.BREACH_RANGE_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    for name in sorted(os.listdir(cache_dir)):
+        if not name.endswith('.txt'):
+            continue
+        prefix = name[:-4].upper()
+        path = os.path.join(cache_dir, name)
+        fetched_at = int(os.stat(path).st_mtime)
+        if ttl is not None and now - fetched_at > ttl:
+            continue
+        with open(path, encoding='utf-8') as cached:
+            yield prefix, fetched_at, parse_range_lines(prefix, cached)
+
+def write_breach_index(path, blocks):
+    """
+    Write a breach index atomically from blocks sorted by prefix.
+
+    Digests are streamed straight to disk; only the prefix table is kept in
+    memory, so building from a full dump needs a few megabytes at most.
+
+    Parameters:
+    - path (str): Destination index file.
+    - blocks (iterable): (prefix, fetched_at, digests) tuples in ascending prefix order.
+    Returns: tuple: (prefix_count, record_count) written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    prefix_table = []
+    record_count = 0
+    try:
+        with os.fdopen(handle, 'wb') as index:
+            index.write(b'\0' * HEADER.size)
+            for prefix, fetched_at, digests in blocks:
+                prefix_table.append(PREFIX_ENTRY.pack(_prefix_to_int(prefix), fetched_at, record_count, len(digests)))
+                index.write(b''.join(digests))
+                record_count += len(digests)
+            prefix_offset = index.tell()
+            index.write(b''.join(prefix_table))
+            index.seek(0)
+            index.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(prefix_table), record_count, prefix_offset))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(prefix_table), record_count
+
+def merge_blocks(existing, fresh):
+    """
+    Merge two prefix-ordered block streams, letting the fresh stream win on equal prefixes.
+
+    Parameters:
+    - existing (iterable): (prefix, fetched_at, digests) blocks from the current index.
+    - fresh (iterable): (prefix, fetched_at, digests) blocks from a dump or the range cache.
+    """
+    existing, fresh = iter(existing), iter(fresh)
+    old, new = next(existing, None), next(fresh, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield old
+            old = next(existing, None)
+        else:
+            if old is not None and old[0] == new[0]:
+                old = next(existing, None)
+            yield new
+            new = next(fresh, None)
+
+def lookup_breach_index(sha1_password):
+    """
+    Check a password hash against the local breach data without touching the network.
+
+    The memory-mapped index is consulted first, then the range cache for
+    prefixes fetched since the last index refresh.
+
+    Parameters: sha1_password (str): Upper-case hex SHA-1 of the password.
+    Returns: bool | None: True if breached, False if known clean, None if the network must be asked.
+    """
+    ttl = settings.BREACH_RANGE_TTL
+    index = get_breach_index()
+    if index is not None:
+        found = index.lookup(sha1_password, ttl)
+        if found is not None:
+            return found
+    prefix, suffix = sha1_password[:5], sha1_password[5:]
+    cached = read_cached_range(prefix, ttl)
+    if cached is None:
+        return None
+    return f"{suffix}:" in cached
@@ -1,26 +1,80 @@
 from __future__ import absolute_import, unicode_literals
 import os
+import smtplib
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Queue
+from password_manager import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_manager.settings')
 
 app = Celery('password_manager')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Queues are served by separate workers, so a long export or rotation never holds up an email:
+# - notifications: short mail tasks, rate limited and sent without storing a result.
+# - reports: weekly uploads and hourly change exports to storage.
+# - maintenance: imports, key rotation and anything not routed elsewhere.
+# The outbox relay runs on notifications too, as the emails it publishes wait on it.
+NOTIFICATIONS_QUEUE = 'notifications'
+REPORTS_QUEUE = 'reports'
+MAINTENANCE_QUEUE = 'maintenance'
+
+MAIL_TASKS = (
+    'user_app.tasks.send_welcome_mail',
+    'password_app.tasks.send_password_import_mail',
+)
+
+# Exponential backoff with jitter for tasks retried on transient failures.
+RETRY_BACKOFF = {
+    'retry_backoff': True,
+    'retry_backoff_max': settings.TASK_RETRY_BACKOFF_MAX,
+    'retry_jitter': True,
+    'max_retries': settings.TASK_MAX_RETRIES,
+}
+# Mail tasks retry SMTP and connection failures. Refused senders and recipients would be refused again.
+MAIL_RETRY_POLICY = {
+    'autoretry_for': (smtplib.SMTPException, OSError),
+    'dont_autoretry_for': (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused),
+    **RETRY_BACKOFF,
+}
+
+app.conf.task_queues = (Queue(NOTIFICATIONS_QUEUE), Queue(REPORTS_QUEUE), Queue(MAINTENANCE_QUEUE))
+app.conf.task_default_queue = MAINTENANCE_QUEUE
+app.conf.task_routes = {
+    **{name: {'queue': NOTIFICATIONS_QUEUE} for name in MAIL_TASKS},
+    'password_app.tasks.send_notification_digests': {'queue': NOTIFICATIONS_QUEUE},
+    'password_app.tasks.relay_outbox': {'queue': NOTIFICATIONS_QUEUE},
+    '*.tasks.upload_*': {'queue': REPORTS_QUEUE},
+    '*.tasks.export_*': {'queue': REPORTS_QUEUE},
+}
+app.conf.task_annotations = {name: {'rate_limit': settings.MAIL_TASK_RATE_LIMIT} for name in MAIL_TASKS}
+
+# The incremental change exports replace the weekly full exports; those tasks remain available for one-off runs.
 app.conf.beat_schedule = {
-    'send_weekly_password_data_on_monday':{
-        'task': 'password_app.tasks.upload_password_data_weekly_to_firebase',
-        # 'schedule' :crontab(minute='*/3', hour='*', day_of_week='*', day_of_month='*', month_of_year='*')
-        'schedule' : crontab(minute = 0, hour= 0, day_of_week='monday')
+    'export_password_changes_hourly':{
+        'task': 'password_app.tasks.export_vault_changes',
+        'schedule' : crontab(minute = 5)
+    },
+    "export_user_changes_hourly":{
+        "task":"user_app.tasks.export_user_changes",
+        'schedule' : crontab(minute = 5)
+    },
+    'send_notification_digests':{
+        'task': 'password_app.tasks.send_notification_digests',
+        'schedule' : crontab(minute = '*')
+    },
+    'relay_outbox':{
+        'task': 'password_app.tasks.relay_outbox',
+        'schedule' : settings.OUTBOX_RELAY_INTERVAL
     },
-    "send_weekly_user_data_on_monday":{
-        "task":"user_app.tasks.upload_user_data_weekly_to_firebase",
-        'schedule' : crontab(minute = 0, hour= 0, day_of_week='monday')
+    'flush_expired_tokens_daily':{
+        'task': 'user_app.tasks.flush_expired_tokens',
+        'schedule' : crontab(minute = 30, hour = 3)
     }
 }
 app.conf.enable_utc = False
 
-app.conf.update(timezone = 'utc')
+app.conf.update(timezone = 'UTC')
 
 app.autodiscover_tasks()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import heapq
+from itertools import groupby
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from django.contrib.auth.models import User
+from password_manager import settings
+from password_manager.storage import export_ndjson_gzip
+from password_manager.sharding import merge_shards
+from password_app.models import PasswordVault, VaultTombstone, ExportWatermark
+
+# The first run of a stream exports everything changed since this instant.
+INITIAL_WATERMARK = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def vault_changes(start, end):
+    """
+    Yield the vault changes of the window (start, end], ordered by change time.
+
+    Upserts come from PasswordVault.updated_at and deletions from VaultTombstone;
+    both are read through server-side iterators over their indexes and merged.
+    When the vault is sharded, every shard is read in parallel and the streams of
+    the shards are merged as well.
+
+    Parameters:
+    - start (datetime): Exclusive lower bound of the window.
+    - end (datetime): Inclusive upper bound of the window.
+    Yields: dict: Change rows with an 'op' of 'upsert' or 'delete' and a 'changed_at' timestamp.
+    """
+    return merge_shards(lambda alias: _shard_vault_changes(alias, start, end), key=lambda row: row['changed_at'])
+
+def _shard_vault_changes(alias, start, end):
+    upserts = (PasswordVault.objects.using(alias).filter(updated_at__gt=start, updated_at__lte=end).order_by('updated_at', 'id')
+               .values('id', 'user_id', 'website_name', 'website_url', 'password', 'created_at', 'updated_at')
+               .iterator(chunk_size=settings.REPORT_CHUNK_SIZE))
+    deletes = (VaultTombstone.objects.using(alias).filter(deleted_at__gt=start, deleted_at__lte=end).order_by('deleted_at', 'id')
+               .values('entry_id', 'user_id', 'website_name', 'deleted_at')
+               .iterator(chunk_size=settings.REPORT_CHUNK_SIZE))
+    upsert_rows = ({'op': 'upsert', 'changed_at': data['updated_at'], **data} for data in upserts)
+    delete_rows = ({'op': 'delete', 'changed_at': data['deleted_at'], 'id': data.pop('entry_id'), **data} for data in deletes)
+    return heapq.merge(upsert_rows, delete_rows, key=lambda row: row['changed_at'])
+
+def user_changes(start, end):
+    """
+    Yield the users who joined in the window (start, end], ordered by join time.
+    Password hashes are left out of the export.
+
+    Parameters:
+    - start (datetime): Exclusive lower bound of the window.
+    - end (datetime): Inclusive upper bound of the window.
+    Yields: dict: Change rows with an 'op' of 'upsert' and a 'changed_at' timestamp.
+    """
+    users = (User.objects.filter(date_joined__gt=start, date_joined__lte=end).order_by('date_joined', 'id')
+             .values('id', 'username', 'first_name', 'last_name', 'email', 'is_active', 'date_joined')
+             .iterator(chunk_size=settings.REPORT_CHUNK_SIZE))
+    return ({'op': 'upsert', 'changed_at': data['date_joined'], **data} for data in users)
+
+def export_changes(stream, changes):
+    """
+    Export everything changed since the stream's watermark, partitioned by day.
+
+    The window upper bound is persisted before anything is written and trails
+    the current time by CHANGE_EXPORT_LAG seconds, so rows from transactions
+    still in flight are picked up by the next window. A retry after a failure
+    reuses the persisted window and writes the same objects again, so exports
+    are idempotent. The watermark only advances once every partition is written.
+
+    Parameters:
+    - stream (str): Name of the export stream, used for the watermark and the storage path.
+    - changes (callable): Function returning the change rows of a (start, end] window, ordered by 'changed_at'.
+    Returns: tuple: (number of rows exported, list of destinations written).
+    """
+    with transaction.atomic():
+        mark, _ = ExportWatermark.objects.select_for_update().get_or_create(stream=stream, defaults={'watermark': INITIAL_WATERMARK})
+        if mark.pending_until is None:
+            mark.pending_until = timezone.now() - timedelta(seconds=settings.CHANGE_EXPORT_LAG)
+            mark.save(update_fields=['pending_until', 'updated_at'])
+    start, end = mark.watermark, mark.pending_until
+
+    exported, destinations = 0, []
+    for day, rows in groupby(changes(start, end), key=lambda row: row['changed_at'].date()):
+        destination = f"changes/{stream}/date={day.isoformat()}/{start:%Y%m%dT%H%M%S%f}_{end:%Y%m%dT%H%M%S%f}.ndjson.gz"
+        exported += export_ndjson_gzip(rows, destination)
+        destinations.append(destination)
+
+    ExportWatermark.objects.filter(stream=stream, pending_until=end).update(watermark=end, pending_until=None, updated_at=timezone.now())
+    return exported, destinations
@@ -0,0 +1,285 @@
+import zlib
+import random
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.apps import apps
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from password_manager import settings
+
+# Writes go to the primary, or to their shard for vault rows. Reads go to a replica only inside
+# read_from_replica(), which read-only paths (vault listing, search, sync, weekly reports) enter;
+# everything else, including the reads of a request that writes, stays on the primary. One replica
+# is picked per block, so all its queries see the same replica state: a vault version and the page
+# read after it can never come from two replicas that lag differently.
+PRIMARY = 'default'
+_read_alias = ContextVar('read_alias', default=None)
+# Holder set per request by DatabaseRoutingMiddleware; the router marks it when a write is routed.
+_request_writes = ContextVar('request_writes', default=None)
+
+# With DATABASE_SHARDS, the rows of these models live on the shard of the user they belong to.
+# The shard comes from the instance being saved, else from the vault owner of the request or of
+# a user_shard() block; with neither, queries go to the primary. User, the directory and every
+# other model stay on the primary; replicas only serve the primary's data.
+SHARDED_MODELS = {'password_app.passwordvault', 'password_app.vaultversion', 'password_app.vaultsearchterm',
+                  'password_app.vaulttombstone', 'password_app.pendingnotification'}
+# Holder of the user whose vault the current request or user_shard() block works on.
+_vault_owner = ContextVar('vault_owner', default=None)
+
+class VaultMoving(APIException):
+    """Raised when a vault write is routed while rebalance_vault is moving the vault to another shard."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "This vault is being moved to another database. Retry in a few seconds."
+    default_code = 'vault_moving'
+
+def is_sharded():
+    """Tell whether the vault is spread over more than one database."""
+    return len(settings.DATABASE_SHARD_ALIASES) > 1
+
+def hash_shard(user_id):
+    """Return the shard a stable hash of the user id places a new user on."""
+    aliases = settings.DATABASE_SHARD_ALIASES
+    return aliases[zlib.crc32(str(user_id).encode()) % len(aliases)]
+
+def _shard_key(user_id):
+    return f"vault-shard:{user_id}"
+
+def lookup_shard(user_id):
+    """
+    Return the shard of a user's vault from the VaultShard directory, through the vault cache.
+    A user without a directory row is placed with hash_shard and the row is created, unless
+    they already have a vault on the primary from before it was sharded, which stays there.
+
+    Parameters: user_id (int): Id of the vault owner.
+    Returns: tuple: (alias, moving), moving being True while rebalance_vault moves the vault.
+    """
+    if not is_sharded():
+        return PRIMARY, False
+    cache = caches['vault']
+    entry = cache.get(_shard_key(user_id))
+    if entry is None:
+        directory = apps.get_model('password_app', 'VaultShard').objects.using(PRIMARY)
+        entry = directory.filter(user_id=user_id).values_list('shard', 'moving').first()
+        if entry is None:
+            existing = any(apps.get_model('password_app', name).objects.using(PRIMARY).filter(user_id=user_id).exists()
+                           for name in ('PasswordVault', 'VaultVersion'))
+            try:
+                with transaction.atomic(using=PRIMARY):
+                    directory.create(user_id=user_id, shard=PRIMARY if existing else hash_shard(user_id))
+            except IntegrityError:
+                pass
+            entry = directory.filter(user_id=user_id).values_list('shard', 'moving').get()
+        cache.set(_shard_key(user_id), tuple(entry), settings.SHARD_DIRECTORY_CACHE_TIMEOUT)
+    return tuple(entry)
+
+def forget_shard(user_id):
+    """Drop the cached shard of a user after the directory row changed."""
+    caches['vault'].delete(_shard_key(user_id))
+
+def shard_for_user(user_id, for_write=False):
+    """
+    Return the database holding a user's vault.
+
+    Parameters:
+    - user_id (int): Id of the vault owner.
+    - for_write (bool): Whether the caller is about to write to the vault.
+    Returns: str: Database alias.
+    Raises: VaultMoving: If for_write and the vault is being moved.
+    """
+    alias, moving = lookup_shard(user_id)
+    if for_write and moving:
+        raise VaultMoving()
+    return alias
+
+def bind_vault_owner(user_id):
+    """Route the vault queries of the current request to the shard of the authenticated user."""
+    owner = _vault_owner.get()
+    if owner is None:
+        _vault_owner.set({'user_id': user_id})
+    elif owner['user_id'] != user_id:
+        owner.clear()
+        owner['user_id'] = user_id
+
+def current_vault_owner():
+    """Return the id of the user whose vault the current request or user_shard() block works on, if any."""
+    owner = _vault_owner.get()
+    return owner['user_id'] if owner is not None else None
+
+def owner_shard(for_write=False):
+    """
+    Return the shard of the current vault owner, looked up once per request or user_shard() block.
+
+    Parameters: for_write (bool): Whether the caller is about to write to the vault.
+    Returns: str | None: Database alias, None when there is no vault owner.
+    Raises: VaultMoving: If for_write and the vault is being moved.
+    """
+    owner = _vault_owner.get()
+    if owner is None or owner['user_id'] is None:
+        return None
+    if 'shard' not in owner:
+        owner['shard'] = lookup_shard(owner['user_id'])
+    alias, moving = owner['shard']
+    if for_write and moving:
+        raise VaultMoving()
+    return alias
+
+@contextmanager
+def user_shard(user_id):
+    """
+    Route the vault queries of the block to the shard of a user, for code running outside a
+    request such as Celery tasks and management commands.
+
+    Parameters: user_id (int): Id of the vault owner.
+    Yields: str: The user's shard.
+    """
+    token = _vault_owner.set({'user_id': user_id})
+    try:
+        yield owner_shard()
+    finally:
+        _vault_owner.reset(token)
+
+def vault_db(user_id=None):
+    """
+    Return the database a block writing to a vault has to open its transaction on.
+
+    Parameters: user_id (int): Id of the vault owner, the current vault owner by default.
+    Returns: str: Database alias.
+    Raises: VaultMoving: If the vault is being moved.
+    """
+    if user_id is None:
+        return owner_shard(for_write=True) or PRIMARY
+    return shard_for_user(user_id, for_write=True)
+
+def replica_alias_for(alias):
+    """Return the database reads of a shard should go to: a replica for the primary, the shard itself otherwise."""
+    return pick_read_alias() if alias == PRIMARY else alias
+
+# Cache of the read-your-writes markers, shared by every process (see REPLICA_STICKY_CACHE_BACKEND).
+STICKY_CACHE = 'replica_sticky'
+
+def _sticky_key(user_id):
+    return f"db-primary:{user_id}"
+
+def stick_to_primary(user_id):
+    """Send a user's replica reads to the primary for REPLICA_STICKY_SECONDS so they see their own writes."""
+    caches[STICKY_CACHE].set(_sticky_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+def pick_read_alias(user_id=None, sticky=None):
+    """
+    Return the database a read-only block should read from: a random replica, or the primary
+    when there is none or the user wrote within REPLICA_STICKY_SECONDS.
+
+    Parameters:
+    - user_id (int): Optional id of the user the reads are for.
+    - sticky (bool): Whether the user is pinned to the primary, looked up in the cache when None.
+    Returns: str: Database alias.
+    """
+    if not settings.DATABASE_REPLICA_ALIASES:
+        return PRIMARY
+    if sticky is None:
+        sticky = user_id is not None and caches[STICKY_CACHE].get(_sticky_key(user_id)) is not None
+    return PRIMARY if sticky else random.choice(settings.DATABASE_REPLICA_ALIASES)
+
+@contextmanager
+def read_from_replica(user_id=None, alias=None):
+    """
+    Route the reads of the block to one replica (see pick_read_alias).
+    Querysets evaluated after the block, such as the body of a streaming response, read from the
+    primary unless they were bound to the replica with .using(queryset.db) inside it.
+
+    Parameters:
+    - user_id (int): Optional id of the user the reads are for.
+    - alias (str): Database to read from, picked with pick_read_alias by default.
+    Yields: str: The alias reads are routed to.
+    """
+    alias = alias or pick_read_alias(user_id)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+def replica_view(handler):
+    """
+    Decorator of read-only view handlers (sync or async) that runs them under read_from_replica
+    for the authenticated user. Reads of a vault on another shard than the primary go to that shard.
+    """
+    if iscoroutinefunction(handler):
+        @wraps(handler)
+        async def async_wrapper(view, request, *args, **kwargs):
+            if is_sharded():
+                # Querysets may resolve their database in the event loop, where the directory cannot be read.
+                await sync_to_async(owner_shard)()
+            sticky = None
+            if settings.DATABASE_REPLICA_ALIASES:
+                sticky = await caches[STICKY_CACHE].aget(_sticky_key(request.user.id)) is not None
+            with read_from_replica(alias=pick_read_alias(request.user.id, sticky)):
+                return await handler(view, request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        with read_from_replica(request.user.id):
+            return handler(view, request, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def track_request_writes():
+    """
+    Record whether a database write is routed during the block, and scope the vault owner bound
+    by authentication to it.
+
+    Yields: dict: {'wrote': bool}, updated by the router; a mutable holder so writes made in a
+    thread that runs with a copy of the context (sync_to_async) are still seen.
+    """
+    writes = {'wrote': False}
+    token, owner_token = _request_writes.set(writes), _vault_owner.set({'user_id': None})
+    try:
+        yield writes
+    finally:
+        _vault_owner.reset(owner_token)
+        _request_writes.reset(token)
+
+class ReplicaRouter:
+    """
+    Database router sending writes, migrations and ordinary reads to the primary, the reads made
+    inside read_from_replica() to the replica picked for that block, and the queries of the vault
+    models to the shard of the vault they belong to.
+    """
+
+    @staticmethod
+    def _vault_shard(model, hints, for_write=False):
+        if model._meta.label_lower not in SHARDED_MODELS or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        user_id = None
+        if instance is not None:
+            user_id = instance.pk if instance._meta.label_lower == 'auth.user' else getattr(instance, 'user_id', None)
+        if user_id is None or user_id == current_vault_owner():
+            return owner_shard(for_write)
+        return shard_for_user(user_id, for_write)
+
+    def db_for_read(self, model, **hints):
+        shard = self._vault_shard(model, hints)
+        if shard is not None and shard != PRIMARY:
+            return shard
+        return _read_alias.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        writes = _request_writes.get()
+        if writes is not None:
+            writes['wrote'] = True
+        return self._vault_shard(model, hints, for_write=True) or PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary, and vault rows only point to users by id.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary by replication. Shards get the whole schema
+        # (their user tables stay empty) so that they can be migrated like the primary.
+        return db in settings.DATABASE_SHARD_ALIASES
@@ -0,0 +1,344 @@
+import time
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from password_manager import settings
+from password_manager.breach_index import lookup_breach_index, cache_range_response
+
+class BreachCheckUnavailable(Exception):
+    """Raised when the Pwned Passwords API cannot be reached and the client fails closed."""
+
+def _unavailable(error, request_error):
+    """Return the BreachCheckUnavailable a failed range request is reported with."""
+    if isinstance(error, BreachCheckUnavailable):
+        return error
+    if isinstance(error, request_error):
+        return BreachCheckUnavailable(f"Unable to reach the Pwned Passwords API: {error}")
+    return BreachCheckUnavailable(f"Unable to read the Pwned Passwords API response: {error!r}")
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the breaker opens and every call
+    fails fast for `reset_timeout` seconds. Then a single trial call is let
+    through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Return True if a call may go to the upstream right now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+class _InflightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.error = None
+
+class _ClientStats:
+    """Hit, miss, coalesced, breaker_open and errors counters kept by both HIBP clients."""
+    STATS = ('hits', 'misses', 'coalesced', 'breaker_open', 'errors')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(self.STATS, 0)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Return a snapshot of the hit, miss, coalesced, breaker_open and errors counters."""
+        with self._lock:
+            return dict(self._stats)
+
+class HIBPClient(_ClientStats):
+    """
+    Shared client for the Pwned Passwords range API.
+
+    Keeps one pooled keep-alive session with strict timeouts, collapses
+    concurrent lookups of the same prefix into a single upstream request,
+    and guards the upstream with a circuit breaker. When the API is
+    unavailable the client either treats the password as clean (fail-open)
+    or raises BreachCheckUnavailable (fail-closed).
+    """
+
+    def __init__(self, api_url=None, connect_timeout=None, read_timeout=None, pool_size=None,
+                 failure_threshold=None, reset_timeout=None, fail_open=None):
+        super().__init__()
+        self.api_url = (api_url or settings.HIBP_API_URL).rstrip('/')
+        self.timeout = (connect_timeout or settings.HIBP_CONNECT_TIMEOUT, read_timeout or settings.HIBP_READ_TIMEOUT)
+        self.fail_open = settings.HIBP_FAIL_OPEN if fail_open is None else fail_open
+        self.breaker = CircuitBreaker(failure_threshold or settings.HIBP_BREAKER_THRESHOLD,
+                                      reset_timeout or settings.HIBP_BREAKER_RESET)
+        # requests is only needed once a breach check misses the local index, so it is imported here.
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._request_error = requests.RequestException
+        pool_size = self.pool_size = pool_size or settings.HIBP_POOL_SIZE
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'password-manager-drf'})
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._inflight = {}
+
+    def _request_range(self, prefix):
+        if not self.breaker.allow():
+            self._count('breaker_open')
+            raise BreachCheckUnavailable("Pwned Passwords circuit breaker is open")
+        try:
+            response = self.session.get(f"{self.api_url}/range/{prefix}", timeout=self.timeout)
+            if response.status_code != 200:
+                raise BreachCheckUnavailable(f"Unable to retrieve data from the Pwned Passwords API. Status code: {response.status_code}")
+            text = response.text
+            cache_range_response(prefix, text)
+        except Exception as e:
+            # Every failure settles the breaker: a half-open trial that ended without an
+            # outcome would keep refusing calls until the process restarts.
+            self.breaker.record_failure()
+            self._count('errors')
+            raise _unavailable(e, self._request_error)
+        self.breaker.record_success()
+        return text
+
+    def fetch_range(self, prefix):
+        """
+        Fetch a range response, sharing one upstream call between concurrent callers.
+
+        Parameters: prefix (str): 5-char SHA-1 prefix.
+        Returns: str: Body of the range API response.
+        Raises: BreachCheckUnavailable: If the upstream failed or the breaker is open.
+        """
+        with self._lock:
+            call = self._inflight.get(prefix)
+            leader = call is None
+            if leader:
+                call = self._inflight[prefix] = _InflightCall()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.text
+
+        try:
+            call.text = self._request_range(prefix)
+            return call.text
+        except BaseException as e:
+            # Whatever the leader failed with, the followers fail with it rather than read an empty text.
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[prefix]
+            call.done.set()
+
+    def is_breached(self, sha1_password):
+        """
+        Check a SHA-1 hash against the local breach index and, on a miss, the range API.
+
+        Parameters: sha1_password (str): Upper-case hex SHA-1 of the password.
+        Returns: bool: True if the password appears in a breach.
+        Raises: BreachCheckUnavailable: If the API is unavailable and the client fails closed.
+        """
+        breached = lookup_breach_index(sha1_password)
+        if breached is not None:
+            self._count('hits')
+            return breached
+        self._count('misses')
+        prefix, suffix = sha1_password[:5], sha1_password[5:]
+        try:
+            text = self.fetch_range(prefix)
+        except BreachCheckUnavailable as e:
+            if not self.fail_open:
+                raise
+            print(f"Error: {e}")
+            return False
+        return f"{suffix}:" in text
+
+    def check_many(self, sha1_passwords):
+        """
+        Check a batch of SHA-1 hashes, fetching every missing prefix once and in parallel.
+
+        Parameters: sha1_passwords (iterable): Upper-case hex SHA-1 hashes.
+        Returns: dict: Hash to True if breached, False if not, None if the API was unavailable and the client fails closed.
+        """
+        results = {}
+        pending = {}
+        for sha1_password in set(sha1_passwords):
+            breached = lookup_breach_index(sha1_password)
+            if breached is None:
+                pending.setdefault(sha1_password[:5], []).append(sha1_password)
+            else:
+                self._count('hits')
+                results[sha1_password] = breached
+
+        def fetch(prefix):
+            try:
+                return self.fetch_range(prefix)
+            except BreachCheckUnavailable as e:
+                print(f"Error: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            for prefix, text in zip(pending, executor.map(fetch, pending)):
+                for sha1_password in pending[prefix]:
+                    self._count('misses')
+                    if text is None:
+                        results[sha1_password] = False if self.fail_open else None
+                    else:
+                        results[sha1_password] = f"{sha1_password[5:]}:" in text
+        return results
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_hibp_client():
+    """Return the process-wide HIBP client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HIBPClient()
+    return _client
+
+class AsyncHIBPClient(_ClientStats):
+    """
+    asyncio counterpart of HIBPClient for the async views.
+
+    Uses one pooled httpx.AsyncClient with the same timeouts, collapses
+    concurrent lookups of the same prefix into a single upstream request,
+    and has its own circuit breaker and counters. An instance belongs to the
+    event loop it was first used on; see get_async_hibp_client.
+    """
+
+    def __init__(self, api_url=None, connect_timeout=None, read_timeout=None, pool_size=None,
+                 failure_threshold=None, reset_timeout=None, fail_open=None):
+        import httpx
+        super().__init__()
+        self.api_url = (api_url or settings.HIBP_API_URL).rstrip('/')
+        self.fail_open = settings.HIBP_FAIL_OPEN if fail_open is None else fail_open
+        self.breaker = CircuitBreaker(failure_threshold or settings.HIBP_BREAKER_THRESHOLD,
+                                      reset_timeout or settings.HIBP_BREAKER_RESET)
+        connect_timeout = connect_timeout or settings.HIBP_CONNECT_TIMEOUT
+        read_timeout = read_timeout or settings.HIBP_READ_TIMEOUT
+        pool_size = pool_size or settings.HIBP_POOL_SIZE
+        self._request_error = httpx.HTTPError
+        self.session = httpx.AsyncClient(
+            headers={'User-Agent': 'password-manager-drf'},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+        self._inflight = {}
+
+    async def _request_range(self, prefix):
+        if not self.breaker.allow():
+            self._count('breaker_open')
+            raise BreachCheckUnavailable("Pwned Passwords circuit breaker is open")
+        try:
+            response = await self.session.get(f"{self.api_url}/range/{prefix}")
+            if response.status_code != 200:
+                raise BreachCheckUnavailable(f"Unable to retrieve data from the Pwned Passwords API. Status code: {response.status_code}")
+            text = response.text
+            cache_range_response(prefix, text)
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count('errors')
+            raise _unavailable(e, self._request_error)
+        self.breaker.record_success()
+        return text
+
+    async def fetch_range(self, prefix):
+        """
+        Fetch a range response, sharing one upstream call between concurrent callers.
+
+        Parameters: prefix (str): 5-char SHA-1 prefix.
+        Returns: str: Body of the range API response.
+        Raises: BreachCheckUnavailable: If the upstream failed or the breaker is open.
+        """
+        call = self._inflight.get(prefix)
+        if call is None:
+            call = self._inflight[prefix] = asyncio.ensure_future(self._request_range(prefix))
+            call.add_done_callback(lambda _: self._inflight.pop(prefix, None))
+        else:
+            self._count('coalesced')
+        return await asyncio.shield(call)
+
+    async def is_breached(self, sha1_password):
+        """
+        Check a SHA-1 hash against the local breach index and, on a miss, the range API.
+
+        Parameters: sha1_password (str): Upper-case hex SHA-1 of the password.
+        Returns: bool: True if the password appears in a breach.
+        Raises: BreachCheckUnavailable: If the API is unavailable and the client fails closed.
+        """
+        breached = lookup_breach_index(sha1_password)
+        if breached is not None:
+            self._count('hits')
+            return breached
+        self._count('misses')
+        try:
+            text = await self.fetch_range(sha1_password[:5])
+        except BreachCheckUnavailable as e:
+            if not self.fail_open:
+                raise
+            print(f"Error: {e}")
+            return False
+        return f"{sha1_password[5:]}:" in text
+
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_hibp_client():
+    """Return the async HIBP client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncHIBPClient()
+    return client
+
+def hibp_stats():
+    """
+    Return the counters of the process's HIBP clients added up: the sync client and the async
+    client of every event loop still running, so checks made by the async views are included.
+
+    Returns: dict: hits, misses, coalesced, breaker_open and errors.
+    """
+    totals = dict.fromkeys(_ClientStats.STATS, 0)
+    for client in [_client, *list(_async_clients.values())]:
+        if client is not None:
+            for name, value in client.stats().items():
+                totals[name] += value
+    return totals
@@ -0,0 +1,73 @@
+import os
+import base64
+from functools import lru_cache
+from django.core.exceptions import ImproperlyConfigured
+from password_manager import settings
+
+# Vault passwords are encrypted under one of several keys, each with a small integer id.
+# ENCRYPTION_KEY is key 0, the key every row was written with before rotation existed.
+# ENCRYPTION_KEYS adds more keys as comma separated 'id:base64 key' pairs, and
+# ENCRYPTION_KEY_ID picks the key new values are encrypted with. Every key that rows may
+# still be encrypted with must stay in the keyring until a rotation has moved them off it.
+LEGACY_KEY_ID = 0
+CIPHERTEXT_V1_PREFIX = 'v1$'
+CIPHERTEXT_V2_PREFIX = 'v2$'
+
+class UnknownEncryptionKey(LookupError):
+    """Raised when a value is encrypted under a key id that is not in the keyring."""
+
+@lru_cache(maxsize=None)
+def get_keyring():
+    """
+    Decode the keyring from the environment on first use.
+
+    Returns: dict: Key bytes by key id.
+    """
+    keyring = {}
+    if os.environ.get('ENCRYPTION_KEY'):
+        keyring[LEGACY_KEY_ID] = base64.b64decode(os.environ['ENCRYPTION_KEY'])
+    for item in os.environ.get('ENCRYPTION_KEYS', '').split(','):
+        if not item.strip():
+            continue
+        key_id, separator, encoded = item.strip().partition(':')
+        if not separator or not key_id.isdigit():
+            raise ImproperlyConfigured("ENCRYPTION_KEYS must be a comma separated list of 'id:base64 key' pairs")
+        key = base64.b64decode(encoded)
+        if int(key_id) in keyring and keyring[int(key_id)] != key:
+            raise ImproperlyConfigured(f"Encryption key {key_id} is configured twice with different values")
+        keyring[int(key_id)] = key
+    for key_id, key in keyring.items():
+        if len(key) not in (16, 24, 32):
+            raise ImproperlyConfigured(f"Encryption key {key_id} must be 16, 24 or 32 bytes long")
+    if settings.ENCRYPTION_KEY_ID not in keyring:
+        raise ImproperlyConfigured(f"ENCRYPTION_KEY_ID {settings.ENCRYPTION_KEY_ID} is not in the keyring")
+    return keyring
+
+def current_key_id():
+    """Return the id of the key new values are encrypted with."""
+    return settings.ENCRYPTION_KEY_ID
+
+def get_key(key_id):
+    """
+    Return the key with the given id.
+
+    Parameters: key_id (int): Key id.
+    Returns: bytes: The key.
+    Raises: UnknownEncryptionKey: If the key is not in the keyring.
+    """
+    try:
+        return get_keyring()[key_id]
+    except KeyError:
+        raise UnknownEncryptionKey(f"Encryption key {key_id} is not in the keyring") from None
+
+def ciphertext_key_id(value):
+    """
+    Return the id of the key a stored value is encrypted with.
+    Legacy and v1 values predate the keyring and are always under key 0.
+
+    Parameters: value (str): Encrypted password as stored in PasswordVault.
+    Returns: int: Key id.
+    """
+    if value.startswith(CIPHERTEXT_V2_PREFIX):
+        return int(value[len(CIPHERTEXT_V2_PREFIX):value.index('$', len(CIPHERTEXT_V2_PREFIX))])
+    return LEGACY_KEY_ID
@@ -1,14 +1,94 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
 from rest_framework import status
+from rest_framework.views import exception_handler
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from password_manager import settings
+from password_manager.db_router import track_request_writes, stick_to_primary
+
+EXPIRED_BODY = {"message": "Session expired or Token invalid. Please log in again."}
+
+def token_exception_handler(exc, context):
+    """
+    REST framework exception handler: an expired or invalid token gets the session-expired
+    body of TokenExpirationMiddleware, everything else the default handling.
+
+    Parameters:
+    - exc (Exception): Exception raised by the view or its authentication.
+    - context (dict): The view and request.
+    Returns: Response: The error response, or None for an exception that is not handled.
+    """
+    response = exception_handler(exc, context)
+    if isinstance(exc, InvalidToken):
+        response.data = dict(EXPIRED_BODY)
+    return response
 
 class TokenExpirationMiddleware:
+    """
+    Answer a token error that escapes a view with HTTP 401 and the session-expired body.
+
+    REST framework views get that answer from token_exception_handler and the async
+    views from AsyncAPIView, so this only acts on exceptions; responses pass through
+    untouched.
+    """
+    # Supports both modes so the async views are not run through a thread by a sync-only middleware.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, (TokenError, InvalidToken)):
+            return self.expired_response()
+        return None
+
+    @staticmethod
+    def expired_response():
+        return JsonResponse(EXPIRED_BODY, status=status.HTTP_401_UNAUTHORIZED)
+
+class DatabaseRoutingMiddleware:
+    """
+    Pin a user's replica reads to the primary for REPLICA_STICKY_SECONDS after any request of
+    theirs that wrote to the database, so a client always reads its own writes even while the
+    replicas lag, and scope the vault owner that routes vault queries to their shard to the
+    request (see password_manager.db_router).
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        try:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with track_request_writes() as writes:
             response = self.get_response(request)
-            if ('<Response status_code=401, "application/json">' in str(response)) and ("code='token_not_valid'" in str(response.data)):raise
-            return response
-        except Exception as e:
-            return JsonResponse({"message": "Session expired or Token invalid. Please log in again."}, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.process_writes(request, writes)
+        return response
+
+    async def __acall__(self, request):
+        with track_request_writes() as writes:
+            response = await self.get_response(request)
+        self.process_writes(request, writes)
+        return response
+
+    @staticmethod
+    def process_writes(request, writes):
+        # REST framework and AsyncAPIView set the authenticated user on the Django request.
+        user = getattr(request, 'user', None)
+        if writes['wrote'] and settings.DATABASE_REPLICA_ALIASES and user is not None and user.is_authenticated:
+            stick_to_primary(user.id)
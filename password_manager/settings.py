@@ -10,8 +10,6 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials
 import os
 from datetime import timedelta
 from pathlib import Path
@@ -45,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
 
     'rest_framework',
     "django_extensions",
@@ -62,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'password_manager.middleware.TokenExpirationMiddleware',
+    'password_manager.middleware.DatabaseRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'password_manager.urls'
@@ -83,17 +83,81 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'password_manager.wsgi.application'
+ASGI_APPLICATION = 'password_manager.asgi.application'
+
+# Serve register, add, update and all from async views; enable when running under an ASGI server (uvicorn, daphne).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE is 'sqlite3' (default) or 'postgresql'. Read replicas are listed in DATABASE_REPLICAS,
+# comma separated: file paths of copies of the database with SQLite, 'host[:port]' of streaming replicas
+# with PostgreSQL. Vault listing, search, sync and the weekly reports read from them (password_manager.db_router).
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+DATABASE_REPLICAS = [replica.strip() for replica in os.environ.get('DATABASE_REPLICAS', '').split(',') if replica.strip()]
+# Seconds a connection is kept open and reused by later requests (0 closes it after every request), and
+# whether a reused connection is checked before the request uses it, so a dropped connection is reopened.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DB_CONN_HEALTH_CHECKS = os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+# After a user writes, their reads stay on the primary for this many seconds, longer than the replica lag.
+# The marker is kept in the 'replica_sticky' cache, apart from the vault page cache so page traffic cannot evict
+# it. Local memory only pins the reads of the process that served the write: with several processes use
+# django.core.cache.backends.redis.RedisCache with a redis:// REPLICA_STICKY_CACHE_LOCATION shared by all of them.
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+REPLICA_STICKY_CACHE_BACKEND = os.environ.get('REPLICA_STICKY_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+REPLICA_STICKY_CACHE_LOCATION = os.environ.get('REPLICA_STICKY_CACHE_LOCATION', 'replica-sticky')
+# Extra databases the vault is sharded over, comma separated: SQLite file paths, or 'host[:port][/name]' of
+# PostgreSQL databases. Each user's vault lives on one shard, the primary ('default') or 'shard1', 'shard2', ...,
+# picked by a stable hash of the user id and recorded in the VaultShard directory (password_manager.db_router).
+DATABASE_SHARDS = [shard.strip() for shard in os.environ.get('DATABASE_SHARDS', '').split(',') if shard.strip()]
+# Seconds a user's shard is kept in the vault cache; a vault move waits this long for every process to see it.
+SHARD_DIRECTORY_CACHE_TIMEOUT = int(os.environ.get('SHARD_DIRECTORY_CACHE_TIMEOUT', 30))
+# Vault entry ids reserved at a time from the primary when sharded, so ids stay unique across shards.
+SHARD_ID_BLOCK_SIZE = int(os.environ.get('SHARD_ID_BLOCK_SIZE', 1000))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'password_manager'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Seconds a writer waits for the database lock before failing with "database is locked".
+            'OPTIONS': {'timeout': int(os.environ.get('SQLITE_TIMEOUT', 20))},
+        }
+    }
+DATABASES['default'].update(CONN_MAX_AGE=DB_CONN_MAX_AGE, CONN_HEALTH_CHECKS=DB_CONN_HEALTH_CHECKS)
+for number, replica in enumerate(DATABASE_REPLICAS, 1):
+    if DATABASE_ENGINE == 'postgresql':
+        host, _, port = replica.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    else:
+        location = {'NAME': replica}
+    # Tests run against the primary's test database only.
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], **location, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICA_ALIASES = [alias for alias in DATABASES if alias != 'default']
+for number, shard in enumerate(DATABASE_SHARDS, 1):
+    if DATABASE_ENGINE == 'postgresql':
+        address, _, name = shard.partition('/')
+        host, _, port = address.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT'], 'NAME': name or DATABASES['default']['NAME']}
+    else:
+        location = {'NAME': shard}
+    # Unlike replicas, shards hold their own rows and get their own test databases.
+    DATABASES[f'shard{number}'] = {**DATABASES['default'], **location}
+DATABASE_SHARD_ALIASES = ['default', *(alias for alias in DATABASES if alias.startswith('shard'))]
+DATABASE_ROUTERS = ['password_manager.db_router.ReplicaRouter']
 
 
 # Password validation
@@ -114,6 +178,20 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Django's PBKDF2 hasher with a bound on the hashes computed at once (user_app.hashers); the others verify older hashes.
+PASSWORD_HASHERS = [
+    'user_app.hashers.BoundedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Password hashes computed at once per process, half the CPUs by default, and seconds a login or registration
+# waits for a free slot before it is answered with HTTP 429. With several worker processes on a host, divide
+# the share of CPU hashing may take by the number of processes.
+PASSWORD_HASHING_CONCURRENCY = int(os.environ.get('PASSWORD_HASHING_CONCURRENCY', max(1, (os.cpu_count() or 1) // 2)))
+PASSWORD_HASHING_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASHING_QUEUE_TIMEOUT', 0.5))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -138,16 +216,145 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework_simplejwt.authentication.JWTAuthentication'],
+    'DEFAULT_AUTHENTICATION_CLASSES': ['user_app.authentication.CachedJWTAuthentication'],
     "DEFAULT_PERMISSION_CLASSES":['rest_framework.permissions.IsAuthenticated'],
+    # Proxies in front of the app; throttles identify clients by the address they add to X-Forwarded-For,
+    # or by the connection's address with 0, so clients cannot pick their own address.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+    # Expired or invalid tokens are answered with the session-expired body of TokenExpirationMiddleware.
+    'EXCEPTION_HANDLER': 'password_manager.middleware.token_exception_handler',
+}
+# Keyset pagination and streaming of /api/password/all
+VAULT_PAGE_SIZE = int(os.environ.get('VAULT_PAGE_SIZE', 100))
+VAULT_MAX_PAGE_SIZE = int(os.environ.get('VAULT_MAX_PAGE_SIZE', 1000))
+VAULT_STREAM_CHUNK_SIZE = int(os.environ.get('VAULT_STREAM_CHUNK_SIZE', 500))
+# Delta sync: above this many changes the client is told to reload the vault through /api/password/all
+VAULT_SYNC_MAX_CHANGES = int(os.environ.get('VAULT_SYNC_MAX_CHANGES', 1000))
+# Minimum share of the query's trigrams an entry must contain to match a fuzzy search
+SEARCH_FUZZY_THRESHOLD = float(os.environ.get('SEARCH_FUZZY_THRESHOLD', 0.5))
+
+# Most update/delete operations accepted by one /api/password/batch request
+VAULT_BATCH_MAX_OPERATIONS = int(os.environ.get('VAULT_BATCH_MAX_OPERATIONS', 500))
+
+# Bulk import of browser/password manager exports
+IMPORT_SYNC_MAX_ROWS = int(os.environ.get('IMPORT_SYNC_MAX_ROWS', 200))
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+
+# Read cache of /api/password/all pages, keyed by user and vault version. Only ciphertext is stored.
+# Use django.core.cache.backends.redis.RedisCache with a redis:// VAULT_CACHE_LOCATION in production;
+# size the Redis instance with maxmemory and an allkeys-lru policy.
+VAULT_CACHE_ENABLED = os.environ.get('VAULT_CACHE_ENABLED', 'True') == 'True'
+VAULT_CACHE_BACKEND = os.environ.get('VAULT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+VAULT_CACHE_LOCATION = os.environ.get('VAULT_CACHE_LOCATION', 'vault-pages')
+VAULT_CACHE_TIMEOUT = int(os.environ.get('VAULT_CACHE_TIMEOUT', 600))
+VAULT_CACHE_MAX_ENTRIES = int(os.environ.get('VAULT_CACHE_MAX_ENTRIES', 5000))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'vault': {
+        'BACKEND': VAULT_CACHE_BACKEND,
+        'LOCATION': VAULT_CACHE_LOCATION,
+        'TIMEOUT': VAULT_CACHE_TIMEOUT,
+        'KEY_PREFIX': 'vault',
+        # Only the local-memory backend bounds its own size; Redis relies on its eviction policy.
+        'OPTIONS': {'MAX_ENTRIES': VAULT_CACHE_MAX_ENTRIES} if VAULT_CACHE_BACKEND.endswith('LocMemCache') else {},
+    },
+}
+CACHES['replica_sticky'] = {
+    'BACKEND': REPLICA_STICKY_CACHE_BACKEND,
+    'LOCATION': REPLICA_STICKY_CACHE_LOCATION,
+    'KEY_PREFIX': 'replica-sticky',
 }
+
+# LOGIN THROTTLING SETTINGS
+# Token buckets of login and registration attempts, as '<tokens>/<s|m|h|d>': the bucket holds that many attempts
+# and refills completely over the period. An empty rate disables that bucket. Buckets live in the 'throttle' cache;
+# use django.core.cache.backends.redis.RedisCache with a redis:// THROTTLE_CACHE_LOCATION so all processes share them.
+LOGIN_THROTTLE_ENABLED = os.environ.get('LOGIN_THROTTLE_ENABLED', 'True') == 'True'
+LOGIN_THROTTLE_IP_RATE = os.environ.get('LOGIN_THROTTLE_IP_RATE', '30/m')
+LOGIN_THROTTLE_USERNAME_RATE = os.environ.get('LOGIN_THROTTLE_USERNAME_RATE', '10/m')
+REGISTER_THROTTLE_IP_RATE = os.environ.get('REGISTER_THROTTLE_IP_RATE', '10/m')
+THROTTLE_CACHE_BACKEND = os.environ.get('THROTTLE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+THROTTLE_CACHE_LOCATION = os.environ.get('THROTTLE_CACHE_LOCATION', 'throttle')
+# An evicted bucket is a full one, so the local-memory cache keeps enough buckets for a flood from many addresses.
+THROTTLE_CACHE_MAX_ENTRIES = int(os.environ.get('THROTTLE_CACHE_MAX_ENTRIES', 100000))
+CACHES['throttle'] = {
+    'BACKEND': THROTTLE_CACHE_BACKEND,
+    'LOCATION': THROTTLE_CACHE_LOCATION,
+    'KEY_PREFIX': 'throttle',
+    'OPTIONS': {'MAX_ENTRIES': THROTTLE_CACHE_MAX_ENTRIES} if THROTTLE_CACHE_BACKEND.endswith('LocMemCache') else {},
+}
+
+# Per-process cache of the users behind JWT access tokens
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+
+# Clients renew the 15-minute access token with the refresh token instead of logging in again. Every refresh
+# returns a new refresh token and blacklists the one presented; expired tokens are flushed from the blacklist daily.
+REFRESH_TOKEN_LIFETIME_DAYS = int(os.environ.get('REFRESH_TOKEN_LIFETIME_DAYS', 7))
+
 SIMPLE_JWT ={
-    "ACCESS_TOKEN_LIFETIME":timedelta(minutes=15)
+    "ACCESS_TOKEN_LIFETIME":timedelta(minutes=15),
+    "REFRESH_TOKEN_LIFETIME":timedelta(days=REFRESH_TOKEN_LIFETIME_DAYS),
+    "ROTATE_REFRESH_TOKENS":True,
+    "BLACKLIST_AFTER_ROTATION":True,
 }
 
 #CELERY_SETTINGS
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND')
+# Messages a worker process reserves ahead. Keep 1 for the reports and maintenance workers, whose tasks run
+# for minutes; a notifications worker can raise it with --prefetch-multiplier.
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
+# Per-worker rate limit of each mail task; divide what the SMTP relay accepts by the number of notification workers.
+MAIL_TASK_RATE_LIMIT = os.environ.get('MAIL_TASK_RATE_LIMIT', '300/m')
+# Transient SMTP and storage failures are retried up to TASK_MAX_RETRIES times, waiting at most TASK_RETRY_BACKOFF_MAX seconds.
+TASK_MAX_RETRIES = int(os.environ.get('TASK_MAX_RETRIES', 5))
+TASK_RETRY_BACKOFF_MAX = int(os.environ.get('TASK_RETRY_BACKOFF_MAX', 600))
+
+# BREACH INDEX SETTINGS
+BREACH_INDEX_PATH = os.environ.get('BREACH_INDEX_PATH', str(BASE_DIR / 'breach_index.bin'))
+BREACH_RANGE_CACHE_DIR = os.environ.get('BREACH_RANGE_CACHE_DIR', str(BASE_DIR / 'breach_ranges'))
+BREACH_RANGE_TTL = int(os.environ.get('BREACH_RANGE_TTL', 7 * 24 * 60 * 60))
+
+# PASSWORD STRENGTH SETTINGS
+# Ranked common-password dictionary built by build_password_dictionary; the bundled list is used without it.
+PASSWORD_DICTIONARY_PATH = os.environ.get('PASSWORD_DICTIONARY_PATH', str(BASE_DIR / 'password_dictionary.bin'))
+# Passwords scoring below this (0-4) are rejected as weak even when they meet the character-class policy.
+PASSWORD_MIN_SCORE = int(os.environ.get('PASSWORD_MIN_SCORE', 2))
+PASSWORD_GENERATOR_LENGTH = int(os.environ.get('PASSWORD_GENERATOR_LENGTH', 16))
+PASSWORD_GENERATOR_MAX_LENGTH = int(os.environ.get('PASSWORD_GENERATOR_MAX_LENGTH', 128))
+PASSWORD_GENERATOR_MAX_BATCH = int(os.environ.get('PASSWORD_GENERATOR_MAX_BATCH', 100))
+
+# ENCRYPTION KEY SETTINGS
+# ENCRYPTION_KEY is key 0; ENCRYPTION_KEYS adds more keys as 'id:base64 key' pairs. New values use ENCRYPTION_KEY_ID.
+ENCRYPTION_KEY_ID = int(os.environ.get('ENCRYPTION_KEY_ID', 0))
+# Key rotation re-encrypts the vault in chunks of this many ids, on KEY_ROTATION_WORKERS parallel Celery tasks.
+KEY_ROTATION_CHUNK_SIZE = int(os.environ.get('KEY_ROTATION_CHUNK_SIZE', 2000))
+KEY_ROTATION_WORKERS = int(os.environ.get('KEY_ROTATION_WORKERS', 4))
+# Upper bound on rows re-encrypted per second across all workers, 0 for no limit.
+KEY_ROTATION_MAX_ROWS_PER_SECOND = int(os.environ.get('KEY_ROTATION_MAX_ROWS_PER_SECOND', 20000))
+# A chunk claimed longer ago than this is considered abandoned by a crashed worker and handed out again.
+KEY_ROTATION_LEASE = int(os.environ.get('KEY_ROTATION_LEASE', 300))
+
+# PWNED PASSWORDS API SETTINGS
+HIBP_API_URL = os.environ.get('HIBP_API_URL', 'https://api.pwnedpasswords.com')
+HIBP_CONNECT_TIMEOUT = float(os.environ.get('HIBP_CONNECT_TIMEOUT', 1.0))
+HIBP_READ_TIMEOUT = float(os.environ.get('HIBP_READ_TIMEOUT', 2.0))
+HIBP_POOL_SIZE = int(os.environ.get('HIBP_POOL_SIZE', 10))
+HIBP_BREAKER_THRESHOLD = int(os.environ.get('HIBP_BREAKER_THRESHOLD', 5))
+HIBP_BREAKER_RESET = float(os.environ.get('HIBP_BREAKER_RESET', 30))
+HIBP_FAIL_OPEN = os.environ.get('HIBP_FAIL_OPEN', 'True').lower() == 'true'
+
+# REPORT EXPORT SETTINGS
+REPORT_STORAGE_BACKEND = os.environ.get('REPORT_STORAGE_BACKEND', 'firebase')
+REPORT_STORAGE_ROOT = os.environ.get('REPORT_STORAGE_ROOT', str(BASE_DIR / 'exports'))
+REPORT_UPLOAD_CHUNK_SIZE = int(os.environ.get('REPORT_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+REPORT_CHUNK_SIZE = int(os.environ.get('REPORT_CHUNK_SIZE', 2000))
+# Change exports stop this many seconds before now so rows of in-flight transactions land in the next window.
+CHANGE_EXPORT_LAG = int(os.environ.get('CHANGE_EXPORT_LAG', 60))
 
 # SMTP SETTINGS
 EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND')
@@ -158,6 +365,32 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
 
-# Configure Firebase Credentials
-cred = credentials.Certificate(os.environ.get('CRED_PATH'))
-firebase_admin.initialize_app(cred)
\ No newline at end of file
+# NOTIFICATION DIGEST SETTINGS
+# Add/update events are mailed as one digest per user once the oldest queued event is this many seconds old.
+NOTIFICATION_WINDOW = int(os.environ.get('NOTIFICATION_WINDOW', 300))
+NOTIFICATION_FLUSH_BATCH = int(os.environ.get('NOTIFICATION_FLUSH_BATCH', 500))
+# Digests sent per minute to one recipient domain, across every notification worker. The per-domain counters live
+# in the 'notification_rate' cache; use django.core.cache.backends.redis.RedisCache with a redis://
+# NOTIFICATION_RATE_CACHE_LOCATION so all workers share them, as local memory only counts one process's sends.
+NOTIFICATION_DOMAIN_RATE_LIMIT = int(os.environ.get('NOTIFICATION_DOMAIN_RATE_LIMIT', 100))
+NOTIFICATION_RATE_CACHE_BACKEND = os.environ.get('NOTIFICATION_RATE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+NOTIFICATION_RATE_CACHE_LOCATION = os.environ.get('NOTIFICATION_RATE_CACHE_LOCATION', 'notification-rate')
+CACHES['notification_rate'] = {
+    'BACKEND': NOTIFICATION_RATE_CACHE_BACKEND,
+    'LOCATION': NOTIFICATION_RATE_CACHE_LOCATION,
+    'KEY_PREFIX': 'notification-rate',
+}
+
+# TASK OUTBOX SETTINGS
+# Tasks written to the outbox are published to the broker in batches of OUTBOX_BATCH_SIZE by the relay.
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+# Seconds between two polls of the relay_outbox command, and between two relay runs scheduled by Celery beat.
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 0.5))
+OUTBOX_RELAY_INTERVAL = float(os.environ.get('OUTBOX_RELAY_INTERVAL', 10))
+# Messages claimed by a relay that died before publishing them are handed out again after this many seconds.
+OUTBOX_LEASE = int(os.environ.get('OUTBOX_LEASE', 60))
+# Published messages are kept this many seconds so a message published twice still runs only once.
+OUTBOX_RETENTION = int(os.environ.get('OUTBOX_RETENTION', 7 * 24 * 3600))
+
+# Firebase credentials, loaded by password_manager.storage the first time Firebase Storage is used
+FIREBASE_CRED_PATH = os.environ.get('CRED_PATH')
\ No newline at end of file
@@ -0,0 +1,143 @@
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.db import connections, transaction, models, IntegrityError
+from password_manager import settings
+from password_manager.db_router import PRIMARY
+
+# Ids handed out when sharded start above anything the primary's own sequence produced before.
+FIRST_SHARDED_ID = 2 ** 40
+# Chunks of rows a shard reader thread keeps ready ahead of the merge.
+READ_AHEAD_CHUNKS = 2
+
+_id_lock = threading.Lock()
+_id_block = [0, 0]
+# Blocks are reserved from a thread of their own, so the reservation commits on its own
+# connection even when the caller is inside a transaction on the primary that later rolls back.
+_id_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vault-ids')
+
+def _reserve_id_block(size):
+    sequence = apps.get_model('password_app', 'VaultIdSequence').objects.using(PRIMARY)
+    name = 'password_vault'
+    with transaction.atomic(using=PRIMARY):
+        # Write first, so SQLite takes its write lock before the read.
+        if not sequence.filter(name=name).update(next_id=models.F('next_id') + size):
+            try:
+                with transaction.atomic(using=PRIMARY):
+                    sequence.create(name=name, next_id=FIRST_SHARDED_ID + size)
+                return FIRST_SHARDED_ID
+            except IntegrityError:
+                sequence.filter(name=name).update(next_id=models.F('next_id') + size)
+        return sequence.filter(name=name).values_list('next_id', flat=True).get() - size
+
+def allocate_vault_ids(count):
+    """
+    Return ids for new vault entries that are unique across every shard.
+
+    Ids come out of blocks of SHARD_ID_BLOCK_SIZE reserved in the VaultIdSequence row of the
+    primary, so an entry keeps its id when rebalance_vault moves it to another shard. Ids are
+    increasing within a process but not across processes.
+
+    Parameters: count (int): Number of ids needed.
+    Returns: list: The ids.
+    """
+    ids = []
+    with _id_lock:
+        while len(ids) < count:
+            if _id_block[0] >= _id_block[1]:
+                size = max(settings.SHARD_ID_BLOCK_SIZE, count - len(ids))
+                start = _id_pool.submit(_reserve_id_block, size).result()
+                _id_block[:] = [start, start + size]
+            take = min(count - len(ids), _id_block[1] - _id_block[0])
+            ids.extend(range(_id_block[0], _id_block[0] + take))
+            _id_block[0] += take
+    return ids
+
+def for_each_shard(function, aliases=None):
+    """
+    Call function(alias) for every shard, in parallel threads when there is more than one.
+    The threads use connections of their own and do not see uncommitted changes of the caller.
+
+    Parameters:
+    - function (callable): Function of a database alias.
+    - aliases (list): Shards to run on, DATABASE_SHARD_ALIASES by default.
+    Returns: dict: Result of each alias.
+    """
+    aliases = list(aliases or settings.DATABASE_SHARD_ALIASES)
+    if len(aliases) == 1:
+        return {aliases[0]: function(aliases[0])}
+
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases), thread_name_prefix='shard') as pool:
+        return dict(zip(aliases, pool.map(run, aliases)))
+
+class _ReaderError:
+    def __init__(self, error):
+        self.error = error
+
+def _put(chunks, item, stop):
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _read_ahead(rows, alias, chunk_size, stop):
+    chunks = queue.Queue(maxsize=READ_AHEAD_CHUNKS)
+
+    def produce():
+        try:
+            chunk = []
+            for row in rows(alias):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    if not _put(chunks, chunk, stop):
+                        return
+                    chunk = []
+            if _put(chunks, chunk, stop):
+                _put(chunks, None, stop)
+        except Exception as error:
+            _put(chunks, _ReaderError(error), stop)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=produce, name=f"shard-reader-{alias}", daemon=True).start()
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, _ReaderError):
+            raise chunk.error
+        yield from chunk
+
+def merge_shards(rows, key, aliases=None, chunk_size=None):
+    """
+    Yield the rows of every shard merged in key order. Each shard is read by a thread of its
+    own that keeps a few chunks ready, so the shards are queried in parallel while the merged
+    stream is consumed, with at most READ_AHEAD_CHUNKS chunks per shard held in memory.
+
+    Parameters:
+    - rows (callable): Function of a database alias returning that shard's rows ordered by key.
+    - key (callable): Sort key of a row.
+    - aliases (list): Shards to read, DATABASE_SHARD_ALIASES by default.
+    - chunk_size (int): Rows handed over at a time, REPORT_CHUNK_SIZE by default.
+    Yields: The rows of all shards.
+    """
+    aliases = list(aliases or settings.DATABASE_SHARD_ALIASES)
+    if len(aliases) == 1:
+        yield from rows(aliases[0])
+        return
+    stop = threading.Event()
+    try:
+        yield from heapq.merge(*(_read_ahead(rows, alias, chunk_size or settings.REPORT_CHUNK_SIZE, stop) for alias in aliases), key=key)
+    finally:
+        stop.set()
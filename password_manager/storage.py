@@ -0,0 +1,165 @@
+import os
+import gzip
+import json
+import tempfile
+import threading
+from password_manager import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+class StorageUnavailable(Exception):
+    """Raised when an export fails because the storage backend could not be reached; the export can be retried."""
+
+def is_transient_storage_error(exc):
+    """
+    Tell whether an export error is worth retrying: a connection failure or timeout, or a
+    429 or 5xx answer of the storage API. The Google client libraries are only imported
+    when the error comes from them.
+
+    Parameters: exc (Exception): The error.
+    Returns: bool: True if retrying the export may succeed.
+    """
+    if isinstance(exc, OSError):
+        return True
+    if type(exc).__module__.startswith('google.'):
+        from google.api_core import exceptions as api_exceptions
+        from google.auth import exceptions as auth_exceptions
+        from google.resumable_media import common
+        if isinstance(exc, (api_exceptions.TooManyRequests, api_exceptions.ServerError, auth_exceptions.TransportError)):
+            return True
+        if isinstance(exc, common.InvalidResponse):
+            return getattr(exc.response, 'status_code', None) in common.RETRYABLE
+    return False
+
+class LocalFileWriter:
+    """
+    Writable file that lands at its destination only when closed, so readers never see a partial export.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, self._temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        self._file = os.fdopen(handle, 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.unlink(self._temp_path)
+
+class LocalStorageBackend:
+    """
+    Storage backend writing exports below a directory of the local filesystem.
+    Used in development and tests in place of Firebase Storage.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.REPORT_STORAGE_ROOT
+
+    def open_writer(self, destination, content_type):
+        """
+        Open a writable stream for an export.
+
+        Parameters:
+        - destination (str): Path of the export relative to the storage root.
+        - content_type (str): MIME type of the export (unused on the local filesystem).
+        Returns: LocalFileWriter: File-like object published when closed.
+        """
+        return LocalFileWriter(os.path.join(self.root, destination))
+
+_firebase_lock = threading.Lock()
+
+def get_firebase_bucket(bucket_name):
+    """
+    Return a Firebase Storage bucket, initializing the Firebase app on first use.
+
+    firebase_admin and the Google client libraries are imported here rather than
+    at module load, so processes that never upload do not pay for them.
+
+    Parameters: bucket_name (str): Name of the bucket.
+    Returns: Bucket: The Google Cloud Storage bucket.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, storage
+    with _firebase_lock:
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(credentials.Certificate(settings.FIREBASE_CRED_PATH))
+    return storage.bucket(bucket_name)
+
+class FirebaseStorageBackend:
+    """
+    Storage backend uploading exports to a Firebase Storage bucket.
+    Data is sent through a resumable upload in fixed-size chunks, so at most one
+    chunk is buffered in memory whatever the size of the export.
+    """
+
+    def __init__(self, bucket_name=None, chunk_size=None):
+        self.bucket_name = bucket_name or os.environ.get('BUCKET_NAME')
+        self.chunk_size = chunk_size or settings.REPORT_UPLOAD_CHUNK_SIZE
+
+    def open_writer(self, destination, content_type):
+        """
+        Open a resumable upload for an export.
+
+        Parameters:
+        - destination (str): Blob name of the export.
+        - content_type (str): MIME type stored on the blob.
+        Returns: BlobWriter: File-like object uploading a chunk whenever its buffer is full.
+        """
+        blob = get_firebase_bucket(self.bucket_name).blob(destination)
+        return blob.open('wb', chunk_size=self.chunk_size, content_type=content_type, ignore_flush=True)
+
+STORAGE_BACKENDS = {
+    'local': LocalStorageBackend,
+    'firebase': FirebaseStorageBackend,
+}
+
+def get_storage_backend():
+    """Return the storage backend selected by REPORT_STORAGE_BACKEND."""
+    return STORAGE_BACKENDS[settings.REPORT_STORAGE_BACKEND]()
+
+def export_ndjson_gzip(rows, destination, backend=None):
+    """
+    Stream rows to storage as gzip-compressed NDJSON.
+
+    Rows are encoded, compressed and uploaded as they are produced, so memory
+    use does not depend on the number of rows.
+
+    Parameters:
+    - rows (iterable): Dictionaries to export, one JSON object per line.
+    - destination (str): Path or blob name of the export.
+    - backend: Storage backend to write to, defaults to get_storage_backend().
+    Returns: int: Number of rows exported.
+    Raises: StorageUnavailable: If the export failed on a transient storage error.
+    """
+    backend = backend or get_storage_backend()
+    try:
+        writer = backend.open_writer(destination, 'application/gzip')
+        count = 0
+        try:
+            with gzip.GzipFile(fileobj=writer, mode='wb') as compressed:
+                for row in rows:
+                    compressed.write(json.dumps(row, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+                    count += 1
+        except BaseException:
+            if hasattr(writer, 'abort'):
+                writer.abort()
+            raise
+        writer.close()
+    except Exception as exc:
+        if is_transient_storage_error(exc):
+            raise StorageUnavailable(f"Could not write {destination}: {exc}") from exc
+        raise
+    return count
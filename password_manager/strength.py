@@ -0,0 +1,551 @@
+import os
+import re
+import math
+import mmap
+import struct
+import tempfile
+import threading
+from datetime import date
+from functools import lru_cache
+from password_manager import settings
+
+# Character classes are bit flags, so a password's classes are collected in a single pass.
+LOWERCASE, UPPERCASE, DIGIT, SYMBOL = 1, 2, 4, 8
+ALL_CLASSES = LOWERCASE | UPPERCASE | DIGIT | SYMBOL
+CLASS_NAMES = {LOWERCASE: 'lowercase', UPPERCASE: 'uppercase', DIGIT: 'digit', SYMBOL: 'symbol'}
+MIN_LENGTH = 8
+
+def _ascii_class(character):
+    if 'a' <= character <= 'z':
+        return LOWERCASE
+    if 'A' <= character <= 'Z':
+        return UPPERCASE
+    if '0' <= character <= '9':
+        return DIGIT
+    return SYMBOL
+
+# str.translate table turning every ASCII character into the code point of its class flag.
+_CLASS_TABLE = {code: _ascii_class(chr(code)) for code in range(128)}
+
+def _unicode_class(character):
+    if character.isupper():
+        return UPPERCASE
+    if character.islower():
+        return LOWERCASE
+    if character.isdigit():
+        return DIGIT
+    return SYMBOL
+
+def character_classes(password):
+    """
+    Return the character classes used by a password as a bit mask.
+
+    The password is mapped to class flags by one str.translate pass; only
+    non-ASCII characters are classified in Python.
+
+    Parameters: password (str): Password to classify.
+    Returns: int: OR of LOWERCASE, UPPERCASE, DIGIT and SYMBOL.
+    """
+    mask = 0
+    for marker in set(password.translate(_CLASS_TABLE)):
+        code = ord(marker)
+        mask |= code if code <= SYMBOL else _unicode_class(marker)
+    return mask
+
+def meets_policy(password, classes=None):
+    """
+    Check the length and character-class policy: at least MIN_LENGTH characters
+    with lowercase and uppercase letters, a digit and a symbol.
+
+    Parameters:
+    - password (str): Password to check.
+    - classes (int): Result of character_classes(password), if already computed.
+    Returns: bool: True if the password meets the policy.
+    """
+    if classes is None:
+        classes = character_classes(password)
+    return len(password) >= MIN_LENGTH and classes == ALL_CLASSES
+
+# On-disk layout of the password dictionary (all integers little-endian):
+#   header: magic, version, word_count, max_length (characters), table_offset
+#   words : UTF-8 words, concatenated in sorted order
+#   table : word_count entries of (offset, length, rank), in the same order
+# The rank is the word's position in its frequency-ordered source list (1 = most common).
+DICTIONARY_MAGIC = b'PMPD'
+DICTIONARY_VERSION = 1
+DICTIONARY_HEADER = struct.Struct('<4sHIHQ')
+WORD_ENTRY = struct.Struct('<III')
+MIN_WORD_LENGTH = 3
+MAX_WORD_LENGTH = 32
+BUNDLED_WORD_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common_passwords.txt')
+
+class PasswordDictionary:
+    """
+    Read-only ranked word list over a memory-mapped dictionary file (or an in-memory copy of one).
+
+    Words are looked up by binary search over the sorted table. matches_at
+    walks the prefixes of a string and stops as soon as no word starts with
+    the current prefix, so scanning a password touches only a few pages.
+    """
+
+    def __init__(self, buffer, path=None, mtime=None):
+        self._buffer = buffer
+        self.path = path
+        self.mtime = mtime
+        self._prefix_ranges = {}
+        magic, version, self.word_count, self.max_length, self._table_offset = DICTIONARY_HEADER.unpack_from(buffer, 0)
+        if magic != DICTIONARY_MAGIC or version != DICTIONARY_VERSION:
+            self.close()
+            raise ValueError(f"{path or 'buffer'} is not a password dictionary (version {DICTIONARY_VERSION})")
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as dictionary_file:
+            mtime = os.fstat(dictionary_file.fileno()).st_mtime
+            buffer = mmap.mmap(dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path, mtime)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def _word(self, position):
+        offset, length, rank = WORD_ENTRY.unpack_from(self._buffer, self._table_offset + position * WORD_ENTRY.size)
+        return self._buffer[offset:offset + length], rank
+
+    def _lower_bound(self, key, low, high):
+        while low < high:
+            middle = (low + high) // 2
+            if self._word(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _prefix_range(self, key, low, high):
+        # Positions of the words starting with key; 0xFF never occurs in UTF-8, so key + 0xFF sorts after all of them.
+        low = self._lower_bound(key, low, high)
+        return low, self._lower_bound(key + b'\xff', low, high)
+
+    def rank(self, word):
+        """Return the rank of a word, or None if it is not in the dictionary."""
+        key = word.encode('utf-8')
+        position = self._lower_bound(key, 0, self.word_count)
+        if position < self.word_count:
+            found, rank = self._word(position)
+            if found == key:
+                return rank
+        return None
+
+    def matches_at(self, text, start):
+        """
+        Yield (end, rank) for every dictionary word spelled by text[start:end].
+
+        The range of words sharing the current prefix shrinks with every character,
+        and ranges of one- and two-character prefixes are cached, so most start
+        positions are rejected without a binary search.
+
+        Parameters:
+        - text (str): Lower-case text to scan.
+        - start (int): Index the words must start at.
+        """
+        low, high = 0, self.word_count
+        for end in range(start + 1, min(len(text), start + self.max_length) + 1):
+            key = text[start:end].encode('utf-8')
+            if end - start <= 2:
+                prefix_range = self._prefix_ranges.get(key)
+                if prefix_range is None:
+                    prefix_range = self._prefix_ranges[key] = self._prefix_range(key, low, high)
+                low, high = prefix_range
+            else:
+                low, high = self._prefix_range(key, low, high)
+            if low == high:
+                return
+            if end - start >= MIN_WORD_LENGTH:
+                word, rank = self._word(low)
+                if word == key:
+                    yield end, rank
+
+def read_word_list(path, limit=None):
+    """
+    Yield the usable words of a frequency-ordered word list, most common first.
+
+    Parameters:
+    - path (str): Text file with one word or password per line.
+    - limit (int): Stop after this many words, None for all of them.
+    """
+    count = 0
+    with open(path, encoding='utf-8', errors='ignore') as word_list:
+        for line in word_list:
+            word = line.strip().lower()
+            if MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH:
+                yield word
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+def rank_words(sources, limit=None):
+    """
+    Rank the words of one or more frequency-ordered lists; a word keeps its best rank.
+
+    Parameters:
+    - sources (iterable): Word list paths.
+    - limit (int): Maximum words taken from each list.
+    Returns: dict: Word to rank, 1 being the most common.
+    """
+    ranks = {}
+    for source in sources:
+        for rank, word in enumerate(read_word_list(source, limit), 1):
+            if rank < ranks.get(word, rank + 1):
+                ranks[word] = rank
+    return ranks
+
+def serialize_dictionary(ranks):
+    """
+    Encode ranked words in the dictionary file format.
+
+    Parameters: ranks (dict): Word to rank.
+    Returns: bytes: Header, words and table.
+    """
+    words = sorted((word.encode('utf-8'), rank) for word, rank in ranks.items())
+    blob, table = [], []
+    offset = DICTIONARY_HEADER.size
+    for word, rank in words:
+        table.append(WORD_ENTRY.pack(offset, len(word), rank))
+        blob.append(word)
+        offset += len(word)
+    max_length = max((len(word) for word in ranks), default=0)
+    return DICTIONARY_HEADER.pack(DICTIONARY_MAGIC, DICTIONARY_VERSION, len(words), max_length, offset) + b''.join(blob) + b''.join(table)
+
+def write_password_dictionary(path, ranks):
+    """
+    Write a password dictionary file atomically.
+
+    Parameters:
+    - path (str): Destination file.
+    - ranks (dict): Word to rank.
+    Returns: int: Number of words written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as dictionary_file:
+            dictionary_file.write(serialize_dictionary(ranks))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(ranks)
+
+@lru_cache(maxsize=None)
+def _bundled_dictionary():
+    return PasswordDictionary(serialize_dictionary(rank_words([BUNDLED_WORD_LIST])))
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+def get_password_dictionary():
+    """
+    Return the process-wide password dictionary, reopening it when the file has been rebuilt.
+    Without a PASSWORD_DICTIONARY_PATH file the bundled list of common passwords is used.
+
+    Returns: PasswordDictionary: The open dictionary.
+    """
+    global _dictionary
+    path = settings.PASSWORD_DICTIONARY_PATH
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return _bundled_dictionary()
+    with _dictionary_lock:
+        if _dictionary is None or _dictionary.path != path or _dictionary.mtime != mtime:
+            if _dictionary is not None:
+                _dictionary.close()
+            try:
+                _dictionary = PasswordDictionary.open(path)
+            except (OSError, ValueError):
+                _dictionary = None
+        return _dictionary or _bundled_dictionary()
+
+class KeyboardGraph:
+    """
+    Adjacency of the keys of one keyboard layout, built once at import.
+
+    Rows are given unshifted and shifted. On a slanted layout each row is offset
+    by half a key, so a key touches two keys in the row above and two below.
+    """
+
+    def __init__(self, name, rows, slanted):
+        self.name = name
+        self.positions = {}
+        self.shifted = frozenset(character for row in rows for character in (row[1] if len(row) > 1 else ''))
+        for row_number, row in enumerate(rows):
+            for variant in row:
+                for column, character in enumerate(variant):
+                    self.positions[character] = (row_number, column)
+        if slanted:
+            steps = ((0, -1), (0, 1), (-1, 0), (-1, 1), (1, -1), (1, 0))
+        else:
+            steps = ((row_step, column_step) for row_step in (-1, 0, 1) for column_step in (-1, 0, 1) if row_step or column_step)
+        steps = tuple(steps)
+        by_position = {}
+        for character, position in self.positions.items():
+            by_position.setdefault(position, []).append(character)
+        self.neighbors = {
+            character: frozenset(neighbor for row_step, column_step in steps
+                                 for neighbor in by_position.get((row + row_step, column + column_step), ()))
+            for character, (row, column) in self.positions.items()}
+        self.starting_positions = len(by_position)
+        self.average_degree = sum(len(self.neighbors[characters[0]]) for characters in by_position.values()) / len(by_position) / (2 if self.shifted else 1)
+
+    def direction(self, first, second):
+        (first_row, first_column), (second_row, second_column) = self.positions[first], self.positions[second]
+        return second_row - first_row, second_column - first_column
+
+KEYBOARD_GRAPHS = (
+    KeyboardGraph('qwerty', (("`1234567890-=", "~!@#$%^&*()_+"), ("qwertyuiop[]\\", "QWERTYUIOP{}|"),
+                             ("asdfghjkl;'", 'ASDFGHJKL:"'), ("zxcvbnm,./", "ZXCVBNM<>?")), slanted=True),
+    KeyboardGraph('keypad', (("789",), ("456",), ("123",), ("0",)), slanted=False),
+)
+
+# zxcvbn's scale: guesses below each threshold give scores 0..3, anything above scores 4.
+SCORE_THRESHOLDS = (1e3 + 5, 1e6 + 5, 1e8 + 5, 1e10 + 5)
+# Guesses per second of an offline attack against a slow hash, used for crack_time_seconds.
+OFFLINE_GUESSES_PER_SECOND = 1e4
+BRUTEFORCE_CARDINALITY = 10
+MIN_GUESSES_BEFORE_GROWING_SEQUENCE = 10000
+MIN_SUBMATCH_GUESSES = 50
+MAX_SCORED_LENGTH = 100
+REFERENCE_YEAR = date.today().year
+MIN_YEAR_SPACE = 20
+L33T_TABLE = str.maketrans({'4': 'a', '@': 'a', '8': 'b', '(': 'c', '3': 'e', '6': 'g', '9': 'g', '1': 'i', '!': 'i',
+                            '|': 'i', '0': 'o', '$': 's', '5': 's', '+': 't', '7': 't', '2': 'z'})
+YEAR_PATTERN = re.compile(r'19\d\d|20\d\d')
+REPEAT_PATTERN = re.compile(r'(.+?)\1+')
+
+# A match is a tuple (start, end, guesses, pattern, details); end is exclusive.
+
+def _uppercase_variations(token):
+    upper = sum(1 for character in token if character.isupper())
+    if not upper:
+        return 1
+    lower = sum(1 for character in token if character.islower())
+    if not lower or upper == 1 and (token[0].isupper() or token[-1].isupper()):
+        return 2
+    return sum(math.comb(upper + lower, count) for count in range(1, min(upper, lower) + 1))
+
+def _dictionary_matches(password, lowered, dictionary, user_inputs):
+    matches = []
+    l33t = lowered.translate(L33T_TABLE)
+    variants = [(lowered, None)]
+    if l33t != lowered:
+        variants.append((l33t, 'l33t'))
+    variants.append((lowered[::-1], 'reversed'))
+    length = len(password)
+    for text, variant in variants:
+        for start in range(length):
+            for end, rank in dictionary.matches_at(text, start):
+                if variant == 'reversed':
+                    start_index, end_index = length - end, length - start
+                    if lowered[start_index:end_index] == lowered[start_index:end_index][::-1]:
+                        continue
+                else:
+                    start_index, end_index = start, end
+                guesses = rank * _uppercase_variations(password[start_index:end_index])
+                if variant == 'l33t':
+                    substitutions = sum(1 for original, plain in zip(lowered[start:end], text[start:end]) if original != plain)
+                    if not substitutions:
+                        continue
+                    guesses *= 2 ** substitutions
+                elif variant == 'reversed':
+                    guesses *= 2
+                matches.append((start_index, end_index, guesses, 'dictionary', {'rank': rank, 'variant': variant}))
+    for rank, user_input in enumerate(user_inputs, 1):
+        start = lowered.find(user_input)
+        while start != -1:
+            matches.append((start, start + len(user_input), rank * _uppercase_variations(password[start:start + len(user_input)]),
+                            'dictionary', {'rank': rank, 'variant': 'user_input'}))
+            start = lowered.find(user_input, start + 1)
+    return matches
+
+def _spatial_guesses(graph, length, turns, shifted):
+    guesses = 0
+    for token_length in range(2, length + 1):
+        for turn_count in range(1, min(turns, token_length - 1) + 1):
+            guesses += math.comb(token_length - 1, turn_count - 1) * graph.starting_positions * graph.average_degree ** turn_count
+    if shifted:
+        unshifted = length - shifted
+        guesses *= 2 if not unshifted else sum(math.comb(shifted + unshifted, count) for count in range(1, min(shifted, unshifted) + 1))
+    return guesses
+
+def _spatial_matches(password):
+    matches = []
+    length = len(password)
+    for graph in KEYBOARD_GRAPHS:
+        neighbors, start = graph.neighbors, 0
+        while start < length - 2:
+            end, turns, direction = start + 1, 0, None
+            while end < length and password[end] in neighbors.get(password[end - 1], ()):
+                step = graph.direction(password[end - 1], password[end])
+                if step != direction:
+                    turns += 1
+                    direction = step
+                end += 1
+            if end - start >= 3:
+                shifted = sum(1 for character in password[start:end] if character in graph.shifted)
+                matches.append((start, end, _spatial_guesses(graph, end - start, turns, shifted), 'spatial', {'graph': graph.name, 'turns': turns}))
+            start = end if end - start >= 3 else start + 1
+    return matches
+
+def _sequence_matches(password):
+    matches = []
+    length = len(password)
+    start, delta = 0, None
+    for position in range(1, length + 1):
+        step = ord(password[position]) - ord(password[position - 1]) if position < length else None
+        if step == delta:
+            continue
+        token = password[start:position]
+        if delta and abs(delta) <= 5 and len(token) >= 3 and token.isalnum() and character_classes(token) in (LOWERCASE, UPPERCASE, DIGIT):
+            base = 4 if token[0] in 'aAzZ019' else 10 if token[0].isdigit() else 26
+            matches.append((start, position, base * len(token) * (2 if delta < 0 else 1), 'sequence', {'ascending': delta > 0}))
+        start, delta = position - 1, step
+    return matches
+
+def _repeat_matches(password, dictionary):
+    matches = []
+    for found in REPEAT_PATTERN.finditer(password):
+        base = found.group(1)
+        count = len(found.group(0)) // len(base)
+        base_guesses = 10 ** _most_guessable(base, dictionary, ())[0] if len(base) > 1 else BRUTEFORCE_CARDINALITY
+        matches.append((found.start(), found.end(), base_guesses * count, 'repeat', {'base': len(base), 'count': count}))
+    return matches
+
+def _year_matches(password):
+    return [(found.start(), found.end(), max(abs(int(found.group(0)) - REFERENCE_YEAR), MIN_YEAR_SPACE), 'year', {})
+            for found in YEAR_PATTERN.finditer(password)]
+
+def _most_guessable(password, dictionary, user_inputs):
+    """
+    Find the cheapest way to guess a password as a sequence of matches and brute-forced runs.
+
+    This is zxcvbn's search: a sequence of k parts costs k! * (product of the
+    parts' guesses) + MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (k - 1), and a
+    brute-forced run of n characters costs BRUTEFORCE_CARDINALITY ** n. Costs are
+    kept as log10 per (position, parts, ends in brute force) state.
+
+    Returns: tuple: (log10 of the guesses, sequence of (start, end, pattern, details)).
+    """
+    length = len(password)
+    if not length:
+        return 0.0, []
+    lowered = password.lower()
+    matches = (_dictionary_matches(password, lowered, dictionary, user_inputs) + _spatial_matches(password)
+               + _sequence_matches(password) + _repeat_matches(password, dictionary) + _year_matches(password))
+    by_start = [[] for _ in range(length)]
+    for match in matches:
+        start, end, guesses = match[:3]
+        if end - start < length:
+            guesses = max(guesses, MIN_SUBMATCH_GUESSES)
+        by_start[start].append((end, math.log10(guesses), match))
+
+    bruteforce_cost = math.log10(BRUTEFORCE_CARDINALITY)
+    # states[position][(parts, in_bruteforce)] = (log10 of the product of guesses, previous state, match)
+    states = [dict() for _ in range(length + 1)]
+    states[0][(0, False)] = (0.0, None, None)
+    for position in range(length):
+        for (parts, in_bruteforce), (cost, _, _) in states[position].items():
+            key = (parts if in_bruteforce else parts + 1, True)
+            if key not in states[position + 1] or cost + bruteforce_cost < states[position + 1][key][0]:
+                states[position + 1][key] = (cost + bruteforce_cost, (position, parts, in_bruteforce), None)
+            for end, match_cost, match in by_start[position]:
+                key = (parts + 1, False)
+                if key not in states[end] or cost + match_cost < states[end][key][0]:
+                    states[end][key] = (cost + match_cost, (position, parts, in_bruteforce), match)
+
+    best = None
+    for (parts, in_bruteforce), (cost, _, _) in states[length].items():
+        sequence_cost = math.lgamma(parts + 1) / math.log(10) + cost
+        growth_cost = (parts - 1) * math.log10(MIN_GUESSES_BEFORE_GROWING_SEQUENCE)
+        high, low = max(sequence_cost, growth_cost), min(sequence_cost, growth_cost)
+        guesses_log10 = high + math.log10(1 + 10 ** (low - high))
+        if best is None or guesses_log10 < best[0]:
+            best = (guesses_log10, (parts, in_bruteforce))
+
+    sequence, position, key = [], length, best[1]
+    while position:
+        _, previous, match = states[position][key]
+        if match is not None:
+            sequence.append((match[0], match[1], match[3], match[4]))
+        elif not sequence or sequence[-1][2] != 'bruteforce':
+            sequence.append((previous[0], position, 'bruteforce', {}))
+        else:
+            sequence[-1] = (previous[0], sequence[-1][1], 'bruteforce', {})
+        position, key = previous[0], previous[1:]
+    return best[0], sequence[::-1]
+
+def _feedback(score, sequence):
+    if score >= 3:
+        return {'warning': '', 'suggestions': []}
+    if not sequence:
+        return {'warning': '', 'suggestions': ["Use a few words, avoid common phrases.", "No need for symbols, digits, or uppercase letters."]}
+    suggestions = ["Add another word or two. Uncommon words are better."]
+    longest = max(sequence, key=lambda part: part[1] - part[0] if part[2] != 'bruteforce' else -1)
+    pattern, details, warning = longest[2], longest[3], ''
+    if pattern == 'dictionary':
+        if details['variant'] == 'user_input':
+            warning = "Passwords containing your username, email or the website name are easy to guess."
+        elif details['rank'] <= 10:
+            warning = "This is a top-10 common password."
+        elif details['rank'] <= 100:
+            warning = "This is a top-100 common password."
+        else:
+            warning = "This is similar to a commonly used password."
+        if details['variant'] == 'l33t':
+            suggestions.append("Predictable substitutions like '@' instead of 'a' don't help very much.")
+        elif details['variant'] == 'reversed':
+            suggestions.append("Reversed words aren't much harder to guess.")
+    elif pattern == 'spatial':
+        warning = "Straight rows of keys are easy to guess." if details['turns'] == 1 else "Short keyboard patterns are easy to guess."
+        suggestions.append("Use a longer keyboard pattern with more turns.")
+    elif pattern == 'repeat':
+        warning = 'Repeats like "aaa" are easy to guess.' if details['base'] == 1 else 'Repeats like "abcabcabc" are only slightly harder to guess than "abc".'
+        suggestions.append("Avoid repeated words and characters.")
+    elif pattern == 'sequence':
+        warning = "Sequences like abc or 6543 are easy to guess."
+        suggestions.append("Avoid sequences.")
+    elif pattern == 'year':
+        warning = "Recent years are easy to guess."
+        suggestions.append("Avoid recent years and years that are associated with you.")
+    return {'warning': warning, 'suggestions': suggestions}
+
+def estimate_strength(password, user_inputs=()):
+    """
+    Estimate how hard a password is to guess, zxcvbn style.
+
+    Common passwords (PASSWORD_DICTIONARY_PATH), their l33t and reversed forms,
+    keyboard walks, sequences, repeats and years are matched, and the cheapest
+    combination of matches and brute force gives the number of guesses.
+    Only the first MAX_SCORED_LENGTH characters are scored, which keeps the cost per call bounded.
+
+    Parameters:
+    - password (str): Password to score.
+    - user_inputs (iterable): Strings such as the username or email that should not appear in the password.
+    Returns: dict: score (0-4), guesses_log10, entropy_bits, crack_time_seconds, classes, meets_policy,
+    sequence (the matched patterns) and feedback (warning and suggestions).
+    """
+    classes = character_classes(password)
+    user_inputs = tuple(value.lower() for value in user_inputs if value and len(value) >= MIN_WORD_LENGTH)
+    guesses_log10, sequence = _most_guessable(password[:MAX_SCORED_LENGTH], get_password_dictionary(), user_inputs)
+    score = next((index for index, threshold in enumerate(SCORE_THRESHOLDS) if guesses_log10 < math.log10(threshold)), len(SCORE_THRESHOLDS))
+    return {
+        'score': score,
+        'guesses_log10': round(guesses_log10, 2),
+        'entropy_bits': round(guesses_log10 * math.log2(10), 1),
+        'crack_time_seconds': round(10 ** guesses_log10 / OFFLINE_GUESSES_PER_SECOND, 2),
+        'classes': [name for flag, name in CLASS_NAMES.items() if classes & flag],
+        'meets_policy': meets_policy(password, classes),
+        'sequence': [{'pattern': pattern, 'start': start, 'end': end} for start, end, pattern, _ in sequence],
+        'feedback': _feedback(score, sequence),
+    }
@@ -1,20 +1,55 @@
-import re
 import os
 import json
 import base64
-import random
 import string
+import secrets
 import hashlib
-import requests
-from Crypto.Cipher import AES
+from itertools import islice
+from functools import lru_cache
 from rest_framework import status
-from datetime import datetime, timedelta
+from django.utils import timezone
+from datetime import datetime, time, timedelta
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework.response import Response
+from django.http import JsonResponse
+from password_manager import settings
 from password_app.models import PasswordVault
+from password_manager.db_router import pick_read_alias, replica_alias_for
+from password_manager.sharding import merge_shards
+from password_manager.hibp import get_hibp_client, get_async_hibp_client, BreachCheckUnavailable
+from password_manager.strength import estimate_strength, meets_policy
+from password_manager.keyring import (CIPHERTEXT_V1_PREFIX,
+                                      CIPHERTEXT_V2_PREFIX,
+                                      LEGACY_KEY_ID,
+                                      current_key_id,
+                                      get_key)
 
-ENCRYPTION_KEY = base64.b64decode(os.environ.get('ENCRYPTION_KEY'))
-ENCRYPTION_NONCE = base64.b64decode(os.environ.get('ENCRYPTION_NONCE'))
+@lru_cache(maxsize=None)
+def encryption_settings():
+    """
+    Decode the encryption key and legacy nonce from the environment on first use.
+
+    Returns: tuple: (ENCRYPTION_KEY, ENCRYPTION_NONCE) as bytes.
+    """
+    return base64.b64decode(os.environ.get('ENCRYPTION_KEY')), base64.b64decode(os.environ.get('ENCRYPTION_NONCE'))
+
+@lru_cache(maxsize=None)
+def _ecb_cipher(key_id=LEGACY_KEY_ID):
+    from Crypto.Cipher import AES
+    return AES.new(get_key(key_id), AES.MODE_ECB)
+
+def __getattr__(name):
+    # ENCRYPTION_KEY and ENCRYPTION_NONCE stay importable from this module but are only decoded when first used.
+    if name == 'ENCRYPTION_KEY':
+        return encryption_settings()[0]
+    if name == 'ENCRYPTION_NONCE':
+        return encryption_settings()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+WEAK_PASSWORD_MESSAGE = "Please ensure your password meets the following criteria:\n\nMinimum length of 8 characters.\nCombination of uppercase and lowercase letters.\nAt least one number and one symbol.\nNo common passwords, keyboard patterns, sequences or the website name.\nConsider meeting these requirements or utilizing an autogenerated password for enhanced security."
+BREACH_CHECK_UNAVAILABLE_MESSAGE = "We are unable to verify your password against known security breaches right now. Please try again shortly."
+BREACHED_PASSWORD_MESSAGE = "Attention: Your password has been identified in security breaches. Please choose a different, secure password or opt for an automatically generated one for enhanced protection."
 
 def check_password_strength(raw_data):
     """
@@ -25,94 +60,397 @@ def check_password_strength(raw_data):
     Raises: Response: HTTP 400 error with error message if validation fails.
     """
     raw_password =raw_data['password']
-    if not len(raw_password) >= 8 and re.search('[A-Z]',raw_password) and re.search('[a-z]',raw_password) and re.search('[0-9]',raw_password) and re.search(r'[~`!@#\$%\^&\*\(\)_\-\+\=\[\]\{\}\:\;\.\?]',raw_password):
-        error_message = "Please ensure your password meets the following criteria:\n\nMinimum length of 8 characters.\nCombination of uppercase and lowercase letters.\nAt least one number and one symbol.\nConsider meeting these requirements or utilizing an autogenerated password for enhanced security."
-        return Response({"Error":error_message},status=status.HTTP_400_BAD_REQUEST)
+    if is_weak_password(raw_password, [raw_data.get('website_name')]):
+        return Response({"Error":WEAK_PASSWORD_MESSAGE},status=status.HTTP_400_BAD_REQUEST)
     
-    if pwned_password(raw_password):
-        error_message = "Attention: Your password has been identified in security breaches. Please choose a different, secure password or opt for an automatically generated one for enhanced protection." 
-        return Response({"Error":error_message},status=status.HTTP_400_BAD_REQUEST)
+    try:
+        breached = pwned_password(raw_password)
+    except BreachCheckUnavailable:
+        return Response({"Error":BREACH_CHECK_UNAVAILABLE_MESSAGE},status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if breached:
+        return Response({"Error":BREACHED_PASSWORD_MESSAGE},status=status.HTTP_400_BAD_REQUEST)
 
     encrypted_password = encrypt_password(raw_password)
     raw_data['password'] = encrypted_password
     return raw_data
 
+async def acheck_password_strength(raw_data):
+    """
+    Async version of check_password_strength for the async views; the breach check does not block the event loop.
+
+    Parameters: raw_data (dict): Dictionary containing the raw password.
+    Return: raw_data (dict): Dictionary with encrypted password if validation passes.
+    Raises: JsonResponse: HTTP 400 or 503 error with error message if validation fails.
+    """
+    raw_password = raw_data['password']
+    if is_weak_password(raw_password, [raw_data.get('website_name')]):
+        return JsonResponse({"Error": WEAK_PASSWORD_MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        breached = await apwned_password(raw_password)
+    except BreachCheckUnavailable:
+        return JsonResponse({"Error": BREACH_CHECK_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if breached:
+        return JsonResponse({"Error": BREACHED_PASSWORD_MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
+    raw_data['password'] = encrypt_password(raw_password)
+    return raw_data
+
+def is_weak_password(raw_password, user_inputs=()):
+    """
+    Check a password against the length and character-class policy and the minimum strength score.
+
+    Parameters:
+    - raw_password (str): Password to check.
+    - user_inputs (iterable): Strings the password should not be built from, such as the website name.
+    Returns: bool: True if the password does not meet the policy or scores below PASSWORD_MIN_SCORE.
+    """
+    return not meets_policy(raw_password) or estimate_strength(raw_password, user_inputs)['score'] < settings.PASSWORD_MIN_SCORE
+
 def pwned_password(password):
     """
     Check if a password has been exposed in known data breaches.
+    The local breach index is consulted first; the Pwned Passwords API is only
+    called when the index has no fresh data for the password's prefix.
+
+    Parameters: password (str): Password to check.
+    Returns: bool: True if password has been breached, False otherwise.
+    Raises: BreachCheckUnavailable: If the API is down and HIBP_FAIL_OPEN is disabled.
+    """
+    sha1_password = hashlib.sha1(password.encode('utf-8')).hexdigest().upper()
+    return get_hibp_client().is_breached(sha1_password)
+
+async def apwned_password(password):
+    """
+    Async version of pwned_password using the event loop's async HIBP client.
 
     Parameters: password (str): Password to check.
     Returns: bool: True if password has been breached, False otherwise.
+    Raises: BreachCheckUnavailable: If the API is down and HIBP_FAIL_OPEN is disabled.
     """
     sha1_password = hashlib.sha1(password.encode('utf-8')).hexdigest().upper()
-    prefix, suffix = sha1_password[:5], sha1_password[5:]
-    response = requests.get(f'https://api.pwnedpasswords.com/range/{prefix}')
-    if response.status_code == 200:
-        for line in response.text.splitlines():
-            if line.startswith(suffix):
-                return True
-    else:
-        print(f"Error: Unable to retrieve data from the Pwned Passwords API. Status code: {response.status_code}")
-    return False 
+    return await get_async_hibp_client().is_breached(sha1_password)
+
+def pwned_passwords(passwords):
+    """
+    Check many passwords against known data breaches, fetching each SHA-1 prefix at most once.
+
+    Parameters: passwords (list): Passwords to check.
+    Returns: list: True if breached, False if not, None if the check was unavailable, in input order.
+    """
+    sha1_passwords = [hashlib.sha1(password.encode('utf-8')).hexdigest().upper() for password in passwords]
+    results = get_hibp_client().check_many(sha1_passwords)
+    return [results[sha1_password] for sha1_password in sha1_passwords]
+
+GENERATOR_ALPHABETS = (('lowercase', string.ascii_lowercase), ('uppercase', string.ascii_uppercase),
+                       ('digits', string.digits), ('symbols', string.punctuation))
+AMBIGUOUS_CHARACTERS = frozenset('Il1|O0o`\'"')
+_system_random = secrets.SystemRandom()
+
+def generate_passwords(count=1, length=None, lowercase=True, uppercase=True, digits=True, symbols=True, exclude_ambiguous=False):
+    """
+    Generate passwords with the operating system's CSPRNG.
+    Each password holds at least one character of every enabled class; the remaining
+    characters are drawn from all enabled classes and the result is shuffled.
+
+    Parameters:
+    - count (int): Number of passwords to generate.
+    - length (int): Characters per password, PASSWORD_GENERATOR_LENGTH by default.
+    - lowercase, uppercase, digits, symbols (bool): Character classes to use.
+    - exclude_ambiguous (bool): Leave out characters that are easily confused, such as 'l', '1' and 'O'.
+    Returns: list: Generated passwords.
+    Raises: ValueError: If no class is enabled or the length is out of range.
+    """
+    length = settings.PASSWORD_GENERATOR_LENGTH if length is None else length
+    enabled = {'lowercase': lowercase, 'uppercase': uppercase, 'digits': digits, 'symbols': symbols}
+    alphabets = [''.join(character for character in alphabet if not (exclude_ambiguous and character in AMBIGUOUS_CHARACTERS))
+                 for name, alphabet in GENERATOR_ALPHABETS if enabled[name]]
+    if not alphabets:
+        raise ValueError("At least one character class must be enabled.")
+    if not len(alphabets) <= length <= settings.PASSWORD_GENERATOR_MAX_LENGTH:
+        raise ValueError(f"length must be between {len(alphabets)} and {settings.PASSWORD_GENERATOR_MAX_LENGTH}.")
+    combined = ''.join(alphabets)
+    passwords = []
+    for _ in range(count):
+        characters = [secrets.choice(alphabet) for alphabet in alphabets]
+        characters += [secrets.choice(combined) for _ in range(length - len(alphabets))]
+        _system_random.shuffle(characters)
+        passwords.append(''.join(characters))
+    return passwords
 
 def generate_password():
-    """Generates a random password.
+    """Generates a random password with the default generator settings.
      
     Returns: str: Randomly generated password."""
-    choices = [string.ascii_letters[:26], string.ascii_letters[26:], string.digits, string.punctuation]
-    final_pass = ''
-    while len(final_pass)<12:
-        for choice in choices:
-            final_pass += random.choice(choice)
-    return final_pass
+    return generate_passwords(1)[0]
+
+# Ciphertexts written with a per-record nonce are stored as CIPHERTEXT_V2_PREFIX + '<key id>$' + base64(nonce + ciphertext).
+# Values under key 0 keep the CIPHERTEXT_V1_PREFIX + base64(nonce + ciphertext) format, which processes
+# that predate the keyring can still read. Anything without a prefix is a legacy value encrypted under
+# key 0 and the global ENCRYPTION_NONCE.
+RECORD_NONCE_SIZE = 12
+BLOCK_SIZE = 16
+
+def _counter_blocks(nonce, block_count, buffer, offset):
+    """Write the CTR counter blocks (nonce followed by a big-endian block counter) for one record into buffer."""
+    counter_size = BLOCK_SIZE - len(nonce)
+    for block in range(block_count):
+        position = offset + block * BLOCK_SIZE
+        buffer[position:position + len(nonce)] = nonce
+        buffer[position + len(nonce):position + BLOCK_SIZE] = block.to_bytes(counter_size, 'big')
+
+def _ctr_transform(records, key_id=LEGACY_KEY_ID):
+    """
+    Run AES-CTR over many records with one key schedule and a single keystream call.
+
+    The counter blocks of every record are laid out in one preallocated buffer and
+    encrypted in a single ECB call; the record data is copied once into a matching
+    block-aligned buffer and XORed against the keystream in place. This produces
+    the same output as AES.new(key, AES.MODE_CTR, nonce=nonce) per record.
+
+    Parameters:
+    - records (list): (nonce, data) pairs, data being any bytes-like object.
+    - key_id (int): Id of the keyring key to use.
+    Returns: tuple: (buffer, offsets) where the transformed data of record i starts at offsets[i] in buffer.
+    """
+    offsets = []
+    total_blocks = 0
+    for nonce, data in records:
+        offsets.append(total_blocks * BLOCK_SIZE)
+        total_blocks += -(-len(data) // BLOCK_SIZE)
+
+    counters = bytearray(total_blocks * BLOCK_SIZE)
+    buffer = bytearray(total_blocks * BLOCK_SIZE)
+    for (nonce, data), offset in zip(records, offsets):
+        _counter_blocks(nonce, -(-len(data) // BLOCK_SIZE), counters, offset)
+        buffer[offset:offset + len(data)] = data
+    if total_blocks:
+        from Crypto.Util.strxor import strxor
+        _ecb_cipher(key_id).encrypt(counters, output=counters)
+        strxor(buffer, counters, output=buffer)
+    return buffer, offsets
+
+def encrypt_passwords(passwords, key_id=None):
+    """
+    Encrypt a batch of passwords, each under its own random nonce.
+
+    Parameters:
+    - passwords (list): Plain-text passwords.
+    - key_id (int): Id of the keyring key to encrypt with, by default ENCRYPTION_KEY_ID.
+    Returns: list: Encrypted passwords in the versioned per-record nonce format.
+    """
+    key_id = current_key_id() if key_id is None else key_id
+    prefix = CIPHERTEXT_V1_PREFIX if key_id == LEGACY_KEY_ID else f"{CIPHERTEXT_V2_PREFIX}{key_id}$"
+    encoded = [password.encode('utf-8') for password in passwords]
+    nonces = memoryview(os.urandom(RECORD_NONCE_SIZE * len(encoded)))
+    records = [(nonces[i * RECORD_NONCE_SIZE:(i + 1) * RECORD_NONCE_SIZE], data) for i, data in enumerate(encoded)]
+    buffer, offsets = _ctr_transform(records, key_id)
+
+    # Lay out nonce + ciphertext for every record in one buffer so each value is base64 encoded straight from a view.
+    stored = bytearray(sum(RECORD_NONCE_SIZE + len(data) for data in encoded))
+    stored_view, buffer_view = memoryview(stored), memoryview(buffer)
+    encrypted_passwords = []
+    position = 0
+    for (nonce, data), offset in zip(records, offsets):
+        end = position + RECORD_NONCE_SIZE + len(data)
+        stored_view[position:position + RECORD_NONCE_SIZE] = nonce
+        stored_view[position + RECORD_NONCE_SIZE:end] = buffer_view[offset:offset + len(data)]
+        encrypted_passwords.append(prefix + base64.b64encode(stored_view[position:end]).decode('ascii'))
+        position = end
+    return encrypted_passwords
+
+def decrypt_passwords(base64_passwords):
+    """
+    Decrypt a batch of stored passwords in any of the stored formats, under any key in the keyring.
+    Values are grouped by key so each key still decrypts its values in a single keystream call.
+
+    Parameters: base64_passwords (list): Encrypted passwords as stored in PasswordVault.
+    Returns: list: Decrypted passwords, in the same order.
+    """
+    groups = {}
+    for index, base64_password in enumerate(base64_passwords):
+        if base64_password.startswith(CIPHERTEXT_V2_PREFIX):
+            key_id, _, encoded = base64_password[len(CIPHERTEXT_V2_PREFIX):].partition('$')
+            key_id = int(key_id)
+        elif base64_password.startswith(CIPHERTEXT_V1_PREFIX):
+            key_id, encoded = LEGACY_KEY_ID, base64_password[len(CIPHERTEXT_V1_PREFIX):]
+        else:
+            groups.setdefault(LEGACY_KEY_ID, []).append((index, encryption_settings()[1], base64.b64decode(base64_password)))
+            continue
+        raw = memoryview(base64.b64decode(encoded))
+        groups.setdefault(key_id, []).append((index, raw[:RECORD_NONCE_SIZE], raw[RECORD_NONCE_SIZE:]))
+
+    passwords = [None] * len(base64_passwords)
+    for key_id, records in groups.items():
+        buffer, offsets = _ctr_transform([(nonce, data) for index, nonce, data in records], key_id)
+        for (index, nonce, data), offset in zip(records, offsets):
+            passwords[index] = str(buffer[offset:offset + len(data)], 'utf-8')
+    return passwords
 
 def encrypt_password(password):
     """
-    Encrypt a password using AES encryption.
+    Encrypt a password using AES encryption with a random per-record nonce.
 
     Parameters: password (str): Password to encrypt.
     Returns: str: Encrypted password.
     """
-    cipher = AES.new(ENCRYPTION_KEY, AES.MODE_CTR, nonce=ENCRYPTION_NONCE)    # Create the AES cipher in CTR mode
-    encrypted_password = cipher.encrypt(password.encode('utf-8'))   # Encrypt the password
-    encrypted_password_b64 = base64.b64encode(encrypted_password).decode('utf-8')   # Base64 encode the encrypted password and nonce for storage
-    return encrypted_password_b64
+    return encrypt_passwords([password])[0]
 
 def decrypt_password(base64_password):
     """
     Decrypt a password using AES decryption.
 
-    Parameters: base64_password (str): Base64 encoded password.
+    Parameters: base64_password (str): Encrypted password, in either the per-record nonce or the legacy format.
     Returns: str: Decrypted password.
     """
-    encrypted_password = base64.b64decode(base64_password)       # Base64 decode the encrypted password and nonce
-    cipher = AES.new(ENCRYPTION_KEY, AES.MODE_CTR, nonce=ENCRYPTION_NONCE)     # Create the AES cipher in CTR mode
+    return decrypt_passwords([base64_password])[0]
+
+def legacy_decrypt_password(base64_password):
+    """
+    Decrypt a legacy password one AES-CTR cipher at a time, as done before batch decryption.
+    Kept as the reference implementation for benchmarks.
+
+    Parameters: base64_password (str): Base64 encoded password encrypted under the global nonce.
+    Returns: str: Decrypted password.
+    """
+    from Crypto.Cipher import AES
+    encryption_key, encryption_nonce = encryption_settings()
+    encrypted_password = base64.b64decode(base64_password)       # Base64 decode the encrypted password
+    cipher = AES.new(encryption_key, AES.MODE_CTR, nonce=encryption_nonce)     # Create the AES cipher in CTR mode
     decrypted_password = cipher.decrypt(encrypted_password).decode('utf-8')     # Decrypt the password
     return decrypted_password
 
+def decrypt_vault_chunks(entries, chunk_size, username=None):
+    """
+    Read vault rows through a server-side iterator and decrypt them chunk by chunk.
+
+    Parameters:
+    - entries (QuerySet): PasswordVault values() queryset.
+    - chunk_size (int): Number of rows fetched and decrypted at a time.
+    - username (str): Optional username added to every row as 'user'.
+    Yields: list: Rows of the next chunk with decrypted passwords.
+    """
+    rows = entries.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        passwords = decrypt_passwords([data['password'] for data in chunk])
+        for data, password in zip(chunk, passwords):
+            if username is not None:
+                data['user'] = username
+            data['password'] = password
+        yield chunk
+
+def stream_vault_entries(entries, output_format='json', chunk_size=500, username=None):
+    """
+    Encode vault rows for a StreamingHttpResponse while holding only one chunk in memory.
+
+    Parameters:
+    - entries (QuerySet): PasswordVault values() queryset.
+    - output_format (str): 'json' for a single JSON array, 'ndjson' for one JSON object per line.
+    - chunk_size (int): Number of rows fetched and decrypted at a time.
+    - username (str): Optional username added to every row as 'user'.
+    Yields: str: Encoded pieces of the response body.
+    """
+    ndjson = output_format == 'ndjson'
+    if not ndjson:
+        yield '['
+    separator = ''
+    for chunk in decrypt_vault_chunks(entries, chunk_size, username):
+        rows = [json.dumps(data, cls=DjangoJSONEncoder) for data in chunk]
+        if ndjson:
+            yield '\n'.join(rows) + '\n'
+        else:
+            yield separator + ','.join(rows)
+            separator = ','
+    if not ndjson:
+        yield ']'
+
+async def adecrypt_vault_chunks(entries, chunk_size, username=None):
+    """
+    Async version of decrypt_vault_chunks. Chunks are read with keyset queries on the entry id,
+    so `entries` must be ordered by id and include it.
+
+    Parameters:
+    - entries (QuerySet): PasswordVault values() queryset ordered by id.
+    - chunk_size (int): Number of rows fetched and decrypted at a time.
+    - username (str): Optional username added to every row as 'user'.
+    Yields: list: Rows of the next chunk with decrypted passwords.
+    """
+    last_id = 0
+    while True:
+        chunk = [data async for data in entries.filter(id__gt=last_id)[:chunk_size]]
+        if not chunk:
+            return
+        last_id = chunk[-1]['id']
+        passwords = decrypt_passwords([data['password'] for data in chunk])
+        for data, password in zip(chunk, passwords):
+            if username is not None:
+                data['user'] = username
+            data['password'] = password
+        yield chunk
+
+async def astream_vault_entries(entries, output_format='json', chunk_size=500, username=None):
+    """Async version of stream_vault_entries, for a StreamingHttpResponse served under ASGI."""
+    ndjson = output_format == 'ndjson'
+    if not ndjson:
+        yield '['
+    separator = ''
+    async for chunk in adecrypt_vault_chunks(entries, chunk_size, username):
+        rows = [json.dumps(data, cls=DjangoJSONEncoder) for data in chunk]
+        if ndjson:
+            yield '\n'.join(rows) + '\n'
+        else:
+            yield separator + ','.join(rows)
+            separator = ','
+    if not ndjson:
+        yield ']'
+
+def _report_rows(rows, datetime_field):
+    """
+    Yield report rows one at a time, formatting the timestamp column.
+
+    Parameters:
+    - rows (iterable): Rows to export, read from a server-side iterator.
+    - datetime_field (str): Name of the timestamp column to format.
+    """
+    for data in rows:
+        data[datetime_field] = data[datetime_field].strftime("%Y-%m-%d %H:%M:%S")
+        yield data
+
+def _vault_report_rows(alias, start):
+    """Yield the entries of one shard created since start, in id order, with their owner's username as 'user'."""
+    entries = (PasswordVault.objects.using(replica_alias_for(alias)).filter(created_at__gte = start).order_by('id')
+               .values('id', 'user_id', 'website_name', 'website_url', 'password', 'created_at')
+               .iterator(chunk_size=settings.REPORT_CHUNK_SIZE))
+    while chunk := list(islice(entries, settings.REPORT_CHUNK_SIZE)):
+        # Users stay on the primary when the vault is sharded, so usernames are looked up per chunk rather than joined.
+        usernames = dict(User.objects.using(pick_read_alias()).filter(id__in={data['user_id'] for data in chunk}).values_list('id', 'username'))
+        for data in chunk:
+            data['user'] = usernames.get(data.pop('user_id'))
+            yield data
+
 def weekly_password_report():
     """
-    Generate a weekly report of password data.
+    Generate a weekly report of password data, read from a replica when there is one. When the
+    vault is sharded, the shards are read in parallel and merged in id order.
 
-    Returns: tuple: Tuple containing JSON string of data, last week's date, and today's date.
+    Returns: tuple: Tuple containing an iterator over the rows, last week's date, and today's date.
     """
     today = datetime.now().date()
     last_week = today-timedelta(days=7)
-    last_week_data = list(PasswordVault.objects.filter(created_at__date__gte = last_week).values())
-    for data in last_week_data:
-        data['created_at'] = data['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-    return json.dumps(last_week_data), last_week, today
+    # Compare against the start of the day rather than casting created_at to a date, so the created_at index is used.
+    start = timezone.make_aware(datetime.combine(last_week, time.min))
+    last_week_data = merge_shards(lambda alias: _vault_report_rows(alias, start), key=lambda data: data['id'])
+    return _report_rows(last_week_data, 'created_at'), last_week, today
 
 def weekly_user_report():
     """
-    Generate a weekly report of user data.
+    Generate a weekly report of user data, read from a replica when there is one.
 
-    Returns: tuple: Tuple containing JSON string of data, last week's date, and today's date.
+    Returns: tuple: Tuple containing an iterator over the rows, last week's date, and today's date.
     """
     today = datetime.now().date()
     last_week = today-timedelta(days=7)
-    last_week_user_data = list(User.objects.filter(date_joined__date__gte = last_week).values())
-    for data in last_week_user_data:
-        data['date_joined'] = data['date_joined'].strftime("%Y-%m-%d %H:%M:%S")
-    return json.dumps(last_week_user_data), last_week, today
-
+    start = timezone.make_aware(datetime.combine(last_week, time.min))
+    last_week_user_data = User.objects.using(pick_read_alias()).filter(date_joined__gte = start).order_by('id').values()
+    return _report_rows(last_week_user_data.iterator(chunk_size=settings.REPORT_CHUNK_SIZE), 'date_joined'), last_week, today
@@ -0,0 +1,36 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse
+from rest_framework import status
+from password_manager.async_views import AsyncAPIView
+from user_app.tasks import send_welcome_mail
+from password_app.outbox import enqueue
+from .serializers import RegisterSerializer
+from .throttling import RegisterIPThrottle
+
+def register(serializer):
+    """Create the user of a validated serializer and queue the welcome email in the same transaction."""
+    with transaction.atomic():
+        instance = serializer.save()
+        enqueue(send_welcome_mail, (instance.username, instance.email), dedupe_key=f"welcome:{instance.id}")
+
+class AsyncRegisterUser(AsyncAPIView):
+    """
+    Async version of RegisterUser, selected with ASYNC_VIEWS=True.
+    Validation, password hashing, the insert and the outbox row of the welcome email run
+    in a worker thread, so the event loop never waits on the database or the broker.
+    Throttling and the hashing slots apply as in RegisterUser.
+
+    Permission: Anyone can register without any restrictions.
+    Parameter: request (HttpRequest): HTTP request object containing registration data.
+    Return: JSON response indicating registration success or failure.
+    """
+    authentication_required = False
+    throttle_classes = [RegisterIPThrottle]
+
+    async def post(self, request):
+        serializer = RegisterSerializer(data=request.data)
+        if await sync_to_async(serializer.is_valid)():
+            await sync_to_async(register)(serializer)
+            return JsonResponse({"message": "User registration successful. Please log in with your credentials."}, status=status.HTTP_201_CREATED)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,124 @@
+import time
+import threading
+from collections import OrderedDict
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from password_manager import settings
+from password_manager.db_router import bind_vault_owner
+
+# Fields loaded for the request user. Anything else (password, names, dates) is
+# deferred and fetched only if a view actually reads it.
+USER_FIELDS = ('id', 'username', 'email', 'is_active')
+
+class UserCache:
+    """
+    Thread-safe, per-process LRU cache of user rows with a time-to-live.
+
+    Entries are dropped explicitly on user save or delete (see user_app.models)
+    and otherwise expire after `ttl` seconds, which bounds how long another
+    process may keep using a snapshot taken before a change it did not see.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the cached row of a user, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, row = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return row
+
+    def set(self, user_id, row):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the token's user id through the per-process
+    user cache, so a warm request runs no User query at all.
+
+    The request user is built from the cached (id, username, email, is_active)
+    row as a deferred User instance; saving it only writes those fields. The user
+    becomes the vault owner of the request, whose shard the vault queries go to.
+    """
+
+    def get_user(self, validated_token):
+        """
+        Return the user a validated token belongs to.
+
+        Parameters: validated_token (Token): Token validated by simplejwt.
+        Returns: User: Active user with the fields in USER_FIELDS loaded.
+        Raises: InvalidToken: If the token has no user id. AuthenticationFailed: If the user does not exist or is inactive.
+        """
+        user_id = self._user_id(validated_token)
+        row = user_cache.get(user_id)
+        if row is None:
+            row = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*USER_FIELDS).first()
+            if row is not None:
+                user_cache.set(user_id, row)
+        return self._user_from_row(row)
+
+    async def aauthenticate(self, request):
+        """
+        Async version of authenticate() for the async views; a cache miss reads the user with the async ORM.
+
+        Parameters: request (HttpRequest): Incoming request.
+        Returns: tuple | None: (user, validated_token), or None if the request carries no token.
+        Raises: InvalidToken, AuthenticationFailed: As authenticate().
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        user_id = self._user_id(validated_token)
+        row = user_cache.get(user_id)
+        if row is None:
+            row = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*USER_FIELDS).afirst()
+            if row is not None:
+                user_cache.set(user_id, row)
+        return self._user_from_row(row), validated_token
+
+    @staticmethod
+    def _user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    @staticmethod
+    def _user_from_row(row):
+        if row is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        user = User.from_db('default', USER_FIELDS, row)
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        bind_vault_owner(user.id)
+        return user
@@ -0,0 +1,75 @@
+import threading
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework.exceptions import Throttled
+from password_manager import settings
+
+class HashingBusy(Throttled):
+    """Raised when no hashing slot frees up within PASSWORD_HASHING_QUEUE_TIMEOUT; rendered as HTTP 429."""
+    default_detail = "Too many logins are being processed. Please retry shortly."
+
+class HashingSlots:
+    """
+    Bound on the password hashes computed at once by this process.
+
+    A hash waits at most `timeout` seconds for one of the `slots`; if none frees up it
+    fails with HashingBusy instead of queueing, so a flood of logins gets quick 429s and
+    leaves the remaining CPU to the vault endpoints.
+    """
+
+    def __init__(self, slots, timeout):
+        self.slots = slots
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self._stats = {'hashed': 0, 'rejected': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def _count(self, name, change=1):
+        with self._lock:
+            self._stats[name] += change
+            self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._stats['in_flight'])
+
+    def stats(self):
+        """Return a snapshot of the hashed, rejected, in_flight and max_in_flight counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def run(self, function, *args):
+        """
+        Call function(*args) in a hashing slot.
+
+        Raises: HashingBusy: If every slot stayed taken for `timeout` seconds.
+        """
+        if not self._semaphore.acquire(timeout=self.timeout):
+            self._count('rejected')
+            raise HashingBusy(wait=self.timeout or 1)
+        self._count('in_flight')
+        try:
+            return function(*args)
+        finally:
+            self._count('in_flight', -1)
+            self._count('hashed')
+            self._semaphore.release()
+
+_slots = None
+_slots_lock = threading.Lock()
+
+def hashing_slots():
+    """Return the process-wide HashingSlots, created from the settings on first use."""
+    global _slots
+    if _slots is None:
+        with _slots_lock:
+            if _slots is None:
+                _slots = HashingSlots(settings.PASSWORD_HASHING_CONCURRENCY, settings.PASSWORD_HASHING_QUEUE_TIMEOUT)
+    return _slots
+
+class BoundedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 hasher, run under hashing_slots().
+
+    The algorithm name and the stored format are unchanged, so existing password hashes
+    keep verifying. verify() and the dummy hash ModelBackend computes for unknown usernames
+    both go through encode(), so every hash of a login or registration takes a slot.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return hashing_slots().run(super().encode, password, salt, iterations)
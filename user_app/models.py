@@ -1 +1,11 @@
 from django.db import models
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from user_app.authentication import user_cache
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached row of a user whenever it is saved (profile change, deactivation, password change) or deleted."""
+    user_cache.invalidate(instance.pk)
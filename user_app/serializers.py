@@ -1,5 +1,11 @@
+from django.db import transaction
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
 
 class RegisterSerializer(serializers.ModelSerializer):
     confirm_password = serializers.CharField(style = {"input_style":"password"}, write_only = True)
@@ -43,4 +49,34 @@ class LoginSerializer(serializers.ModelSerializer):
         model = User
         fields = ['username', 'password']
 
+class RotatingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Exchange a refresh token for a new access token and a new refresh token.
 
+    The presented refresh token is blacklisted in the same step, and of two requests
+    presenting the same token only the one that blacklists it gets new tokens, so a
+    stolen refresh token can be used at most once. The user must still exist and be
+    active. No password is hashed.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if not User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).exists():
+            raise AuthenticationFailed("User not found or inactive", code="user_inactive")
+
+        with transaction.atomic():
+            outstanding, _ = OutstandingToken.objects.get_or_create(
+                jti=refresh.payload[api_settings.JTI_CLAIM],
+                defaults={'user_id': user_id, 'token': str(refresh), 'expires_at': datetime_from_epoch(refresh.payload['exp'])})
+            _, blacklisted = BlacklistedToken.objects.get_or_create(token=outstanding)
+        if not blacklisted:
+            raise InvalidToken("Token is blacklisted")
+
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        # Recorded as outstanding, so the user's refresh tokens can all be listed and blacklisted.
+        OutstandingToken.objects.create(user_id=user_id, jti=refresh.payload[api_settings.JTI_CLAIM], token=str(refresh),
+                                        created_at=refresh.current_time, expires_at=datetime_from_epoch(refresh.payload['exp']))
+        return {'access': str(refresh.access_token), 'refresh': str(refresh)}
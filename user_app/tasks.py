@@ -1,11 +1,14 @@
-import os
 from celery import shared_task
-from firebase_admin import storage
 from password_manager import settings
 from django.core.mail import send_mail
+from django.core.management import call_command
 from password_manager.utility import weekly_user_report
+from password_manager.storage import export_ndjson_gzip, StorageUnavailable
+from password_manager.celery import MAIL_RETRY_POLICY, RETRY_BACKOFF
+from password_manager.change_export import export_changes, user_changes
+from password_app.outbox import OutboxTask
 
-@shared_task
+@shared_task(base=OutboxTask, ignore_result=True, **MAIL_RETRY_POLICY)
 def send_welcome_mail(user, target_mail):
     """
     Task to send a welcome email to a new user.
@@ -30,18 +33,36 @@ def send_welcome_mail(user, target_mail):
     return f"Welcome mail sent to {user}"
 
 
-@shared_task
+@shared_task(autoretry_for=(StorageUnavailable,), **RETRY_BACKOFF)
 def upload_user_data_weekly_to_firebase():
     """
-    This task uploads weekly user data to firebase storage. It generates a JSON file 
-    containing user data from previous week and uploads it to specified bucket in firebase storage.
+    This task uploads weekly user data to firebase storage. It streams user data from the previous
+    week as gzip-compressed NDJSON to the configured storage backend.
 
     Return: A message indicating successful upload of the weekly data to Firebase Storage.
     """
-    bucket = storage.bucket(os.environ.get('BUCKET_NAME'))
     last_week_user_data ,last_week,today = weekly_user_report()
-    destination = f"weekly_data/user_data_{last_week.strftime("%Y-%m-%d")}_to_{today.strftime("%Y-%m-%d")}.json"
-    blob = bucket.blob(destination)
-    blob.upload_from_string(last_week_user_data, content_type='text/plain')
+    destination = f"weekly_data/user_data_{last_week.strftime("%Y-%m-%d")}_to_{today.strftime("%Y-%m-%d")}.ndjson.gz"
+    count = export_ndjson_gzip(last_week_user_data, destination)
 
-    return f"Weekly user data is uploaded to Firebase Storage: {destination}"
\ No newline at end of file
+    return f"Weekly user data is uploaded to Firebase Storage: {destination} ({count} rows)"
+
+@shared_task(autoretry_for=(StorageUnavailable,), **RETRY_BACKOFF)
+def export_user_changes():
+    """
+    This task exports the users who joined since the last successful run as gzip-compressed
+    NDJSON files partitioned by day. It is safe to retry: a failed run is repeated over exactly
+    the same window.
+
+    Return: A message indicating how many users were exported.
+    """
+    exported, destinations = export_changes('user', user_changes)
+    return f"Exported {exported} user changes to {len(destinations)} file(s)"
+
+@shared_task(ignore_result=True)
+def flush_expired_tokens():
+    """
+    This task deletes expired refresh tokens from the outstanding token list and the blacklist,
+    which otherwise grow by a row on every login and two on every refresh.
+    """
+    call_command('flushexpiredtokens')
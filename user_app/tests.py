@@ -1,3 +1,92 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.test import TestCase, Client, RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from password_app.benchmarks import BENCHMARK_HOST, local_services
+from user_app.authentication import USER_FIELDS, CachedJWTAuthentication, user_cache
 
-# Create your tests here.
+class CachedAuthenticationQueryTests(TestCase):
+    """Authenticated requests whose user is already in the per-process user cache run no User query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'Str0ng!Passw0rd#1')
+
+    def setUp(self):
+        self.enterContext(local_services())
+        caches['vault'].clear()
+        user_cache.clear()
+        self.token = AccessToken.for_user(self.user)
+        self.api = Client(HTTP_HOST=BENCHMARK_HOST, HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def test_first_request_loads_the_user_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get('/api/password/generate').status_code, 200)
+        self.assertEqual(user_cache.get(self.user.id), (self.user.id, 'alice', 'alice@example.com', True))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api.get('/api/password/generate').status_code, 200)
+
+    def test_warm_requests_only_query_the_vault(self):
+        self.api.get('/api/password/generate')
+        # Vault version, then the page.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.api.get('/api/password/all').status_code, 200)
+        # The page is now cached as well.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get('/api/password/all').status_code, 200)
+        # An up-to-date client only reads the vault version.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get('/api/password/changes', {'since': 0}).json()['changed'], [])
+
+    def test_async_authentication_uses_the_cache(self):
+        request = RequestFactory().get('/api/password/all', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        authenticate = async_to_sync(CachedJWTAuthentication().aauthenticate)
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(request)[0].id, self.user.id)
+        with self.assertNumQueries(0):
+            user, _ = authenticate(request)
+        self.assertEqual(user.get_deferred_fields(), {field.attname for field in User._meta.concrete_fields} - set(USER_FIELDS))
+
+class UserCacheInvalidationTests(TestCase):
+    """The post_save and post_delete receivers of user_app.models drop the cached row."""
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'Str0ng!Passw0rd#1')
+        self.row = (self.user.id, 'alice', 'alice@example.com', True)
+        user_cache.set(self.user.id, self.row)
+
+    def assertDropped(self):
+        self.assertIsNone(user_cache.get(self.user.id))
+
+    def test_profile_change(self):
+        self.user.email = 'alice@example.org'
+        self.user.save(update_fields=['email'])
+        self.assertDropped()
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertDropped()
+
+    def test_password_change(self):
+        self.user.set_password('N3w!Passw0rd#2')
+        self.user.save()
+        self.assertDropped()
+
+    def test_delete(self):
+        self.user.delete()
+        self.assertDropped()
+
+    def test_other_users_stay_cached(self):
+        User.objects.create_user('bob', 'bob@example.com', 'Str0ng!Passw0rd#1')
+        self.assertEqual(user_cache.get(self.user.id), self.row)
+
+    def test_deactivated_user_is_refused_on_the_next_request(self):
+        api = Client(HTTP_HOST=BENCHMARK_HOST, HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        with local_services():
+            self.assertEqual(api.get('/api/password/generate').status_code, 200)
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+            self.assertEqual(api.get('/api/password/generate').status_code, 401)
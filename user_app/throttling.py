@@ -0,0 +1,91 @@
+import time
+import hashlib
+import threading
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+from password_manager import settings
+
+_DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_rate(rate):
+    """
+    Parse a bucket rate such as '10/m': the bucket holds 10 tokens and refills completely in a minute.
+
+    Parameters: rate (str): '<tokens>/<s|m|h|d>', or an empty string for no limit.
+    Returns: tuple: (capacity, tokens added per second), or None for no limit.
+    """
+    if not rate:
+        return None
+    tokens, _, period = rate.partition('/')
+    capacity = int(tokens)
+    return capacity, capacity / _DURATIONS[period[0].lower()]
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle kept in the 'throttle' cache.
+
+    Every request takes one token from the bucket of its key; the bucket holds `rate`
+    tokens and refills at a steady pace, so short bursts pass while a sustained flood
+    is cut down to the refill rate. A request finding the bucket empty is refused with
+    HTTP 429 and a Retry-After header before the view does any work.
+
+    The bucket is read and written back without a cross-process lock, like REST framework's
+    own throttles: with several processes sharing Redis a burst may get a few extra tokens.
+    Subclasses set `scope`, `rate_setting` and get_key().
+    """
+    scope = None
+    rate_setting = None
+    _lock = threading.Lock()
+
+    def get_key(self, request):
+        """Return the value the bucket is kept for, or None to let the request through."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        rate = parse_rate(getattr(settings, self.rate_setting))
+        key = self.get_key(request) if settings.LOGIN_THROTTLE_ENABLED and rate else None
+        if key is None:
+            return True
+        capacity, refill = rate
+        cache = caches['throttle']
+        cache_key = f"{self.scope}:{key}"
+        with self._lock:
+            now = time.time()
+            tokens, updated = cache.get(cache_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            if tokens < 1:
+                self.wait_seconds = (1 - tokens) / refill
+                return False
+            # Kept until the bucket would be full again; an expired bucket is a full one.
+            cache.set(cache_key, (tokens - 1, now), timeout=int(capacity / refill) + 1)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+class LoginIPThrottle(TokenBucketThrottle):
+    """Login attempts per client address, LOGIN_THROTTLE_IP_RATE."""
+    scope = 'login-ip'
+    rate_setting = 'LOGIN_THROTTLE_IP_RATE'
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+class LoginUsernameThrottle(TokenBucketThrottle):
+    """Login attempts per username, LOGIN_THROTTLE_USERNAME_RATE, whatever address they come from."""
+    scope = 'login-username'
+    rate_setting = 'LOGIN_THROTTLE_USERNAME_RATE'
+
+    def get_key(self, request):
+        username = str(request.data.get('username') or '').strip().lower() if hasattr(request.data, 'get') else ''
+        # Hashed, so any username makes a valid cache key.
+        return hashlib.sha256(username.encode('utf-8')).hexdigest() if username else None
+
+class RegisterIPThrottle(TokenBucketThrottle):
+    """Registrations per client address, REGISTER_THROTTLE_IP_RATE."""
+    scope = 'register-ip'
+    rate_setting = 'REGISTER_THROTTLE_IP_RATE'
+
+    def get_key(self, request):
+        return self.get_ident(request)
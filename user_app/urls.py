@@ -1,7 +1,14 @@
 from django.urls import path
-from .views import RegisterUser, LoginUser
+from password_manager import settings
+from .async_views import AsyncRegisterUser
+from .views import RegisterUser, LoginUser, RefreshAccessToken, LogoutUser
+
+if settings.ASYNC_VIEWS:
+    RegisterUser = AsyncRegisterUser
 
 urlpatterns = [
     path('register',RegisterUser.as_view()),
     path('login',LoginUser.as_view()),
+    path('token/refresh',RefreshAccessToken.as_view()),
+    path('logout',LogoutUser.as_view()),
 ]
\ No newline at end of file
@@ -1,48 +1,61 @@
 from rest_framework import views
 from rest_framework import status
-from .serializers import RegisterSerializer
+from .serializers import RegisterSerializer, RotatingTokenRefreshSerializer
+from django.db import transaction
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
 from user_app.tasks import send_welcome_mail
+from password_app.outbox import enqueue
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView, TokenBlacklistView
+from .throttling import LoginIPThrottle, LoginUsernameThrottle, RegisterIPThrottle
 
 class RegisterUser(views.APIView):
     """
     This view allows users to register within the password manager application. 
     Upon receiving a POST request with user registration data, it validates the data, creates a new user account.
     Once registration is successful, the user receives a welcome email and a JSON response confirming the successful registration.
+    The welcome email is written to the task outbox in the transaction that creates the user, so the request does not wait on the broker.
     If registration fails due to invalid data, the view returns an HTTP 400 response with error details.
+    Registrations are throttled per client address, and password hashing waits for a free hashing slot (user_app.hashers).
 
-    Raises: HTTP 400 Bad Request: If the provided registration data is invalid and HTTP 500 Internal Server Error: If there is an unexpected error during registration.
+    Raises: HTTP 400 Bad Request: If the provided registration data is invalid, HTTP 429 Too Many Requests: If the address
+    is over REGISTER_THROTTLE_IP_RATE or no hashing slot is free, and HTTP 500 Internal Server Error: If there is an unexpected error during registration.
     Permission Classes: AllowAny: Anyone can register without any restrictions.
     Parameter: request (Request): HTTP request object containing registration data.
     Return: JSON response indicating registration success or failure.
     """
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterIPThrottle]
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
             user = serializer.validated_data['username']
             mail = serializer.validated_data['email']
-            send_welcome_mail.delay(user,mail)
+            with transaction.atomic():
+                instance = serializer.save()
+                enqueue(send_welcome_mail, (user, mail), dedupe_key=f"welcome:{instance.id}")
             return Response({"message": "User registration successful. Please log in with your credentials."}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 class LoginUser(views.APIView):
     """
     This view processes POST requests containing user credentials (username and password).
-    If valid credentials are provided, it authenticates the user and generates an access token.
-    The access token is returned in the response, granting the user access to protected endpoints.
+    If valid credentials are provided, it authenticates the user and generates an access token and a refresh token.
+    The access token grants the user access to protected endpoints; once it expires, the refresh token gets a new
+    one from /api/user/token/refresh without sending the password again.
     If authentication fails, an error response is returned with a message indicating invalid credentials.
+    Attempts are throttled per client address and per username before any password is hashed, and hashing
+    waits for a free hashing slot (user_app.hashers), so a flood of logins is answered with quick HTTP 429s.
 
-    Permission Classes: AllowAny: Anyone can attempt to log in without restrictions.
+    Permission Classes: AllowAny: Anyone can attempt to log in, within LOGIN_THROTTLE_IP_RATE and LOGIN_THROTTLE_USERNAME_RATE.
     Parameter: request (Request): HTTP request object containing user login credentials.
-    Return: JSON response containing the access token if authentication is successful.
+    Return: JSON response containing the access and refresh tokens if authentication is successful.
     Otherwise, returns an error message indicating invalid credentials.
     """
     permission_classes = [AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
     def post(self, request):
         username = request.data.get('username')
         password = request.data.get('password')
@@ -56,6 +69,31 @@ class LoginUser(views.APIView):
             refresh = RefreshToken.for_user(user)
             return Response({
                 'access': str(refresh.access_token),
+                'refresh': str(refresh),
             }, status=status.HTTP_200_OK)
         else:
-            return Response({"message": "Invalid login credentials"}, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+            return Response({"message": "Invalid login credentials"}, status=status.HTTP_401_UNAUTHORIZED)
+
+class RefreshAccessToken(TokenRefreshView):
+    """
+    This view processes POST requests containing a refresh token issued by the login or a previous refresh.
+    It returns a new access token and a new refresh token; the presented refresh token is blacklisted and
+    cannot be used again. No password is checked, so renewing a session costs no password hash.
+
+    Permission Classes: None: The refresh token is the credential.
+    Parameter: request (Request): HTTP request object containing the refresh token.
+    Return: JSON response containing the new access and refresh tokens.
+    Raises: HTTP 401 Unauthorized: If the refresh token is expired, invalid or already used, or the user is inactive.
+    """
+    serializer_class = RotatingTokenRefreshSerializer
+
+class LogoutUser(TokenBlacklistView):
+    """
+    This view processes POST requests containing a refresh token and blacklists it, ending the session.
+    The access token issued with it stays valid until it expires, at most ACCESS_TOKEN_LIFETIME.
+
+    Permission Classes: None: The refresh token is the credential.
+    Parameter: request (Request): HTTP request object containing the refresh token.
+    Return: Empty JSON response.
+    Raises: HTTP 401 Unauthorized: If the refresh token is expired or invalid.
+    """